@@ -0,0 +1,258 @@
+"""
+Benchmarks of the simulator and of the exploration loop.
+
+    python benchmark.py                       # every benchmark, saved to benchmark.json
+    python benchmark.py -o bench/abc123.json  # other output file
+    python benchmark.py -k cache plru         # benchmarks whose name contains one of the words
+    python benchmark.py --compare old.json    # also prints the ratio to the timings of a previous run
+
+Workloads and seeds are fixed, so the timings of two commits are comparable. Every benchmark has a
+setup, not timed, returning the function that is timed: ``repeat`` times ``number`` calls. The JSON
+output holds the environment (commit, python, numpy, platform) and, for every benchmark, the min,
+median and mean time of one call in seconds and ``ops``, the number of operations of one call.
+Most of the few minutes of a full run go to filling the History of history_store[100000].
+"""
+import argparse
+import contextlib
+import datetime
+import functools
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+import numpy as np
+
+from simulator.sim3 import CACHE_LEVELS, PLRU, DDRMemory, DDRMemoryController, MemoryRequest, SimContext
+from exploration.env.func import Env, Experiment
+from exploration.history import History
+from exploration.imgep.OptimizationPolicy import OptimizationPolicykNN
+from exploration.imgep.goal_generator import GoalGenerator
+from exploration.imgep.imgep import IMGEP
+from exploration.seed import make_rngs, numpy_rng, python_rng
+from codegeneration import generate_instruction_sequence
+
+SEED = 0
+CYCLES = 300
+NUM_ADDR = 100
+L2_CONF = {'size': 512, 'line_size': 4, 'assoc': 16}
+
+BENCHMARKS = {} # name: (setup, number, repeat, ops)
+def benchmark(name:str, number:int = 1, repeat:int = 5, ops:int = 1):
+    def register(setup):
+        BENCHMARKS[name] = (setup, number, repeat, ops)
+        return setup
+    return register
+
+# ---------------------------------------------------------
+# Fixed workloads
+# ---------------------------------------------------------
+def parameters(n:int)->list[dict]:
+    """n program pairs, the same at every run"""
+    rng = python_rng(SEED)
+    return [{'core0':generate_instruction_sequence(None, 60, 0, 50, rng=rng),
+             'core1':generate_instruction_sequence(None, 60, 49, 100, rng=rng)} for _ in range(n)]
+
+@functools.lru_cache(maxsize=None)
+def observations(n:int = 64)->list[dict]:
+    """Samples ready for ``History.store``, the observations of ``parameters(n)``"""
+    E = Env(CYCLES, num_addr=NUM_ADDR, seed=SEED)
+    return [{'program':parameter}|E(parameter) for parameter in parameters(n)]
+
+def addresses(n:int)->list[int]:
+    return numpy_rng(SEED).integers(0, 200, size=n).tolist()
+
+# ---------------------------------------------------------
+# Simulator
+# ---------------------------------------------------------
+def cache_benchmark(impl:str, op:str, n:int = 10000):
+    def setup():
+        level = CACHE_LEVELS[impl]('L2', 'anycore', context=SimContext(trace='contention'), **L2_CONF)
+        addrs = addresses(n)
+        def run():
+            level.reset()
+            if op=='read':
+                for addr in addrs:
+                    level.read(addr, lambda: None, origine=0)
+            else:
+                for addr in addrs:
+                    level.write(addr, origine=0)
+        return run
+    return setup
+
+for impl in CACHE_LEVELS:
+    for op in ['read', 'write']:
+        benchmark(f'cache_{op}[{impl}]', ops=10000)(cache_benchmark(impl, op))
+
+@benchmark('plru', ops=10000)
+def plru():
+    tree = PLRU(16)
+    ways = numpy_rng(SEED).integers(0, 16, size=10000).tolist()
+    def run():
+        tree.reset()
+        for way in ways:
+            tree.get_victim()
+            tree.update_on_access(way)
+    return run
+
+@benchmark('ddr_controller_tick', ops=200)
+def ddr_controller_tick():
+    ddr = DDRMemory(num_banks=4)
+    controller = DDRMemoryController(ddr, context=SimContext(trace='contention'), num_rows=NUM_ADDR//16+1)
+    rng = numpy_rng(SEED)
+    requests = list(zip(rng.integers(0, NUM_ADDR, size=200).tolist(), rng.integers(0, 2, size=200).tolist()))
+    def run():
+        ddr.reset()
+        controller.reset()
+        for time_, (addr, op) in enumerate(requests):
+            controller.request(MemoryRequest(time_ % 2, time_, ['read', 'write'][op], addr))
+        while controller.pending:
+            controller.tick()
+            ddr.tick()
+    return run
+
+def experiment_benchmark(event_driven:bool):
+    def setup():
+        parameter = parameters(1)[0]
+        program = Experiment(num_banks=4, num_addr=NUM_ADDR, trace='contention')
+        def run():
+            program.reset(np.random.default_rng(SEED))
+            program.load_instr(parameter['core0'], parameter['core1'])
+            program.simulate(CYCLES, event_driven=event_driven, stop_when_quiescent=event_driven)
+        return run
+    return setup
+
+benchmark('experiment_simulate[event_driven]', number=10)(experiment_benchmark(True))
+benchmark('experiment_simulate[tick]', number=10)(experiment_benchmark(False))
+
+@benchmark('env_call', number=10)
+def env_call():
+    E = Env(CYCLES, num_addr=NUM_ADDR, seed=SEED)
+    parameter = parameters(1)[0]
+    return lambda: E(parameter)
+
+# ---------------------------------------------------------
+# Exploration
+# ---------------------------------------------------------
+def history(n:int, capacity:int)->History:
+    """History holding n samples cycling through ``observations()``"""
+    samples = observations()
+    H = History(env=Env(CYCLES, num_addr=NUM_ADDR), capacity=capacity)
+    for i in range(n):
+        H.store(samples[i % len(samples)])
+    return H
+
+def history_store_benchmark(size:int, n:int = 100, repeat:int = 5):
+    def setup():
+        # every call stores n more samples, from size to size + (repeat+1)*n with the warm up
+        H = history(size, size+(repeat+1)*n)
+        samples = observations()
+        def run():
+            for i in range(n):
+                H.store(samples[(H.j+i) % len(samples)])
+        return run
+    return setup
+
+for size in [1000, 10000, 100000]:
+    benchmark(f'history_store[{size}]', ops=100)(history_store_benchmark(size))
+
+def policy_benchmark(batch:bool):
+    def setup():
+        H = history(1000, 1000)
+        Pi = OptimizationPolicykNN(k=2, rng=python_rng(SEED), min_address_core0=0, max_address_core0=50,
+                                   min_address_core1=49, max_address_core1=100)
+        G = GoalGenerator(rng=numpy_rng(SEED))
+        modules = numpy_rng(SEED).integers(0, H.as_tab().shape[1]+1, size=100).tolist()
+        goals = G.sample(H, modules)
+        def run():
+            if batch:
+                Pi.propose_batch(goals, H, modules)
+            else:
+                for goal, module in zip(goals, modules):
+                    Pi(goal, H, module)
+        return run
+    return setup
+
+benchmark('policy_call', ops=100)(policy_benchmark(False))
+benchmark('policy_propose_batch', ops=100)(policy_benchmark(True))
+
+@benchmark('goal_sample', ops=100)
+def goal_sample():
+    H = history(1000, 1000)
+    G = GoalGenerator(rng=numpy_rng(SEED))
+    modules = numpy_rng(SEED).integers(0, H.as_tab().shape[1]+1, size=100).tolist()
+    return lambda: G.sample(H, modules)
+
+@benchmark('imgep_short', repeat=3)
+def imgep_short():
+    def run():
+        rngs = make_rngs(SEED)
+        E = Env(CYCLES, num_addr=NUM_ADDR, seed=rngs['env'])
+        H = History(env=E, capacity=300)
+        Pi = OptimizationPolicykNN(k=2, rng=rngs['policy'], min_address_core0=0, max_address_core0=50,
+                                   min_address_core1=49, max_address_core1=100)
+        imgep = IMGEP(300, 100, E, H, GoalGenerator(rng=rngs['goal']), Pi,
+                      min_address_core0=0, max_address_core0=50, min_address_core1=49, max_address_core1=100,
+                      rng=rngs['imgep'], random_rng=rngs['random'])
+        with contextlib.redirect_stdout(io.StringIO()):
+            imgep()
+    return run
+
+# ---------------------------------------------------------
+# Runner
+# ---------------------------------------------------------
+def commit()->str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def measure(setup, number:int, repeat:int)->list[float]:
+    run = setup()
+    run() # warm up
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        times.append((time.perf_counter()-start)/number)
+    return times
+
+def run_benchmarks(names:list[str])->dict:
+    results = {}
+    for name in names:
+        setup, number, repeat, ops = BENCHMARKS[name]
+        times = measure(setup, number, repeat)
+        results[name] = {'min':min(times), 'median':statistics.median(times), 'mean':statistics.mean(times),
+                         'number':number, 'repeat':repeat, 'ops':ops}
+        print(f"{name:40s} {results[name]['min']*1e3:10.3f} ms  ({results[name]['min']/ops*1e6:.2f} us/op)", flush=True)
+    return results
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-o', '--output', default='benchmark.json')
+    parser.add_argument('-k', nargs='*', default=None, help='only the benchmarks whose name contains one of these words')
+    parser.add_argument('--compare', default=None, help='JSON output of a previous run')
+    args = parser.parse_args()
+
+    names = [name for name in BENCHMARKS if not args.k or any(word in name for word in args.k)]
+    results = run_benchmarks(names)
+    output = {'commit':commit(),
+              'date':datetime.datetime.now().isoformat(timespec='seconds'),
+              'python':platform.python_version(),
+              'numpy':np.__version__,
+              'platform':platform.platform(),
+              'results':results}
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['results']
+        print(f"\nratio to {args.compare} (min time, < 1 is faster)")
+        for name in names:
+            if name in previous:
+                print(f"{name:40s} {results[name]['min']/previous[name]['min']:6.2f}")
@@ -1,7 +1,9 @@
 import random
 import copy
+import numpy as np
+from simulator.program import EMPTY, OPCODES
 
-def generate_instruction_sequence(num_instructions=None, max_cycle=60, min_address=0,max_address=19):
+def generate_instruction_sequence(num_instructions=None, max_cycle=60, min_address=0,max_address=19,packed=False,rng=random):
     """
     Generate a random dictionary of assembly instructions.
     
@@ -9,12 +11,14 @@ def generate_instruction_sequence(num_instructions=None, max_cycle=60, min_addre
         num_instructions: Number of instructions to generate (if None, random between 1-20)
         max_cycle: Maximum cycle number (default: 60)
         max_address: Maximum memory address (default: 19)
+        packed: Returns the packed form of simulator/program.py instead of a dictionary
+        rng: random.Random used for the draws (default: the global random module)
     
     Returns:
-        Dictionary with format {cycle: (type, address)}
+        Dictionary with format {cycle: (type, address)}, or array of max_cycle+1 slots if packed
     """
     if num_instructions is None:
-        num_instructions = random.randint(1, 20)  # Random number of instructions
+        num_instructions = rng.randint(1, 20)  # Random number of instructions
     
     # Ensure we don't generate more instructions than available cycles
     num_instructions = min(num_instructions, max_cycle + 1)
@@ -23,11 +27,20 @@ def generate_instruction_sequence(num_instructions=None, max_cycle=60, min_addre
     instruction_types = ['read', 'write']
     
     # Generate unique cycle numbers
-    cycles = random.sample(range(0, max_cycle + 1), num_instructions)
+    cycles = rng.sample(range(0, max_cycle + 1), num_instructions)
+    
+    if packed:
+        # same random draws as the dictionary form
+        instructions = np.full(max_cycle + 1, EMPTY, dtype=np.int32)
+        for cycle in cycles:
+            instr_type = rng.choice(instruction_types)
+            address = rng.randint(min_address, max_address)
+            instructions[cycle] = (address << 1) | OPCODES[instr_type]
+        return instructions
     
     for cycle in cycles:
-        instr_type = random.choice(instruction_types)
-        address = random.randint(min_address, max_address)
+        instr_type = rng.choice(instruction_types)
+        address = rng.randint(min_address, max_address)
         instructions[cycle] = (instr_type, address)
     
     return dict(sorted(instructions.items()))
@@ -0,0 +1,84 @@
+import numpy as np
+
+
+class Bounds:
+    """
+    Running minimum and maximum per dimension of a stream of vectors, updated in O(dimension) and read in O(1).
+    mode: str.
+    - 'all': bounds of every value since the start
+    - 'window': bounds of the values of the last ``window`` updates
+    - 'decay': bounds that expand at once to a new value and otherwise contract towards the latest values,
+      low <- x + decay*(low-x) when low < x (and the same for high), so that old extremes fade away
+    An update holds one value, the bounds of a group of values, or nothing (an update without value only
+    counts in the window). ``low`` and ``high`` are None until the first value.
+    """
+    MODES = ['all', 'window', 'decay']
+    def __init__(self, mode:str = 'all', window:int = 1000, decay:float = 0.999):
+        assert mode in self.MODES, f'unknown bounds mode {mode}'
+        assert window>=1, 'empty window'
+        self.mode = mode
+        self.window = window
+        self.decay = decay
+        self.low = None
+        self.high = None
+        # Sliding window as a queue of two stacks: the newest updates in back (with their running bounds),
+        # the oldest in front as suffix bounds, the front starting at front_start
+        self.size = 0
+        self.back_low = []
+        self.back_high = []
+        self.back_min = None
+        self.back_max = None
+        self.front_min = None
+        self.front_max = None
+        self.front_start = 0
+    def update(self, low, high=None):
+        """Adds a value (``low``), the bounds of a group of values (``low``, ``high``) or, with None, no value"""
+        if low is not None:
+            low = np.array(low, dtype=np.float64).reshape(-1)
+            high = low if high is None else np.array(high, dtype=np.float64).reshape(-1)
+        if self.mode=='window':
+            self.push(low, high)
+        elif low is None:
+            return
+        elif self.low is None:
+            self.low, self.high = low.copy(), high.copy()
+        elif self.mode=='all':
+            np.minimum(self.low, low, out=self.low)
+            np.maximum(self.high, high, out=self.high)
+        else:
+            self.low = np.minimum(low, low + self.decay*(self.low - low))
+            self.high = np.maximum(high, high + self.decay*(self.high - high))
+    def push(self, low, high):
+        if low is None:
+            if self.back_min is None and self.front_min is None:
+                return # nothing to bound yet, the updates without value are neutral
+            low = np.full_like(self.back_min if self.back_min is not None else self.front_min[0], np.inf)
+            high = -low
+        if self.back_min is None:
+            self.back_min, self.back_max = low.copy(), high.copy()
+        else:
+            np.minimum(self.back_min, low, out=self.back_min)
+            np.maximum(self.back_max, high, out=self.back_max)
+        self.back_low.append(low)
+        self.back_high.append(high)
+        self.size+=1
+        if self.size>self.window:
+            self.pop()
+        low, high = self.back_min, self.back_max
+        if self.front_min is not None and self.front_start<len(self.front_min):
+            low = np.minimum(low, self.front_min[self.front_start])
+            high = np.maximum(high, self.front_max[self.front_start])
+        # a window without any value keeps the last bounds
+        if np.all(low<=high):
+            self.low, self.high = low.copy(), high.copy()
+    def pop(self):
+        if self.front_min is None or self.front_start==len(self.front_min):
+            # the back stack becomes the front one, with the bounds of every suffix
+            self.front_min = np.minimum.accumulate(np.array(self.back_low)[::-1], axis=0)[::-1]
+            self.front_max = np.maximum.accumulate(np.array(self.back_high)[::-1], axis=0)[::-1]
+            self.front_start = 0
+            self.back_low, self.back_high = [], []
+            self.back_min = np.full_like(self.back_min, np.inf)
+            self.back_max = np.full_like(self.back_max, -np.inf)
+        self.front_start+=1
+        self.size-=1
@@ -0,0 +1,71 @@
+import copy
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+from simulator.program import unpack
+
+
+def canonical_program(inst)->tuple:
+    """Canonical form of an instruction sequence {cycle: (op, addr)} or packed, the empty dict and [] are the same program"""
+    return tuple(sorted((int(cycle), (op, int(addr))) for cycle, (op, addr) in unpack(inst).items()))
+
+def program_key(core0_inst, core1_inst, config:tuple)->str:
+    """Content address of one simulation: the two instruction sequences plus the simulator configuration"""
+    canonical = (canonical_program(core0_inst), canonical_program(core1_inst), tuple(config))
+    return hashlib.sha1(repr(canonical).encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Content-addressed cache of simulation outputs with LRU eviction.
+    maxsize: int. Number of results kept in memory.
+    path: str. Optional directory used as a persistent backing store, one pickle per result.
+    It is never evicted and should be deleted whenever the simulator itself changes.
+    """
+    def __init__(self, maxsize:int = 100000, path:str = None):
+        self.maxsize = maxsize
+        self.path = path
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if self.path:
+            os.makedirs(self.path, exist_ok=True)
+    def __len__(self):
+        return len(self.data)
+    def __contains__(self, key:str):
+        return key in self.data or (self.path is not None and os.path.isfile(self.file(key)))
+    def file(self, key:str)->str:
+        return os.path.join(self.path, f"{key}.pkl")
+    def get(self, key:str):
+        """Returns a copy of the stored output, or None on a miss"""
+        if key in self.data:
+            self.data.move_to_end(key)
+        elif self.path and os.path.isfile(self.file(key)):
+            with open(self.file(key), "rb") as f:
+                self.data[key] = pickle.load(f)
+            self.evict()
+        else:
+            self.misses+=1
+            return None
+        self.hits+=1
+        return copy.deepcopy(self.data[key])
+    def put(self, key:str, value):
+        self.data[key] = copy.deepcopy(value)
+        self.data.move_to_end(key)
+        self.evict()
+        if self.path and not os.path.isfile(self.file(key)):
+            # write then rename, so that concurrent readers never see a partial file
+            tmp = f"{self.file(key)}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                pickle.dump(value, f)
+            os.replace(tmp, self.file(key))
+    def evict(self):
+        while len(self.data)>self.maxsize:
+            self.data.popitem(last=False)
+    def stats(self)->dict:
+        total = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits/total if total else 0,
+                'size': len(self.data)}
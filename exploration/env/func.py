@@ -2,21 +2,40 @@ import sys
 sys.path.append('../../')
 from simulator.sim3 import *
 import numpy as np
+import copy
+import bisect
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from exploration.env.cache import ResultCache, program_key
+from simulator.batch import BatchExperiment
+from simulator.program import unpack
+from exploration.seed import as_seed_sequence, simulation_seed
 
 
-# Simulation setup
-random.seed(0) # For reproducible results
-
 class Experiment:
+    """
+    rng: numpy.random.Generator. Source of the interconnect jitter, one seeded with 0 by default.
+    l1_conf, l2_conf: dict. Cache configurations, passed to ``cache_level`` ('impl' selects the
+    implementation of the cache levels, see simulator/sim3.py).
+    trace: str. Trace level of ``TRACE_LEVELS``. The shared resource events of the outputs
+    need 'contention', 'full' also keeps the access logs and the stages of the controller requests.
+    """
     def __init__(self,
         num_banks = 4,
         num_addr = 20,
+        rng = None,
+        l1_conf = None,
+        l2_conf = None,
+        trace = 'full',
             ):
         self.num_banks = num_banks
         self.num_addr  = num_addr 
         self.num_rows = self.num_addr//16+1
         self.ddr_stats = {}
-        self.time_values = {'core0':[0],'core1':[0]}
+        self.time_max = {'core0':0,'core1':0}
+        # Clock and logs of this simulation, shared by all the components
+        self.context = SimContext(trace=trace)
         # Instantiate the DDR Memory
         self.ddr_memory_physical = DDRMemory(num_banks=self.num_banks)
 
@@ -29,18 +48,22 @@ class Experiment:
             tRC=30,     # Row Cycle time
             tWR=15,     # Write Recovery Time
             tRTP=8,     # Read to Precharge Time
-            tCCD=4)     # Column to Column Delay
+            tCCD=4,     # Column to Column Delay
+            context=self.context,
+            num_rows=self.num_rows)
 
         # Create interconnect, connected to the DDR Memory Controller
-        self.interconnect = Interconnect(self.ddr_controller, delay=5, bandwidth=4)
+        self.interconnect = Interconnect(self.ddr_controller, delay=5, bandwidth=4, rng=rng)
 
         # Create cache configurations
-        l1_conf = {'size': 32, 'line_size': 4, 'assoc': 2}
-        l2_conf = {'size': 512, 'line_size': 4, 'assoc': 16}
+        l1_conf = l1_conf or {'size': 32, 'line_size': 4, 'assoc': 2, 'impl': 'object'}
+        l2_conf = l2_conf or {'size': 512, 'line_size': 4, 'assoc': 16, 'impl': 'object'}
+        self.l1_conf = l1_conf
+        self.l2_conf = l2_conf
 
 
         # Create shared L2 Cache, connected to the Interconnect
-        shared_l2 = CacheLevel("L2", core_id="anycore", memory=self.interconnect, **l2_conf)
+        shared_l2 = cache_level("L2", core_id="anycore", memory=self.interconnect, context=self.context, **l2_conf)
 
         self.num_set = shared_l2.num_sets 
         self._index = shared_l2._index
@@ -52,39 +75,157 @@ class Experiment:
         self.mem_core1 = MultiLevelCache(1, l1_conf, shared_l2)
 
         # Create cores
-        self.core0 = Core(0, self.mem_core0)
-        self.core1 = Core(1, self.mem_core1)
-    def add_time_values(self,values:dict[list]):
-        if type(values['core0'])!=type(None):
-                self.time_values['core0'].append(values['core0'])
-        if type(values['core1'])!=type(None):
-                self.time_values['core1'].append(values['core1'])
+        self.core0 = Core(0, self.mem_core0, context=self.context)
+        self.core1 = Core(1, self.mem_core1, context=self.context)
+        self.shared_l2 = shared_l2
+    def reset(self, rng=None, trace=None):
+        """Puts the experiment back in the state of a new one, keeping the allocated hierarchy.
+        rng: numpy.random.Generator. New source of the interconnect jitter, the current one is kept if None.
+        trace: str. New trace level, the current one is kept if None.
+        """
+        if trace is not None:
+            self.context.set_trace(trace)
+        self.ddr_stats = {}
+        self.time_max = {'core0':0,'core1':0}
+        # a new log list, the outputs of previous simulations keep theirs
+        self.context.clear_history()
+        self.ddr_memory_physical.reset()
+        self.ddr_controller.reset()
+        self.interconnect.reset(rng)
+        self.shared_l2.reset()
+        self.mem_core0.l1.reset()
+        self.mem_core1.l1.reset()
+        self.core0.reset()
+        self.core1.reset()
+        return self
+    def snapshot(self)->dict:
+        """State of the whole hierarchy at the current cycle (caches, PLRU, interconnect and jitter,
+        controller queues, DDR banks, statistics and logs), to be given back to ``restore``.
+        The queued requests hold callbacks into this hierarchy, so a snapshot can only be restored
+        into the experiment that took it."""
+        return {'experiment':self,
+                'cycle':self.context.global_cycle,
+                'context':self.context.snapshot(),
+                'ddr':self.ddr_memory_physical.snapshot(),
+                'controller':self.ddr_controller.snapshot(),
+                'interconnect':self.interconnect.snapshot(),
+                'l2':self.shared_l2.snapshot(),
+                'l1':(self.mem_core0.l1.snapshot(), self.mem_core1.l1.snapshot()),
+                'cores':(self.core0.snapshot(), self.core1.snapshot()),
+                'time_max':dict(self.time_max),
+                'ddr_stats':{key:list(value) for key, value in self.ddr_stats.items()}}
+    def restore(self, state:dict):
+        """Puts the hierarchy back in the state of ``snapshot``, the instructions are kept.
+        ``simulate(..., resume=True)`` then continues from the cycle of the snapshot."""
+        assert state['experiment'] is self, 'a snapshot is restored into the experiment that took it'
+        self.context.restore(state['context'])
+        self.ddr_memory_physical.restore(state['ddr'])
+        self.ddr_controller.restore(state['controller'])
+        self.interconnect.restore(state['interconnect'])
+        self.shared_l2.restore(state['l2'])
+        self.mem_core0.l1.restore(state['l1'][0])
+        self.mem_core1.l1.restore(state['l1'][1])
+        self.core0.restore(state['cores'][0])
+        self.core1.restore(state['cores'][1])
+        self.time_max = dict(state['time_max'])
+        self.ddr_stats = {key:list(value) for key, value in state['ddr_stats'].items()}
+        return self
     def add_values(self,ddr_stats):
+        # outputs of the controller, kept for inspection at the 'full' trace level only
         if type(ddr_stats)!=type(None):
             for key in ddr_stats:
-                if key in self.ddr_stats and key!='completion_time':
+                if key in self.ddr_stats:
                     self.ddr_stats[key].append(ddr_stats[key])
-                elif key =='completion_time':
-                    self.time_values[['core0','core1'][ddr_stats['core']]].append(ddr_stats[key])
                 else:
                     self.ddr_stats[key]=[ddr_stats[key]]
     def load_instr(self, core0_inst, core1_inst):
         self.core0.load_instr(core0_inst)
         self.core1.load_instr(core1_inst)
 
-    def simulate(self, cycles,display_stats=False):
-        GlobalVar.global_cycle = 0
-        for cycle in range(cycles):
+    def next_event(self, cycle):
+        """Earliest cycle >= ``cycle`` at which some component has work to do, None if none has"""
+        events = [self.core0.next_event(cycle),
+                  self.core1.next_event(cycle),
+                  self.interconnect.next_event(),
+                  self.ddr_controller.next_event(),
+                  self.ddr_memory_physical.next_event()]
+        events = [event for event in events if event is not None]
+        return min(events) if events else None
+    def quiescent(self, cycle):
+        """True once nothing can change the results anymore: no core can issue an access at or after ``cycle``
+        and the interconnect, controller and DDR queues are empty. A core still waiting for a read, or
+        stalled behind one, is only woken up by a completion coming from these queues."""
+        return (self.core0.next_event(cycle) is None
+                and self.core1.next_event(cycle) is None
+                and not self.interconnect.queue
+                and not self.ddr_controller.pending
+                and not self.ddr_controller.scheduled_ddr_requests
+                and not self.ddr_memory_physical.scheduled_completions)
+    def fast_forward(self, cycle, target):
+        """Moves every clock from ``cycle`` to ``target`` without ticking the components"""
+        skip = target - cycle
+        self.interconnect.cycle += skip
+        self.ddr_controller.cycle += skip
+        self.ddr_memory_physical.cycle += skip
+        self.context.global_cycle += skip
+        return target
+    def simulate(self, cycles,display_stats=False,event_driven=False,stop_when_quiescent=False,verify=False,snapshot_cycles=(),resume=False):
+        """
+        Runs the simulation for ``cycles`` cycles.
+        With ``event_driven`` the clock jumps from one event to the next instead of
+        ticking every component on idle cycles. Both modes give identical results.
+        With ``stop_when_quiescent`` the simulation stops as soon as ``quiescent`` holds,
+        the clocks being moved to ``cycles`` as if the remaining idle cycles had been run.
+        With ``verify`` the results are asserted to be those of a full cycle by cycle run
+        of the same programs with the same jitter.
+        ``snapshot_cycles``: the state at the start of these cycles is kept in ``self.snapshots``
+        {cycle: snapshot} (the cycles skipped once quiescent are not kept).
+        With ``resume`` the simulation continues from the current cycle, after ``restore``.
+        """
+        assert not (verify and resume), 'a resumed simulation cannot be verified'
+        if verify:
+            reference = Experiment(num_banks=self.num_banks,num_addr=self.num_addr,rng=copy.deepcopy(self.interconnect.rng),
+                                   l1_conf=self.l1_conf,l2_conf=self.l2_conf,trace=self.context.trace)
+            reference.interconnect.jitter = list(self.interconnect.jitter)
+            reference.load_instr(self.core0.inst, self.core1.inst)
+        if resume:
+            cycle = self.context.global_cycle
+        else:
+            self.context.global_cycle = 0
+            cycle = 0
+        self.snapshots = {}
+        snapshot_cycles = sorted(c for c in set(snapshot_cycles) if cycle <= c < cycles)
+        next_snapshot = 0
+        while cycle < cycles:
+            if next_snapshot < len(snapshot_cycles) and cycle == snapshot_cycles[next_snapshot]:
+                self.snapshots[cycle] = self.snapshot()
+                next_snapshot += 1
             # /!\ All components tick at the same frequency
             time0 = self.core0.tick()
             time1 = self.core1.tick()
             self.interconnect.tick()
             ddr_stats = self.ddr_controller.tick()
-            self.add_values(ddr_stats)
-            self.add_time_values({'core0':time0,'core1':time1})
+            if self.context.trace_full:
+                self.add_values(ddr_stats)
+            # cores issue in cycle order, the last issue is the latest
+            if time0 is not None:
+                self.time_max['core0'] = time0
+            if time1 is not None:
+                self.time_max['core1'] = time1
             self.ddr_memory_physical.tick()
-            # Update global clock (shared variable)
-            GlobalVar.global_cycle+=1
+            # Update the clock of this simulation (shared by its components)
+            self.context.global_cycle+=1
+            cycle += 1
+            if stop_when_quiescent and cycle < cycles and self.quiescent(cycle):
+                cycle = self.fast_forward(cycle, cycles)
+            if event_driven and cycle < cycles:
+                target = self.next_event(cycle)
+                if target is None or target > cycles:
+                    target = cycles
+                # idle cycles are not skipped past a snapshot
+                if next_snapshot < len(snapshot_cycles):
+                    target = min(target, snapshot_cycles[next_snapshot])
+                cycle = self.fast_forward(cycle, target)
 
         self.cache_stats_core_0 = self.mem_core0.stats()
         self.cache_stats_core_1 = self.mem_core1.stats()
@@ -103,42 +244,21 @@ class Experiment:
             print('shared cache L2',display_dict)
             print('ddr hits', self.hits_tab)
             print('ddr miss', self.miss_tab)
+        if verify:
+            assert_same_output(self.output_data(), reference.simulate(cycles))
         return self.output_data()
     def reorder(self):
-        hits = np.zeros(self.num_banks)
-        miss = np.zeros(self.num_banks)
-        self.hits_tab = np.zeros((self.num_rows,self.num_banks))
-        self.miss_tab = np.zeros((self.num_rows,self.num_banks))
-        if 'row' in self.ddr_stats:
-            for j in range(len(self.ddr_stats['row'])):
-                if self.ddr_stats['status'][j]=='ROW MISS':
-                    miss[self.ddr_stats['bank'][j]] +=1
-                    self.miss_tab[self.ddr_stats['row'][j],self.ddr_stats['bank'][j]] +=1
-                else:
-                    hits[self.ddr_stats['bank']] +=1
-                    self.hits_tab[self.ddr_stats['row'][j],self.ddr_stats['bank'][j]] +=1
-
-
-        denominator = miss + hits
-        denominator[denominator==0] = -1
-        self.ratios = miss/(denominator)
-        self.ratios[self.ratios<=0] = 0
-        self.analyze_interference_events = analyze_shared_resource_contention()
-        if (np.sum(miss)+np.sum(hits))==0:
-            self.miss_ratio_global =0
-        else:
-            self.miss_ratio_global = np.sum(miss)/(np.sum(miss)+np.sum(hits))
-
-        denominator_tab  = self.miss_tab + self.hits_tab
-        denominator_tab[denominator_tab==0] = -1
-        self.ratios_tab = self.miss_tab/(denominator_tab)
-        self.ratios_tab[self.ratios_tab<0] = -1
+        # counted by the controller at schedule time
+        self.hits_tab = self.ddr_controller.row_hits.astype(float)
+        self.miss_tab = self.ddr_controller.row_misses.astype(float)
+        self.ratios_tab, self.ratios, self.miss_ratio_global = ddr_miss_ratios(self.hits_tab, self.miss_tab)
+        self.analyze_interference_events = analyze_shared_resource_contention(self.context)
 
         #details for shared cache miss ratio
         #self.cache_miss_ratio_tab = sel
     def output_data(self):
-        return {'time_core0':max(self.time_values['core0']),
-                'time_core1':max(self.time_values['core1']),
+        return {'time_core0':max(self.time_max['core0'], self.ddr_controller.completion_max.get(0, 0)),
+                'time_core1':max(self.time_max['core1'], self.ddr_controller.completion_max.get(1, 0)),
                 #'miss_nb_detailled':self.miss_tab,
                 'miss_ratios_detailled':self.ratios_tab,
                 'miss_ratios_global': self.ratios,
@@ -147,34 +267,249 @@ class Experiment:
                 'L2_miss_ratio':self.cache_stats_core_1['L2']['miss_rate'],
                 #'L2_cache_miss_detailled':self.cache_stats_core_0['L2']['cache_miss_detailled'],
                 #'contention_events': self.analyze_interference_events,
-                'shared_resource_events': GlobalVar.shared_resource_events,
+                'shared_resource_events': self.context.shared_resource_events,
                 }
+def assert_same_output(out, reference, path='output'):
+    """Asserts that two ``Experiment.output_data`` dictionaries are identical"""
+    if isinstance(reference, dict):
+        assert out.keys()==reference.keys(), f'{path}: keys {set(out.keys())^set(reference.keys())} differ'
+        for key in reference:
+            assert_same_output(out[key], reference[key], f'{path}/{key}')
+    elif isinstance(reference, (list, tuple)):
+        assert len(out)==len(reference), f'{path}: {len(out)} items instead of {len(reference)}'
+        for i, (a, b) in enumerate(zip(out, reference)):
+            assert_same_output(a, b, f'{path}[{i}]')
+    else:
+        assert np.array_equal(out, reference), f'{path}: {out} instead of {reference}'
+# Warm experiments of this thread, one per (num_banks, num_addr), reset before every simulation.
+# The pool is per thread (and so per worker process), so that Envs running in different threads
+# never reset or run the same Experiment at the same time.
+experiment_pools = threading.local()
+def warm_experiment(num_banks, num_addr, rng=None, trace='full')->Experiment:
+    """A cold ``Experiment`` taken from the pool of the calling thread, built on first use"""
+    experiment_pool = experiment_pools.__dict__.setdefault('pool', {})
+    if (num_banks, num_addr) not in experiment_pool:
+        experiment_pool[(num_banks, num_addr)] = Experiment(num_banks=num_banks,num_addr=num_addr,rng=rng,trace=trace)
+        return experiment_pool[(num_banks, num_addr)]
+    return experiment_pool[(num_banks, num_addr)].reset(rng, trace)
+def run_experiment(core0_inst, core1_inst, cycles, num_banks, num_addr, event_driven, stop_when_quiescent=False, trace='full', seed=0):
+    """Simulates one pair of instruction sequences in a warm ``Experiment`` whose jitter is drawn from ``seed``.
+    Module level so that it can be sent to the worker processes of ``Env``, each process keeping its own pool.
+    """
+    program = warm_experiment(num_banks, num_addr, rng=np.random.default_rng(seed), trace=trace)
+    program.load_instr(core0_inst, core1_inst)
+    return program.simulate(cycles,event_driven=event_driven,stop_when_quiescent=stop_when_quiescent)
+def _run_experiment(task):
+    return run_experiment(*task)
+def _run_experiments(tasks):
+    return [run_experiment(*task) for task in tasks]
+def run_batch(tasks, cycles, num_banks, num_addr, event_driven=True, stop_when_quiescent=True, trace='contention', seeds=None):
+    """Simulates a list of (core0_inst, core1_inst) pairs at once with the array-backed ``BatchExperiment``,
+    the jitter of the i-th pair being drawn from ``seeds[i]`` as ``run_experiment`` would"""
+    program = BatchExperiment(num_banks=num_banks,num_addr=num_addr,trace=trace)
+    program.load_instr([task[0] for task in tasks], [task[1] for task in tasks])
+    rngs = [np.random.default_rng(seed) for seed in seeds] if seeds is not None else None
+    return program.simulate(cycles, rngs=rngs)
+def _run_batch(args):
+    return run_batch(*args)
 class Env:
+    """
+    Runs the three simulations of a parameter: core0 alone, core1 alone and both cores together.
+    num_workers: int. Size of the process pool used by ``evaluate_many``, None or 1 to stay in process.
+    engine: str. 'object' simulates every program pair with ``Experiment``, 'numpy' simulates
+    the whole batch in lockstep with ``BatchExperiment`` (for large random sweeps).
+    cache: ResultCache. Optional cache of simulation outputs, keyed on the programs and the configuration.
+    trace: str. Trace level of the simulations (see simulator/sim3.py), 'contention' is the lowest
+    level giving the shared resource events of the observations.
+    seed: int or numpy.random.SeedSequence. Root of the interconnect jitter (see exploration/seed.py):
+    the simulation of a pair of programs draws its jitter from ``simulation_seed(seed, key)``, so its
+    output does not depend on the order, batch, worker or cache it goes through. 0 by default, None for fresh entropy.
+    prefix_sharing: bool. Keeps snapshots of the simulations every ``snapshot_every`` cycles (the
+    ``snapshot_capacity`` most recently used ones) and starts a simulation from the latest snapshot
+    whose programs issued the same instructions up to that cycle, typically the parent it was mutated
+    from, instead of from cycle 0. For the resumed part to be the one of a full simulation, the jitter
+    is drawn from a single stream of the configuration rather than from the programs, so the outputs
+    differ from those without prefix sharing (and are cached apart). Object engine, in process only.
+    """
     def __init__(self,cycles,
                  num_banks = 4,
                  num_addr = 20,
+                 event_driven = True,
+                 stop_when_quiescent = True,
+                 trace = 'contention',
+                 num_workers = None,
+                 cache:ResultCache = None,
+                 engine:str = 'object',
+                 batch_chunk:int = 4096,
+                 seed = 0,
+                 prefix_sharing:bool = False,
+                 snapshot_every:int = 10,
+                 snapshot_capacity:int = 4096,
                 ):
         self.num_banks = num_banks
         self.num_addr  = num_addr 
         self.num_rows = self.num_addr//16+1
         self.cycles = cycles
-    def __call__(self, parameter:dict)->dict:
-        program  = Experiment(num_banks=self.num_banks,num_addr=self.num_addr)
-        program0 = Experiment(num_banks=self.num_banks,num_addr=self.num_addr)
-        program1 = Experiment(num_banks=self.num_banks,num_addr=self.num_addr)
-        program.load_instr(parameter["core0"], parameter["core1"])
-        program0.load_instr(parameter["core0"],[])
-        program1.load_instr([],parameter["core1"])
-        out = {}
-        GlobalVar.clear_history()
-        out['core0'] = program0.simulate(self.cycles)
-        GlobalVar.clear_history()
-        out['core1'] = program1.simulate(self.cycles)
-        GlobalVar.clear_history()
-        out['mutual'] = program.simulate(self.cycles)
+        self.event_driven = event_driven
+        self.stop_when_quiescent = stop_when_quiescent
+        self.trace = trace
+        self.num_workers = num_workers
+        self.cache = cache
+        assert engine in ('object', 'numpy'), f'unknown engine {engine}'
+        self.engine = engine
+        self.batch_chunk = batch_chunk # max number of simulations per BatchExperiment
+        self.pool = None
+        self.seed = as_seed_sequence(seed)
+        assert not prefix_sharing or (engine=='object' and (not num_workers or num_workers<=1)), \
+            'snapshots are restored into the experiment that took them: object engine, in process'
+        self.prefix_sharing = prefix_sharing
+        self.snapshot_every = snapshot_every
+        self.snapshot_capacity = snapshot_capacity
+        self.snapshots = OrderedDict() # (cycle, core0 prefix, core1 prefix): snapshot, least recently used first
+        self.submitted = {} # future of submit: (keys, results, todo) of lookup
+    def config(self)->tuple:
+        """Simulator configuration, the arguments of ``run_experiment`` following the programs"""
+        return (self.cycles, self.num_banks, self.num_addr, self.event_driven, self.stop_when_quiescent, self.trace)
+    def tasks(self, parameter:dict)->list[tuple]:
+        """Pairs of programs of the core0, core1 and mutual simulations"""
+        return [(parameter["core0"], []),
+                ([], parameter["core1"]),
+                (parameter["core0"], parameter["core1"])]
+    def key(self, task:tuple)->str:
+        # event_driven, stop_when_quiescent and engine do not change the results, they are left out of the key
+        return program_key(task[0], task[1], (self.cycles, self.num_banks, self.num_addr, self.seed.entropy, self.seed.spawn_key))
+    def cache_key(self, task:tuple)->str:
+        """``key`` with the simulator version, told apart when the trace level is too low for the shared resource events"""
+        # The version is left out of ``key``, which also seeds the jitter of the simulations
+        key = f'{self.key(task)}-v{SIMULATOR_VERSION}'
+        if self.prefix_sharing:
+            key += '-shared-jitter'
+        if TRACE_LEVELS[self.trace] < TRACE_LEVELS['contention']:
+            key += '-no-events'
+        return key
+    def simulation_seed(self, task:tuple):
+        """Seed of the jitter of a task, the one of the empty programs for all of them with prefix sharing"""
+        if self.prefix_sharing:
+            return simulation_seed(self.seed, self.key(([], [])))
+        return simulation_seed(self.seed, self.key(task))
+    def prefixes(self, task:tuple)->dict:
+        """{cycle: key} of the snapshot cycles of a task, the key holding the instructions issued before the cycle"""
+        programs = [sorted((cycle, op, addr) for cycle, (op, addr) in unpack(inst).items()) for inst in task[:2]]
+        length = max([program[-1][0]+1 for program in programs if program], default=0)
+        prefixes = {}
+        for cycle in range(self.snapshot_every, min(length, self.cycles-1)+1, self.snapshot_every):
+            prefixes[cycle] = (cycle,)+tuple(tuple(program[:bisect.bisect_left(program, (cycle,))]) for program in programs)
+        return prefixes
+    def run_resumed(self, task:tuple, seed)->dict:
+        """``run_experiment`` from the latest matching snapshot, keeping the snapshots of this simulation"""
+        program = warm_experiment(self.num_banks, self.num_addr, rng=np.random.default_rng(seed), trace=self.trace)
+        prefixes = self.prefixes(task)
+        start = 0
+        for cycle in sorted(prefixes, reverse=True):
+            # a snapshot is only restored into the experiment that took it, the one of its thread
+            if prefixes[cycle] in self.snapshots and self.snapshots[prefixes[cycle]]['experiment'] is program:
+                self.snapshots.move_to_end(prefixes[cycle])
+                program.restore(self.snapshots[prefixes[cycle]])
+                start = cycle
+                break
+        program.load_instr(task[0], task[1])
+        out = program.simulate(self.cycles,event_driven=self.event_driven,stop_when_quiescent=self.stop_when_quiescent,
+                               snapshot_cycles=[cycle for cycle in prefixes if cycle > start],resume=start>0)
+        for cycle, state in program.snapshots.items():
+            self.snapshots[prefixes[cycle]] = state
+            self.snapshots.move_to_end(prefixes[cycle])
+        while len(self.snapshots) > self.snapshot_capacity:
+            self.snapshots.popitem(last=False)
+        return out
+    def run(self, tasks:list[tuple])->list[dict]:
+        """Simulates the tasks, in the process pool if there is one, without looking at the cache"""
+        seeds = [self.simulation_seed(task) for task in tasks]
+        if self.prefix_sharing:
+            return [self.run_resumed(task, seed) for task, seed in zip(tasks, seeds)]
+        if self.engine=='numpy':
+            chunk = self.batch_chunk
+            if self.num_workers and self.num_workers>1:
+                chunk = min(chunk, -(-len(tasks)//self.num_workers))
+            chunks = [(tasks[i:i+chunk],)+self.config()+(seeds[i:i+chunk],) for i in range(0,len(tasks),chunk)]
+            if not self.num_workers or self.num_workers<=1:
+                return [out for args in chunks for out in run_batch(*args)]
+            return [out for outs in self.get_pool().map(_run_batch, chunks) for out in outs]
+        tasks = [task+self.config()+(seed,) for task, seed in zip(tasks, seeds)]
+        if not self.num_workers or self.num_workers<=1:
+            return [run_experiment(*task) for task in tasks]
+        chunksize = max(1,len(tasks)//(4*self.num_workers))
+        return list(self.get_pool().map(_run_experiment, tasks, chunksize=chunksize))
+    def lookup(self, tasks:list[tuple])->tuple:
+        """(keys, results, todo): the cache keys of the tasks, their cached results (None when missing)
+        and the tasks to simulate by key, each distinct one only once. Without cache every task is to simulate."""
+        if self.cache is None:
+            return None, [None]*len(tasks), dict(enumerate(tasks))
+        keys = [self.cache_key(task) for task in tasks]
+        results = [self.cache.get(key) for key in keys]
+        todo = {key:task for key, task, result in zip(keys, tasks, results) if result is None}
+        return keys, results, todo
+    def fill(self, keys:list, results:list, todo:dict, outs:list[dict])->list[dict]:
+        """Results of the tasks of ``lookup``, ``outs`` being the outputs of the tasks of ``todo``"""
+        if self.cache is None:
+            return outs
+        computed = dict(zip(todo, outs))
+        for key, out in computed.items():
+            self.cache.put(key, out)
+        return [result if result is not None else copy.deepcopy(computed[key]) for key, result in zip(keys, results)]
+    def run_cached(self, tasks:list[tuple])->list[dict]:
+        """Answers the tasks from the cache and simulates the others, each distinct one only once"""
+        keys, results, todo = self.lookup(tasks)
+        return self.fill(keys, results, todo, self.run(list(todo.values())))
+    def merge(self, out0:dict, out1:dict, out_mutual:dict)->dict:
+        out = {'core0':out0,'core1':out1,'mutual':out_mutual}
         out['mutual']['miss_ratios_diff_core0'] = np.array(out['mutual']['miss_ratios_detailled'] - out['core0']['miss_ratios_detailled'])
         out['mutual']['miss_ratios_diff_core1'] = np.array(out['mutual']['miss_ratios_detailled'] - out['core1']['miss_ratios_detailled'])
-        GlobalVar.clear_history()
         del out['core0']['time_core1']
         del out['core1']['time_core0']
         return out
+    def __call__(self, parameter:dict)->dict:
+        return self.merge(*self.run_cached(self.tasks(parameter)))
+    def evaluate_many(self, parameters:list[dict])->list[dict]:
+        """Evaluates a batch of parameters, returns the observations in the same order.
+        The three simulations of every parameter are farmed out independently to the process pool.
+        """
+        if self.engine=='object' and (not self.num_workers or self.num_workers<=1):
+            return [self(parameter) for parameter in parameters]
+        results = self.run_cached([task for parameter in parameters for task in self.tasks(parameter)])
+        return [self.merge(*results[3*i:3*i+3]) for i in range(len(parameters))]
+    def submit(self, parameter:dict)->Future:
+        """Starts the evaluation of a parameter and returns at once, its simulations running in the process
+        pool (in process, the future is already done). ``collect`` gives the observation."""
+        keys, results, todo = self.lookup(self.tasks(parameter))
+        tasks = list(todo.values())
+        if not tasks or not self.num_workers or self.num_workers<=1:
+            future = Future()
+            future.set_result(self.run(tasks))
+        else:
+            seeds = [self.simulation_seed(task) for task in tasks]
+            if self.engine=='numpy':
+                future = self.get_pool().submit(run_batch, tasks, *self.config(), seeds)
+            else:
+                future = self.get_pool().submit(_run_experiments, [task+self.config()+(seed,) for task, seed in zip(tasks, seeds)])
+        self.submitted[future] = (keys, results, todo)
+        return future
+    def collect(self, future:Future)->dict:
+        """Observation of a parameter given to ``submit``, waits for its simulations if needed"""
+        keys, results, todo = self.submitted.pop(future)
+        return self.merge(*self.fill(keys, results, todo, future.result()))
+    def get_pool(self)->ProcessPoolExecutor:
+        """The pool is created on first use and kept alive until ``close``"""
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.num_workers)
+        return self.pool
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['pool'] = None
+        state['submitted'] = {}
+        # snapshots hold callbacks into the experiments of this process
+        state['snapshots'] = OrderedDict()
+        return state
@@ -2,42 +2,144 @@ import numpy as np
 import pickle
 import os.path
 import copy
+from exploration.knn_index import SortedIndex, VectorIndex
+from exploration.bounds import Bounds
+from exploration.store import HistoryStore
+
+SHARED_RESOURCE_COORDS = [('program',np.int64),('cycle',np.int64)]
 class History:
-    def __init__(self,env=None,capacity=1000):
+    """
+    env: Env. Used to vectorize the shared resource events.
+    capacity: int. Maximum number of samples.
+    path: str. Optional directory of a ``HistoryStore`` the samples are streamed to.
+    flush_every: int. Number of samples between two writes to ``path``.
+    bounds_mode: str. Bounds of the features and of the shared resource vectors given by ``bounds`` (see
+    exploration/bounds.py): 'all' the samples, a 'window' of the last ``bounds_window`` samples or bounds
+    decayed by ``bounds_decay`` per sample.
+    """
+    def __init__(self,env=None,capacity=1000,path=None,flush_every=1000,bounds_mode='all',bounds_window=1000,bounds_decay=0.999):
         self.memory_program = {"core0":[],"core1":[]}
         self.memory_perf = {'mutual':{},
                             'core0':{},
                             'core1':{}}
         self.j = 0
         self.capacity = capacity
-        self.shared_resource_list = []
-        self.shared_resource_coords = []
+        # vectors of the DDR contention events and their (program, cycle), preallocated and grown geometrically
+        self.shared_resource_vecs = None
+        self.shared_resource_ids = np.zeros(1024,dtype=SHARED_RESOURCE_COORDS)
+        self.num_shared_resources = 0
         self.env = env
-        self.tab = []
+        self.tab = None # preallocated (rows, features) observation matrix, filled up to self.size
+        self.size = 0
+        self.columns = [] # name of every feature, e.g. 'mutual/miss_ratios_detailled[row,bank]'
+        self.column_index = {}
         self.hist_vec = []
         self.diversity_vec = 0
         self.reward_vec = [0]
         self.alp_vec = [0]
         self.window_size = 200
         self.window = {'id':[],'alp':[]}
+        self.index = [] # one nearest neighbour index per feature of the observation vector
+        self.shared_resource_index = VectorIndex()
+        self.storage = HistoryStore(path) if path else None
+        self.flush_every = flush_every
+        self.flushed = 0 # number of samples already written to the storage
+        self.bounds_conf = {'mode':bounds_mode,'window':bounds_window,'decay':bounds_decay}
+        self.feature_bounds = Bounds(**self.bounds_conf)
+        self.shared_resource_bounds = Bounds(**self.bounds_conf) # of the vectors of the shared resource events
     def as_tab(self):
-        return np.array(self.tab)
+        """View of the observations stored so far, shape (len, features)"""
+        if self.tab is None:
+            return np.zeros((0,0))
+        return self.tab[:self.size]
+    def column(self,name:str)->np.ndarray:
+        """View of the feature ``name`` over the observations stored so far"""
+        return self.as_tab()[:,self.column_index[name]]
+    def set_columns(self,columns:list[str]):
+        self.columns = columns
+        self.column_index = {name:i for i,name in enumerate(columns)}
+    def append_observation(self,observation_vec:np.ndarray):
+        if self.tab is None:
+            self.tab = np.zeros((max(self.capacity+1,1),len(observation_vec)))
+        elif self.size==self.tab.shape[0]:
+            self.tab = np.concatenate((self.tab,np.zeros_like(self.tab)),axis=0)
+        self.tab[self.size] = observation_vec
+        self.size+=1
     def __len__(self):
         return len(self.memory_program["core0"])
+    @property
+    def shared_resource_list(self)->np.ndarray:
+        """View of the vectors of the shared resource events stored so far, shape (events, dim)"""
+        if self.shared_resource_vecs is None:
+            return np.zeros((0,0))
+        return self.shared_resource_vecs[:self.num_shared_resources]
+    @property
+    def shared_resource_coords(self)->np.ndarray:
+        """View of the (program, cycle) of the shared resource events, ``coords[i]['program']`` for the event i"""
+        return self.shared_resource_ids[:self.num_shared_resources]
+    def add_shared_resources(self,events:list,j:int)->np.ndarray:
+        """Stores the vectors of the DDR contention events of the sample j, returns them"""
+        events = [event for event in events if event['type']=='DDR_MEMORY_CONTENTION']
+        vecs = shared_resources2vec(events,self.env)
+        n, start = len(events), self.num_shared_resources
+        if n==0:
+            return vecs
+        if self.shared_resource_vecs is None:
+            self.shared_resource_vecs = np.zeros((len(self.shared_resource_ids),vecs.shape[1]))
+        while start+n>len(self.shared_resource_ids):
+            self.shared_resource_vecs = np.concatenate((self.shared_resource_vecs,np.zeros_like(self.shared_resource_vecs)),axis=0)
+            self.shared_resource_ids = np.concatenate((self.shared_resource_ids,np.zeros_like(self.shared_resource_ids)))
+        self.shared_resource_vecs[start:start+n] = vecs
+        self.shared_resource_ids['program'][start:start+n] = j
+        self.shared_resource_ids['cycle'][start:start+n] = [event['cycle'] for event in events]
+        for i,vec in enumerate(vecs):
+            self.shared_resource_index.add(vec,start+i)
+        self.num_shared_resources+=n
+        return vecs
+    def clear_shared_resources(self):
+        self.shared_resource_vecs = None
+        self.shared_resource_ids = np.zeros(1024,dtype=SHARED_RESOURCE_COORDS)
+        self.num_shared_resources = 0
+        self.shared_resource_index = VectorIndex()
+    def bounds(self,module:int)->tuple:
+        """(min, max) of the feature ``module``, or of the shared resource vectors for the last module"""
+        if module==self.num_features():
+            assert self.shared_resource_bounds.low is not None, "no shared resource event"
+            return self.shared_resource_bounds.low,self.shared_resource_bounds.high
+        return self.feature_bounds.low[module],self.feature_bounds.high[module]
+    def update_bounds(self,observation_vec:np.ndarray,event_vecs:np.ndarray):
+        """Bounds updated with one sample: its observation and the vectors of its shared resource events"""
+        self.feature_bounds.update(observation_vec)
+        if len(event_vecs):
+            self.shared_resource_bounds.update(event_vecs.min(axis=0),event_vecs.max(axis=0))
+        else:
+            self.shared_resource_bounds.update(None)
+    def rebuild_bounds(self,n:int):
+        """Bounds of the n first samples, replayed in order"""
+        self.feature_bounds = Bounds(**self.bounds_conf)
+        self.shared_resource_bounds = Bounds(**self.bounds_conf)
+        programs = self.shared_resource_coords['program']
+        order = np.argsort(programs,kind='stable')
+        starts = np.searchsorted(programs[order],np.arange(n+1))
+        for j in range(n):
+            self.update_bounds(self.tab[j],self.shared_resource_list[order[starts[j]:starts[j+1]]])
     def store(self,sample:dict):
         key_set = ['shared_resource_events']
         self.memory_program["core0"].append(sample["program"]["core0"])
         self.memory_program["core1"].append(sample["program"]["core1"])
         observation_vec = []
+        columns = []
         diversity = 0
         observation_diversity_vec = []
         step = 5
         k =0
+        events = [] # shared resource events of the sample
         for key1 in self.memory_perf.keys():
             for key2 in sample[key1].keys():
                 if key2 not in key_set:
                     value = np.array(sample[key1][key2]).reshape((-1))
                     observation_vec.append(value)
+                    columns+=feature_names(key1,key2,np.shape(sample[key1][key2]))
                     if self.j==0:
                         if key2 in ['time_core0', 'time_core1']:
                             hist = np.zeros((value.shape[0],300//step+1))
@@ -73,15 +175,13 @@ class History:
                         self.memory_perf[key1][key2][self.j] = sample[key1][key2]
                     elif sample[key1][key2]!=[] :
                         self.memory_perf[key1][key2] = {self.j:sample[key1][key2]}
-                    if sample[key1][key2]!=[]:
-                        for event in sample[key1][key2]:
-                            if event['type']=='DDR_MEMORY_CONTENTION':
-                                self.shared_resource_list.append(shared_resource2vec(event,self.env))
-                                self.shared_resource_coords.append({'program':self.j,'cycle':event['cycle']})
+                    events+=sample[key1][key2]
         #array that counts diversity for every axis
         current_diversity_array = np.concatenate(observation_diversity_vec)
         #synthetizes an array with all observations, usefull for exploration.
         observation_vec = np.concatenate(observation_vec)
+        if not self.columns:
+            self.set_columns(columns)
         if self.j==0:
             self.reward_vec = np.zeros((self.capacity+1,len(observation_vec)))
             self.alp_vec = np.zeros((self.capacity+1,len(observation_vec)))
@@ -90,17 +190,78 @@ class History:
             current_reward = current_diversity_array - self.diversity_vec
         #closest previously sampled observation
         if self.j>0:
-            loss = np.abs(self.as_tab()-observation_vec.reshape(1,-1))
-            argmin = loss.argmin(axis=0) #(Nb of Features,)
+            argmin = np.array([index.nearest(value) for index,value in zip(self.index,observation_vec)]) #(Nb of Features,)
             alp_values = np.abs(self.reward_vec[argmin,range(len(argmin))] - current_reward)
             self.alp_vec[self.j] = alp_values
             self.reward_vec[self.j] = current_reward
         self.diversity_vec = current_diversity_array
-        self.tab.append(observation_vec)
+        self.append_observation(observation_vec)
+        self.index_observation(observation_vec,self.j)
+        self.update_bounds(observation_vec,self.add_shared_resources(events,self.j))
 
 
         self.j+=1
+        if self.storage is not None and self.j-self.flushed>=self.flush_every:
+            self.flush()
+    def flush(self):
+        """Appends the samples stored since the last flush to the on-disk store"""
+        if self.storage is None or self.flushed==self.j:
+            return
+        rows = range(self.flushed,self.j)
+        arrays = {f"{key1}/{key2}":self.memory_perf[key1][key2][self.flushed:self.j] for key1 in self.memory_perf for key2 in self.memory_perf[key1] if key2!='shared_resource_events'}
+        arrays['reward'] = self.reward_vec[self.flushed:self.j]
+        arrays['alp'] = self.alp_vec[self.flushed:self.j]
+        programs = [(self.memory_program["core0"][j],self.memory_program["core1"][j]) for j in rows]
+        events = [(j,key1,self.memory_perf[key1]['shared_resource_events'][j]) for j in rows for key1 in self.memory_perf
+                  if j in self.memory_perf[key1].get('shared_resource_events',{})]
+        state = {'diversity_vec':self.diversity_vec}|{f'hist_{k}':hist for k,hist in enumerate(self.hist_vec)}
+        self.storage.append(arrays,programs,events,state,self.columns)
+        self.flushed = self.j
+    def resume(self)->int:
+        """Reloads the samples of the on-disk store, so that the exploration continues after them.
+        Returns the number of samples"""
+        n = len(self.storage)
+        if n==0:
+            return 0
+        assert n<=self.capacity+1, f"{n} samples stored, capacity {self.capacity}"
+        programs = self.storage.programs()
+        self.memory_program = {"core0":[core0 for core0,_ in programs],"core1":[core1 for _,core1 in programs]}
+        self.memory_perf = {'mutual':{},'core0':{},'core1':{}}
+        for key1,stats in self.storage.memory_perf(mmap=False).items():
+            for key2,value in stats.items():
+                self.memory_perf[key1][key2] = np.zeros((self.capacity+1,)+value.shape[1:])
+                self.memory_perf[key1][key2][:n] = value
+        self.clear_shared_resources()
+        for j,key1,events in self.storage.events():
+            self.memory_perf[key1].setdefault('shared_resource_events',{})[j] = events
+            self.add_shared_resources(events,j)
+        tab = np.concatenate([self.storage.read(name,mmap=False).reshape((n,-1)) for name in self.storage.features if '/' in name],axis=1)
+        self.set_columns(self.storage.columns)
+        self.tab = np.zeros((self.capacity+1,tab.shape[1]))
+        self.tab[:n] = tab
+        self.size = n
+        self.index = []
+        for id_,observation_vec in enumerate(tab):
+            self.index_observation(observation_vec,id_)
+        self.rebuild_bounds(n)
+        self.reward_vec = np.zeros((self.capacity+1,tab.shape[1]))
+        self.alp_vec = np.zeros((self.capacity+1,tab.shape[1]))
+        self.reward_vec[:n] = self.storage.read('reward',mmap=False)
+        self.alp_vec[:n] = self.storage.read('alp',mmap=False)
+        state = self.storage.state()
+        self.diversity_vec = state['diversity_vec']
+        self.hist_vec = [state[f'hist_{k}'] for k in range(len(state)-1)]
+        self.j = n
+        self.flushed = n
+        return n
 
+    def index_observation(self,observation_vec:np.ndarray,id_:int):
+        if not self.index:
+            self.index = [SortedIndex() for _ in range(len(observation_vec))]
+        for module,value in enumerate(observation_vec):
+            self.index[module].add(value,id_)
+    def num_features(self)->int:
+        return len(self.index)
     def content(self):
         """
         returns dictionary of content
@@ -126,13 +287,48 @@ class History:
         self.memory_perf = sample["memory_perf"]
         self.memory_program["core0"] = sample["memory_program"]["core0"]
         self.memory_program["core1"] = sample["memory_program"]["core1"]
-        self.tab = np.concatenate([np.array(sample['memory_perf'][key1][key2]).reshape((N_init,-1)) for key1 in sample['memory_perf'] for key2 in sample['memory_perf'][key1] if key2!='shared_resource_events'],axis=1)    
+        keys = [(key1,key2) for key1 in sample['memory_perf'] for key2 in sample['memory_perf'][key1] if key2!='shared_resource_events']
+        tab = np.concatenate([np.array(sample['memory_perf'][key1][key2])[:N_init].reshape((N_init,-1)) for key1,key2 in keys],axis=1)
+        self.set_columns([name for key1,key2 in keys for name in feature_names(key1,key2,np.shape(sample['memory_perf'][key1][key2])[1:])])
+        self.tab = np.zeros((max(self.capacity+1,N_init),tab.shape[1]))
+        self.tab[:N_init] = tab
+        self.size = N_init
+        self.index = []
+        for id_,observation_vec in enumerate(tab):
+            self.index_observation(observation_vec,id_)
+        self.rebuild_bounds(N_init)
+
+
+def feature_names(key1:str,key2:str,shape:tuple)->list[str]:
+    """Names of the features obtained by flattening the output ``key1/key2`` of shape ``shape``"""
+    if len(shape)==0:
+        return [f"{key1}/{key2}"]
+    return [f"{key1}/{key2}[{','.join(map(str,i))}]" for i in np.ndindex(*shape)]
 
+def shared_resources2vec(events:list,E)->np.ndarray:
+    """
+    Vectors of DDR contention events, one row per event: the share of the initiators that are core 1,
+    the share of the accesses to every bank and to every row, and the bank and row conflict flags.
+    The counts of all the events are made at once with ``np.bincount`` on (event, bank) and (event, row)
+    indices, bins as ``np.histogram`` with bins ``range(n+1)`` (the last one closed).
+    """
+    num_events = len(events)
+    if num_events==0:
+        return np.zeros((0,1+E.num_banks+E.num_rows+2))
+    lengths = np.array([len(event['details']['banks']) for event in events])
+    initiators = [len(event['initiators']) for event in events]
+    event_ids = np.repeat(np.arange(num_events),lengths)
+    def counts(values,num_bins):
+        values = np.asarray(values,dtype=np.int64)
+        kept = (values>=0)&(values<=num_bins)
+        bins = np.minimum(values[kept],num_bins-1)
+        return np.bincount(event_ids[kept]*num_bins+bins,minlength=num_events*num_bins).reshape(num_events,num_bins)
+    count_banks = counts([bank for event in events for bank in event['details']['banks']],E.num_banks)/lengths[:,None]
+    count_rows = counts([row for event in events for row in event['details']['rows']],E.num_rows)/lengths[:,None]
+    core1 = np.array([initiator==1 for event in events for initiator in event['initiators']])
+    ratios_core = np.bincount(np.repeat(np.arange(num_events),initiators),weights=core1,minlength=num_events)/np.array(initiators)
+    conflicts = np.array([[1*event['details']['bank_conflicts'],1*event['details']['row_conflicts']] for event in events])
+    return np.concatenate((ratios_core[:,None],count_banks,count_rows,conflicts),axis=1)
 
 def shared_resource2vec(in_,E):
-    count_banks = np.histogram(in_['details']['banks'],bins = range(E.num_banks+1))[0]/len(in_['details']['banks'])
-    count_rows = np.histogram(in_['details']['rows'],bins = range(E.num_rows+1))[0]/len(in_['details']['banks'])
-    ratios_core = np.array([sum(np.array(in_['initiators'])==1)/len(in_['initiators'])])
-    conflicts = np.array([1*in_['details']['bank_conflicts'],1*in_['details']['row_conflicts']])
-    out = np.concatenate((ratios_core,count_banks,count_rows,conflicts),axis=0)
-    return out
+    return shared_resources2vec([in_],E)[0]
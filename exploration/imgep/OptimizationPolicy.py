@@ -8,11 +8,16 @@ from exploration.history import History
 from exploration.imgep.features import Features
 from exploration.imgep.mix import mix_sequences
 from exploration.imgep.mixxx import random_mix_sequences
+from simulator.program import EMPTY, is_packed
 
 def subsequence(cycle,parameter:dict):
     '''
     returns the sequences of instructions up to the given cycle
     '''
+    if is_packed(parameter):
+        out = parameter.copy()
+        out[cycle+1:] = EMPTY
+        return out
     return {k:parameter[k] for k in parameter if k<=cycle}
 
 class OptimizationPolicykNN(Features):
@@ -27,8 +32,13 @@ class OptimizationPolicykNN(Features):
                 min_address_core1 = 11,
                 max_address_core1 = 21,
                 segment_method=True,
+                rng:random.Random = None,
                 ):
+        """
+        rng: random.Random. Generator of the mixing and mutation draws, the global random module by default.
+        """
         super().__init__()
+        self.rng = rng if rng is not None else random
         self.segment_method = segment_method
         self.min_address_core0 = min_address_core0
         self.max_address_core0 = max_address_core0
@@ -48,50 +58,68 @@ class OptimizationPolicykNN(Features):
             output = self.mix(output)
         output = self.light_code_mutation(output)
         return output
+    def propose_batch(self,goals:list,H:History, modules:list)->list[dict]:
+        """
+        Parameters of a batch of (goal, module) pairs, as many calls to ``__call__`` would give them.
+        The nearest neighbour queries of the goals of a module are answered together (see ``query_many``
+        in exploration/knn_index.py), then the codes are mixed and mutated in the order of the goals.
+        Mixing and mutation, most of the cost, stay goal by goal: the batch is only faster when many goals
+        share a module, otherwise it is a convenience with the results of ``__call__``.
+        """
+        assert len(goals)==len(modules), f"{len(goals)} goals for {len(modules)} modules"
+        idx = [None]*len(goals)
+        for module in set(modules):
+            rows = [i for i,m in enumerate(modules) if m==module]
+            for i,ids in zip(rows,self.query_many([goals[i] for i in rows],H,module)):
+                idx[i] = ids
+        outputs = []
+        for ids,module in zip(idx,modules):
+            closest_codes = self.closest_codes(H,ids,module)
+            output = {'core0':closest_codes['program']['core0'],
+                    'core1':closest_codes['program']['core1']}
+            if self.k>1:
+                output = self.mix(output)
+            outputs.append(self.light_code_mutation(output))
+        return outputs
     def mix(self,programs:list[dict]):
         if self.segment_method:
-            mix0, mix1 = mix_sequences(programs["core0"],max_cycle=self.max_cycle), mix_sequences(programs["core1"],max_cycle=self.max_cycle)
+            mix0, mix1 = mix_sequences(programs["core0"],max_cycle=self.max_cycle,rng=self.rng), mix_sequences(programs["core1"],max_cycle=self.max_cycle,rng=self.rng)
         else:
-            mix0, mix1 = random_mix_sequences(programs["core0"],max_cycle=self.max_cycle), mix_sequences(programs["core1"],max_cycle=self.max_cycle)
+            mix0, mix1 = random_mix_sequences(programs["core0"],max_cycle=self.max_cycle,rng=self.rng), mix_sequences(programs["core1"],max_cycle=self.max_cycle,rng=self.rng)
         return {'core0':[mix0],'core1':[mix1]}
-    def loss(self,goal:np.ndarray, elements:np.ndarray):
-        if type(goal)!=float:
-            a = goal.reshape(1,-1) 
-#            print('a', a.shape)
-#            print('elements', elements.shape)
-        else:
-            a = np.array([goal]).reshape(1,-1)#size (dim,N), N=1 individual
-            elements = elements.reshape(-1,1)
-        out = np.sum((a -elements)**2,axis=1)
-#        if type(goal)!=float:
-#            print('out', out.shape)
-        return out
-    def feature2closest_code(self,features,signature:np.ndarray)->np.ndarray:
-        if type(signature)==np.ndarray:
-            if features.ndim==1 and (signature.shape[0]>1 or signature.ndim>1):
-                raise TypeError(f"goal of shape {signature.shape} has be a float. Features of shape {features.shape}")
-        d = self.loss(signature,features)
-        idx = np.argsort(d)[:self.k]
-        #print('idx',idx)
-        return idx
     def select_closest_codes(self,H:History,signature: np.ndarray,module:int)->dict:
         assert len(H.memory_program)>0, "history empty"
+        if module==H.num_features():
+            idx = H.shared_resource_index.query(signature,self.k)
+        else:
+            self.check_goal(signature,H)
+            idx = H.index[module].query(signature,self.k)
+        return self.closest_codes(H,idx,module)
+    def query_many(self,signatures:list,H:History,module:int)->list[list[int]]:
+        """Ids of the k closest observations (or shared resource events) of every goal of the module"""
+        assert len(H.memory_program)>0, "history empty"
+        if module==H.num_features():
+            return H.shared_resource_index.query_many(np.stack(signatures),self.k)
+        for signature in signatures:
+            self.check_goal(signature,H)
+        return H.index[module].query_many(np.array(signatures,dtype=np.float64).reshape(-1),self.k)
+    def check_goal(self,signature,H:History):
+        if type(signature)==np.ndarray and (signature.shape[0]>1 or signature.ndim>1):
+            raise TypeError(f"goal of shape {signature.shape} has be a float. Features of shape {(len(H),)}")
+    def closest_codes(self,H:History,idx:list[int],module:int)->dict:
+        """Programs of the observations ``idx``, cut at the cycle of the event for the shared resource module"""
         output = {"program": {"core0":[],"core1":[]},}
-        if module==H.as_tab().shape[-1]:
-            features = np.array(H.shared_resource_list) # to get size (dim,N), with N individual, vectors 
-            idx = self.feature2closest_code(features,signature)
-            idx = [(H.shared_resource_coords[id_]['program'],H.shared_resource_coords[id_]['cycle']) for id_ in idx]
-            for id_,cycle in idx:
+        if module==H.num_features():
+            coords = H.shared_resource_coords[idx]
+            for id_,cycle in zip(coords['program'].tolist(),coords['cycle'].tolist()):
                 output["program"]["core0"].append(subsequence(cycle,H.memory_program["core0"][id_]))
                 output["program"]["core1"].append(subsequence(cycle,H.memory_program["core1"][id_]))
         else:
-            features = H.as_tab()[:,module]
-            idx = self.feature2closest_code(features,signature)
             for id_ in idx:
                 output["program"]["core0"].append(H.memory_program["core0"][id_])
                 output["program"]["core1"].append(H.memory_program["core1"][id_])
         return output
     def light_code_mutation(self,programs:dict[list[dict]]):
-        mutated0 = mutate_instruction_sequence(programs['core0'][0],num_mutations=self.num_mutations,max_cycle=self.max_cycle,min_address=self.min_address_core0,max_address=self.max_address_core0)
-        mutated1 = mutate_instruction_sequence(programs['core1'][0],num_mutations=self.num_mutations,max_cycle=self.max_cycle,min_address=self.min_address_core1,max_address=self.max_address_core1)
+        mutated0 = mutate_instruction_sequence(programs['core0'][0],num_mutations=self.num_mutations,max_cycle=self.max_cycle,min_address=self.min_address_core0,max_address=self.max_address_core0,rng=self.rng)
+        mutated1 = mutate_instruction_sequence(programs['core1'][0],num_mutations=self.num_mutations,max_cycle=self.max_cycle,min_address=self.min_address_core1,max_address=self.max_address_core1,rng=self.rng)
         return {'core0':mutated0,'core1':mutated1}
@@ -4,20 +4,30 @@ import sys
 sys.path.append("../../")
 from exploration.history import History
 class GoalGenerator:
+    """
+    rng: numpy.random.Generator. Generator of the goals, the global numpy.random state by default.
+    """
     def __init__(self,
+                 rng:np.random.Generator = None,
                  ):
-        pass
-    def __call__(self,H:History, module:int)->np.ndarray:
-        Tab = H.as_tab()
-        if module ==Tab.shape[1]:
-            min_ = np.array(H.shared_resource_list).min(axis=0)
-            max_ = np.array(H.shared_resource_list).max(axis=0)
-        else:
-            stat = Tab[:,module]
-            min_ = stat.min(axis=-1)
-            max_ = stat.max(axis=-1)
+        self.rng = rng if rng is not None else np.random
+    def bounds(self,H:History, module:int)->tuple:
+        """(low, high) of the uniform distribution of the goals of ``module``, from the running bounds of H"""
+        min_, max_ = H.bounds(module)
         if np.max(max_)>1.0:
-            out = np.random.uniform((1-np.sign(min_)*0.6)*min_,2.0*max_)
-        else:
-            out = np.random.uniform(min_,max_)
-        return out
+            return (1-np.sign(min_)*0.6)*min_,2.0*max_
+        return min_,max_
+    def __call__(self,H:History, module:int)->np.ndarray:
+        low, high = self.bounds(H, module)
+        return self.rng.uniform(low,high)
+    def sample(self,H:History, modules, n:int = None)->list[np.ndarray]:
+        """
+        n goals at once, the bounds of every module being computed once.
+        modules: int or list. Module of all the goals, or of every goal (n is then its length).
+        The goals are drawn in order, as n calls to ``__call__`` would.
+        """
+        if np.ndim(modules)==0:
+            modules = [modules]*n
+        assert n is None or len(modules)==n, f"{len(modules)} modules for {n} goals"
+        bounds = {module:self.bounds(H, module) for module in set(modules)}
+        return [self.rng.uniform(*bounds[module]) for module in modules]
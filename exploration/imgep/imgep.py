@@ -6,6 +6,7 @@ from exploration.history import History
 from  exploration.imgep.OptimizationPolicy import OptimizationPolicykNN
 from exploration.imgep.goal_generator import GoalGenerator
 import random
+from concurrent.futures import FIRST_COMPLETED, wait
 
 from codegeneration import generate_instruction_sequence
 from exploration.random.func import RANDOM
@@ -17,6 +18,11 @@ class IMGEP:
     H: History. Buffer containing codes and signature pairs
     G: GoalGenerator.
     Pi: OptimizationPolicy.
+    batch_size: int. Number of parameters generated from the same history and evaluated together with ``E.evaluate_many``
+    packed: bool. Explores packed programs (see simulator/program.py) instead of dictionaries
+    rng: random.Random. Generator of the module choice, the global random module by default.
+    random_rng: random.Random. Generator of the random initialisation, ``rng`` by default.
+    Seeding every component from one seed is described in exploration/seed.py.
     """
     def __init__(self,
                 N:int,
@@ -30,6 +36,10 @@ class IMGEP:
                 max_address_core0=10,
                 min_address_core1=11,
                 max_address_core1=21,
+                batch_size:int = 1,
+                packed:bool = False,
+                rng:random.Random = None,
+                random_rng:random.Random = None,
                 ):
         self.N = N
         self.env = E
@@ -40,7 +50,9 @@ class IMGEP:
         self.periode = periode
         self.modules = None
         self.start = 0
-        self.random_explor = RANDOM(self.N_init,self.env,self.H,min_address_core0,max_address_core0,min_address_core1,max_address_core1)
+        self.batch_size = batch_size
+        self.rng = rng if rng is not None else random
+        self.random_explor = RANDOM(self.N_init,self.env,self.H,min_address_core0,max_address_core0,min_address_core1,max_address_core1,batch_size=batch_size,packed=packed,rng=random_rng if random_rng is not None else self.rng)
     def take(self,sample:dict,start:int): 
         """Takes the ``start`` first steps from the ``sample`` dictionnary to initialize the exploration. 
         Then the iterator i is set to ``start`` directly
@@ -49,20 +61,99 @@ class IMGEP:
         self.H.memory_perf = sample["memory_perf"]
         self.H.memory_program["core0"] = sample["memory_program"]["core0"]
         self.H.memory_program["core1"] = sample["memory_program"]["core1"]
+    def resume(self):
+        """Reloads the samples flushed to the on-disk store of ``H`` and continues the exploration after them"""
+        self.start = self.H.resume()
+        self.random_explor.start = min(self.start,self.N_init)
     def __call__(self):
         start_time = time.time()
         """Performs the exploration.
         """
-        if self.start==0:
+        if self.start<self.N_init:
             self.random_explor()
         self.modules = range(self.H.as_tab().shape[1]+1)#average data + shared events
-        for i in range(self.N_init,self.N):
-            if i%1000==0 or i==self.N-1:
-                print(f'step {i}/{self.N-1}')
-            if (i-self.N_init)%self.periode==0 and i>=self.N_init:
-                module = random.choice(self.modules)
-                goal = self.G(self.H, module = module)
-            parameter = self.Pi(goal,self.H, module)
-            observation = self.env(parameter)
-            self.H.store({"program":parameter}|observation)
+        goal = None
+        for i in range(max(self.N_init,self.start),self.N,self.batch_size):
+            # modules of the batch, then its goals and parameters with the batch APIs of G and Pi
+            modules = []
+            new_goals = [] # positions in the batch where a new goal is drawn
+            for j in range(i,min(i+self.batch_size,self.N)):
+                if j%1000==0 or j==self.N-1:
+                    print(f'step {j}/{self.N-1}')
+                if ((j-self.N_init)%self.periode==0 or (goal is None and not new_goals)) and j>=self.N_init:
+                    module = self.rng.choice(self.modules)
+                    new_goals.append(len(modules))
+                modules.append(module)
+            drawn = iter(self.G.sample(self.H,[modules[n] for n in new_goals]))
+            goals = []
+            for n in range(len(modules)):
+                if n in new_goals:
+                    goal = next(drawn)
+                goals.append(goal)
+            parameters = self.Pi.propose_batch(goals,self.H,modules)
+            for parameter, observation in zip(parameters,self.env.evaluate_many(parameters)):
+                self.H.store({"program":parameter}|observation)
+        self.H.flush()
         print(time.time() - start_time)
+        if self.env.cache is not None:
+            print('simulation cache', self.env.cache.stats())
+
+
+class AsyncIMGEP(IMGEP):
+    """
+    Steady-state variant of IMGEP: ``in_flight`` evaluations are kept running in the process pool of the
+    environment (``E.submit``), new parameters being proposed from the history as it stands while earlier
+    simulations run, and the observations being stored as they come back. Same arguments as IMGEP, plus:
+    in_flight: int. Number of parameters proposed and not stored yet, about twice ``E.num_workers``.
+    ordered: bool. Stores the observations in the order of the proposals, so that a run is reproducible:
+    the parameter j is proposed from the history of the first j-in_flight+1 parameters (with in_flight=1
+    and batch_size=1, the run of IMGEP). Otherwise they are stored as soon as they are done.
+    max_staleness: int. When not ordered, no parameter is proposed while the evaluation of a parameter
+    proposed more than ``max_staleness`` proposals before is running, so that the history a proposal
+    is made from lacks none of the older observations. None for no bound other than ``in_flight``.
+    """
+    def __init__(self,*args,in_flight:int = 4,ordered:bool = True,max_staleness:int = None,**kwargs):
+        super().__init__(*args,**kwargs)
+        assert in_flight>=1, "at least one evaluation in flight"
+        self.in_flight = in_flight
+        self.ordered = ordered
+        self.max_staleness = max_staleness
+        self.goal = None
+        self.module = None
+    def propose(self,j:int)->dict:
+        """Parameter of the step j from the history as it stands"""
+        if (j-self.N_init)%self.periode==0 or self.goal is None:
+            self.module = self.rng.choice(self.modules)
+            self.goal = self.G(self.H, module = self.module)
+        return self.Pi(self.goal,self.H, self.module)
+    def stale(self,j:int,pending:dict)->bool:
+        if self.ordered or self.max_staleness is None or not pending:
+            return False
+        return j-min(step for step,_ in pending.values())>self.max_staleness
+    def __call__(self):
+        start_time = time.time()
+        if self.start<self.N_init:
+            self.random_explor()
+        self.modules = range(self.H.as_tab().shape[1]+1)#average data + shared events
+        self.goal = None
+        pending = {} # future: (step, parameter)
+        j = max(self.N_init,self.start)
+        while j<self.N or pending:
+            while j<self.N and len(pending)<self.in_flight and not self.stale(j,pending):
+                if j%1000==0 or j==self.N-1:
+                    print(f'step {j}/{self.N-1}')
+                parameter = self.propose(j)
+                pending[self.env.submit(parameter)] = (j,parameter)
+                j+=1
+            if self.ordered:
+                done = [min(pending,key=lambda future: pending[future][0])]
+            else:
+                done,_ = wait(pending,return_when=FIRST_COMPLETED)
+                done = sorted(done,key=lambda future: pending[future][0])
+            for future in done:
+                _,parameter = pending.pop(future)
+                self.H.store({"program":parameter}|self.env.collect(future))
+        self.H.flush()
+        print(time.time() - start_time)
+        if self.env.cache is not None:
+            print('simulation cache', self.env.cache.stats())
@@ -55,23 +55,27 @@
 
 
 import random
+import numpy as np
+from simulator.program import EMPTY, cycles as program_cycles, is_packed, pack
 
-def mix_sequences(sequences, num_parts=3, seed=None, max_cycle=60):
+def mix_sequences(sequences, num_parts=3, seed=None, max_cycle=60, rng=random):
     """
     Mix contiguous parts from multiple instruction sequences, preserving timing,
     and ensuring the resulting sequence fits within a maximum cycle range.
 
     Args:
-        sequences (list[dict]): list of input sequences, each {cycle: (type, address)}
+        sequences (list[dict]): list of input sequences, each {cycle: (type, address)} or packed
         num_parts (int): number of contiguous parts to extract and mix
         seed (int, optional): random seed for reproducibility
         max_cycle (int): maximum allowed cycle for final mixed sequence
+        rng (random.Random): generator used for the draws (default: the global random module)
 
     Returns:
-        dict: new mixed sequence {cycle: (type, address)}
+        dict: new mixed sequence {cycle: (type, address)}, packed if the first input sequence is packed
     """
     if seed is not None:
-        random.seed(seed)
+        rng.seed(seed)
+    packed = is_packed(sequences[0])
 
     mixed = {}
     current_time = 0
@@ -82,23 +86,23 @@ def mix_sequences(sequences, num_parts=3, seed=None, max_cycle=60):
             break
 
         # Choose a random sequence
-        seq = random.choice(sequences)
-        if not seq:
-            continue
+        seq = rng.choice(sequences)
+        if packed and not is_packed(seq):
+            seq = pack(seq)
 
         # Sort cycles
-        cycles = sorted(seq.keys())
+        cycles = program_cycles(seq)
         if not cycles:
             continue
 
         # Choose random start
-        start = random.choice(cycles)
+        start = rng.choice(cycles)
 
         # Choose random contiguous slice length
         max_len = len(cycles) - cycles.index(start)
         if max_len <= 0:
             continue
-        length = random.randint(1, max_len)
+        length = rng.randint(1, max_len)
 
         # Extract contiguous block
         block_cycles = cycles[cycles.index(start):cycles.index(start) + length]
@@ -123,10 +127,14 @@ def mix_sequences(sequences, num_parts=3, seed=None, max_cycle=60):
         mixed.update(shifted_block)
 
         # Update current_time with random gap, but not beyond max_cycle
-        next_time = max(shifted_block.keys()) + random.randint(1, 5)
+        next_time = max(shifted_block.keys()) + rng.randint(1, 5)
         if next_time > max_cycle:
             break
         current_time = next_time
 
+    if packed:
+        out = np.full(max_cycle + 1, EMPTY, dtype=np.int32)
+        out[list(mixed.keys())] = list(mixed.values())
+        return out
     return dict(sorted(mixed.items()))
 
@@ -1,38 +1,51 @@
 import random
+import numpy as np
+from simulator.program import EMPTY, is_packed, pack
 
-def random_mix_sequences(sequences, seed=None, max_gap=5,max_cycle=60):
+def random_mix_sequences(sequences, seed=None, max_gap=5,max_cycle=60, rng=random):
     """
     Randomly mix all instructions from multiple sequences, preserving relative timing.
 
     Args:
-        sequences (list[dict]): list of input sequences, each {cycle: (type, address)}
+        sequences (list[dict]): list of input sequences, each {cycle: (type, address)} or packed
         seed (int, optional): random seed for reproducibility
         max_gap (int): maximum random gap (in cycles) between successive instructions
+        rng (random.Random): generator used for the draws (default: the global random module)
 
     Returns:
-        dict: new mixed sequence {cycle: (type, address)} with randomized order and timing
+        dict: new mixed sequence {cycle: (type, address)} with randomized order and timing,
+        packed if the first input sequence is packed
     """
     if seed is not None:
-        random.seed(seed)
+        rng.seed(seed)
+    packed = is_packed(sequences[0])
 
-    # Flatten all instructions into a single list [(type, address), ...]
+    # Flatten all instructions into a single list [(type, address), ...], or of packed slots
     all_instructions = []
     for seq in sequences:
-        all_instructions.extend(list(seq.values()))
+        if packed:
+            seq = pack(seq)
+            all_instructions.extend(seq[seq >= 0].tolist())
+        else:
+            all_instructions.extend(list(seq.values()))
 
     # Randomize instruction order
-    random.shuffle(all_instructions)
+    rng.shuffle(all_instructions)
 
     # Build new sequence with random cycle gaps
     mixed = {}
     current_cycle = 0
     for op in all_instructions:
         # Random gap between 1 and max_gap cycles
-        current_cycle += random.randint(1, max_gap)
+        current_cycle += rng.randint(1, max_gap)
         mixed[current_cycle] = op
 
     out =  dict(sorted(mixed.items()))
     out = {key:out[key] for key in out.keys() if key <= max_cycle}
+    if packed:
+        packed_out = np.full(max_cycle + 1, EMPTY, dtype=np.int32)
+        packed_out[list(out.keys())] = list(out.values())
+        return packed_out
     return out
 
 #seq1 = {0: ('read', 1), 1: ('write', 2), 3: ('read', 3)}
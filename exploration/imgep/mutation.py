@@ -1,7 +1,9 @@
 import random 
 import copy
+import numpy as np
+from simulator.program import EMPTY, OPCODES, is_packed, resize
 
-def mutate_instruction_sequence(instructions, num_mutations=1, max_cycle=60, min_address = 0,max_address=19):
+def mutate_instruction_sequence(instructions, num_mutations=1, max_cycle=60, min_address = 0,max_address=19, rng=random):
     """
     Mutate an instruction sequence by adding, deleting, or modifying instructions.
     
@@ -10,12 +12,15 @@ def mutate_instruction_sequence(instructions, num_mutations=1, max_cycle=60, min
         num_mutations: Number of mutations to perform
         max_cycle: Maximum cycle number (default: 60)
         max_address: Maximum memory address (default: 19)
+        rng: random.Random used for the draws (default: the global random module)
     
     Returns:
-        New mutated dictionary
+        New mutated dictionary, or packed array if ``instructions`` is packed
     """
-    # Create a deep copy to avoid modifying the original
-    mutated = copy.deepcopy(instructions)
+    if is_packed(instructions):
+        return mutate_packed_sequence(instructions, num_mutations, max_cycle, min_address, max_address, rng)
+    # Copy to avoid modifying the original, the (type, address) tuples are immutable
+    mutated = dict(instructions)
     instruction_types = ['read', 'write']
     
     # Get all possible cycles (0 to max_cycle)
@@ -24,29 +29,29 @@ def mutate_instruction_sequence(instructions, num_mutations=1, max_cycle=60, min
     available_cycles = list(all_cycles - used_cycles)
     
     for _ in range(num_mutations):
-        mutation_type = random.choice(['add', 'delete', 'modify'])
+        mutation_type = rng.choice(['add', 'delete', 'modify'])
         
         if mutation_type == 'add' and available_cycles:
             # Add a new instruction at an available cycle
-            new_cycle = random.choice(available_cycles)
-            instr_type = random.choice(instruction_types)
-            address = random.randint(0, max_address)
+            new_cycle = rng.choice(available_cycles)
+            instr_type = rng.choice(instruction_types)
+            address = rng.randint(0, max_address)
             mutated[new_cycle] = (instr_type, address)
             available_cycles.remove(new_cycle)
             
         elif mutation_type == 'delete' and mutated:
             # Delete a random existing instruction
-            cycle_to_delete = random.choice(list(mutated.keys()))
+            cycle_to_delete = rng.choice(list(mutated.keys()))
             del mutated[cycle_to_delete]
             available_cycles.append(cycle_to_delete)
             
         elif mutation_type == 'modify' and mutated:
             # Modify an existing instruction
-            cycle_to_modify = random.choice(list(mutated.keys()))
+            cycle_to_modify = rng.choice(list(mutated.keys()))
             old_type, old_address = mutated[cycle_to_modify]
             
             # Choose what to modify: type, address, or both
-            modify_choice = random.choice(['type', 'address', 'both'])
+            modify_choice = rng.choice(['type', 'address', 'both'])
             
             if modify_choice == 'type':
                 # Change instruction type only
@@ -54,15 +59,52 @@ def mutate_instruction_sequence(instructions, num_mutations=1, max_cycle=60, min
                 mutated[cycle_to_modify] = (new_type, old_address)
             elif modify_choice == 'address':
                 # Change address only
-                new_address = random.randint(min_address, max_address)
+                new_address = rng.randint(min_address, max_address)
                 mutated[cycle_to_modify] = (old_type, new_address)
             else:
                 # Change both type and address
                 new_type = 'write' if old_type == 'read' else 'read'
-                new_address = random.randint(min_address, max_address)
+                new_address = rng.randint(min_address, max_address)
                 mutated[cycle_to_modify] = (new_type, new_address)
     
     return mutated
 
-def mutate_paire_instructions(programs0,programs1,num_mutations, max_cycle=60, max_address=19):
-    return mutate_instruction_sequence(programs0,num_mutations,max_cycle = max_cycle,max_address=max_address),mutate_instruction_sequence(programs1,num_mutations,max_cycle = max_cycle,max_address=max_address)
+def mutate_packed_sequence(instructions, num_mutations=1, max_cycle=60, min_address = 0,max_address=19, rng=random):
+    """
+    Same mutations as ``mutate_instruction_sequence`` on a packed program (see simulator/program.py).
+    Occupied and free cycles are drawn in cycle order.
+    """
+    mutated = resize(instructions, max(max_cycle, len(instructions) - 1))
+    instruction_types = ['read', 'write']
+    
+    for _ in range(num_mutations):
+        mutation_type = rng.choice(['add', 'delete', 'modify'])
+        used_cycles = np.flatnonzero(mutated >= 0)
+        available_cycles = np.flatnonzero(mutated[:max_cycle + 1] < 0)
+        
+        if mutation_type == 'add' and len(available_cycles):
+            new_cycle = rng.choice(available_cycles)
+            instr_type = rng.choice(instruction_types)
+            address = rng.randint(0, max_address)
+            mutated[new_cycle] = (address << 1) | OPCODES[instr_type]
+            
+        elif mutation_type == 'delete' and len(used_cycles):
+            mutated[rng.choice(used_cycles)] = EMPTY
+            
+        elif mutation_type == 'modify' and len(used_cycles):
+            cycle_to_modify = rng.choice(used_cycles)
+            op, address = mutated[cycle_to_modify] & 1, mutated[cycle_to_modify] >> 1
+            
+            # Choose what to modify: type, address, or both
+            modify_choice = rng.choice(['type', 'address', 'both'])
+            
+            if modify_choice in ['type', 'both']:
+                op ^= 1
+            if modify_choice in ['address', 'both']:
+                address = rng.randint(min_address, max_address)
+            mutated[cycle_to_modify] = (address << 1) | op
+    
+    return mutated
+
+def mutate_paire_instructions(programs0,programs1,num_mutations, max_cycle=60, max_address=19, rng=random):
+    return mutate_instruction_sequence(programs0,num_mutations,max_cycle = max_cycle,max_address=max_address,rng=rng),mutate_instruction_sequence(programs1,num_mutations,max_cycle = max_cycle,max_address=max_address,rng=rng)
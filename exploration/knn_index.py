@@ -0,0 +1,166 @@
+import numpy as np
+
+
+class SortedIndex:
+    """
+    Nearest neighbour index of a scalar feature, updated one observation at a time.
+    The distinct values are kept sorted, each with the ids of the observations that share it,
+    so a query only walks outwards from the goal until k ids are collected.
+    ``query_many`` also reads the ids from one array sorted by (value, id), with the number of ids of
+    every value. These arrays are only built by ``query_many``, when ``add`` has made them stale.
+    Ties in distance are broken by the lowest id.
+    """
+    MIN_BATCH = 10 # fewer goals are walked one by one, faster than the fixed cost of the arrays of ``query_many``
+    def __init__(self):
+        self.values = np.zeros(0)
+        self.ids = []
+        self.size = 0
+        self.flat_ids = None # ids sorted by (value, id), None when stale
+        self.counts = None
+        self.starts = None
+    def __len__(self):
+        return self.size
+    def add(self, value:float, id_:int):
+        value = float(value)
+        i = np.searchsorted(self.values, value)
+        if i<len(self.values) and self.values[i]==value:
+            self.ids[i].append(id_)
+        else:
+            self.values = np.insert(self.values, i, value)
+            self.ids.insert(i, [id_])
+        self.size+=1
+        self.flat_ids = None
+    def build(self):
+        """Arrays of ``query_many``: the ids sorted by (value, id), the number of ids and first position of every value"""
+        self.counts = np.fromiter(map(len, self.ids), dtype=np.int64, count=len(self.ids))
+        self.starts = np.cumsum(self.counts) - self.counts
+        self.flat_ids = np.fromiter((id_ for ids in self.ids for id_ in sorted(ids)), dtype=np.int64, count=self.size)
+    def query(self, goal:float, k:int)->list[int]:
+        assert len(self.ids)>0, "index empty"
+        goal = float(goal)
+        return self.walk(goal, int(np.searchsorted(self.values, goal)), k)
+    def query_many(self, goals:np.ndarray, k:int)->list[list[int]]:
+        """
+        ``query`` of every goal, with the same result, for all the goals at once.
+        Every value holds at least one id, so the k closest ids are among the k values on each side of the
+        position of the goal, and among the k lowest ids of each of them. These (value, id) pairs of a
+        window of 2k values are gathered for all the goals in one array, sorted by (distance, id) per goal.
+        """
+        assert len(self.ids)>0, "index empty"
+        goals = np.asarray(goals, dtype=np.float64).reshape(-1)
+        positions = np.searchsorted(self.values, goals)
+        if len(goals)<self.MIN_BATCH:
+            return [self.walk(goal, hi, k) for goal, hi in zip(goals.tolist(), positions.tolist())]
+        if self.flat_ids is None:
+            self.build()
+        n = len(self.values)
+        k = min(k, self.size)
+        window = positions[:, None] + np.arange(-min(k, n), min(k, n)) # (goals, 2k)
+        valid = (window>=0)&(window<n)
+        window = np.clip(window, 0, n-1)
+        rank = np.arange(min(k, self.counts.max()))
+        valid = valid[:, :, None]&(rank<self.counts[window][:, :, None]) # (goals, 2k, k)
+        ids = self.flat_ids[np.minimum(self.starts[window][:, :, None] + rank, self.size-1)]
+        d = np.where(valid, ((goals[:, None] - self.values[window])**2)[:, :, None], np.inf)
+        ids, d = ids.reshape(len(goals), -1), d.reshape(len(goals), -1)
+        order = np.lexsort((ids, d), axis=-1)[:, :k]
+        return ids[np.arange(len(goals))[:, None], order].tolist()
+    def walk(self, goal:float, hi:int, k:int)->list[int]:
+        # k closest ids, walking outwards from the position hi of the goal in the sorted values
+        lo = hi-1
+        out = []
+        while len(out)<k and (lo>=0 or hi<len(self.values)):
+            d_lo = (goal-self.values[lo])**2 if lo>=0 else np.inf
+            d_hi = (goal-self.values[hi])**2 if hi<len(self.values) else np.inf
+            d = min(d_lo, d_hi)
+            group = []
+            if d_lo==d:
+                group+=self.ids[lo]
+                lo-=1
+            if d_hi==d:
+                group+=self.ids[hi]
+                hi+=1
+            out+=sorted(group)
+        return out[:k]
+    def nearest(self, value:float)->int:
+        """Lowest id among the observations at the smallest absolute distance of ``value``, as ``argmin`` gives"""
+        assert len(self.ids)>0, "index empty"
+        hi = int(np.searchsorted(self.values, value))
+        if hi==len(self.values):
+            return self.ids[hi-1][0]
+        if hi==0:
+            return self.ids[0][0]
+        d_lo, d_hi = abs(value-self.values[hi-1]), abs(value-self.values[hi])
+        if d_lo==d_hi:
+            return min(self.ids[hi-1][0], self.ids[hi][0])
+        return self.ids[hi-1][0] if d_lo<d_hi else self.ids[hi][0]
+
+
+class VectorIndex:
+    """
+    Nearest neighbour index of a vector feature (squared euclidean distance), updated one observation at a time.
+    Identical vectors are stored once in a preallocated matrix, grown geometrically, with the ids sharing them.
+    A query computes the distances to the distinct vectors and selects the k closest with ``argpartition``.
+    Ties in distance are broken by the lowest id.
+    """
+    def __init__(self, capacity:int = 1024):
+        self.capacity = capacity
+        self.vectors = None
+        self.size = 0
+        self.ids = []
+        self.position = {}
+    def __len__(self):
+        return sum(len(ids) for ids in self.ids)
+    def add(self, vector:np.ndarray, id_:int):
+        vector = np.asarray(vector, dtype=np.float64).reshape(-1)
+        key = vector.tobytes()
+        if key in self.position:
+            self.ids[self.position[key]].append(id_)
+            return
+        if self.vectors is None:
+            self.vectors = np.zeros((self.capacity, vector.shape[0]))
+        elif self.size==self.vectors.shape[0]:
+            self.vectors = np.concatenate((self.vectors, np.zeros_like(self.vectors)), axis=0)
+        self.vectors[self.size] = vector
+        self.position[key] = self.size
+        self.ids.append([id_])
+        self.size+=1
+    def query(self, goal:np.ndarray, k:int)->list[int]:
+        assert self.size>0, "index empty"
+        d = np.sum((np.asarray(goal).reshape(1,-1) - self.vectors[:self.size])**2, axis=1)
+        if k<self.size:
+            # every distinct vector holds at least one id, the k closest ids are among the vectors
+            # closer than or as close as the k-th closest vector
+            threshold = np.partition(d, k-1)[k-1]
+            candidates = np.flatnonzero(d<=threshold)
+        else:
+            candidates = range(self.size)
+        out = sorted((d[c], id_) for c in candidates for id_ in self.ids[c])
+        return [id_ for _, id_ in out[:k]]
+    def query_many(self, goals:np.ndarray, k:int)->list[list[int]]:
+        """
+        ``query`` of every row of ``goals``, with the same result.
+        The distances to all the vectors are computed at once as |g|^2 + |v|^2 - 2 g.v (one matrix
+        product), which is only accurate up to rounding: the vectors within a rounding margin of the
+        k-th closest are selected with it, and their distances are then computed exactly as ``query`` does.
+        Only the matrix product is shared by the goals, the exact selection is still made goal by goal:
+        it pays off with many stored vectors, not with few goals.
+        """
+        assert self.size>0, "index empty"
+        vectors = self.vectors[:self.size]
+        goals = np.asarray(goals, dtype=np.float64).reshape(-1, vectors.shape[1])
+        if k>=self.size:
+            return [self.query(goal, k) for goal in goals]
+        norms = np.sum(vectors**2, axis=1)
+        goal_norms = np.sum(goals**2, axis=1)
+        d = goal_norms[:, None] + norms[None, :] - 2*goals@vectors.T
+        margins = 1e-9*(goal_norms+norms.max()+1)
+        thresholds = np.partition(d, k-1, axis=1)[:, k-1] + 2*margins
+        out = []
+        for goal, row, threshold in zip(goals, d, thresholds):
+            candidates = np.flatnonzero(row<=threshold)
+            exact = np.sum((goal.reshape(1,-1) - vectors[candidates])**2, axis=1)
+            kth = np.partition(exact, k-1)[k-1]
+            row_out = sorted((exact[i], id_) for i in np.flatnonzero(exact<=kth) for id_ in self.ids[candidates[i]])
+            out.append([id_ for _, id_ in row_out[:k]])
+        return out
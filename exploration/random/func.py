@@ -15,7 +15,10 @@ class RANDOM:
                     min_address_core0 = 0 ,
                     max_address_core0 = 10,
                     min_address_core1 = 11,
-                    max_address_core1 = 21
+                    max_address_core1 = 21,
+                    batch_size = 1,
+                    packed = False,
+                    rng:random.Random = None,
 
             ):
         """
@@ -23,6 +26,9 @@ class RANDOM:
         H: History. Buffer containing codes and signature pairs
         max_l: int. Max length for of the instruction sequences
         E: Env. The environnement.
+        batch_size: int. Number of parameters sent at once to ``E.evaluate_many``
+        packed: bool. Generates packed programs (see simulator/program.py) instead of dictionaries
+        rng: random.Random. Generator of the programs, the global random module by default
         """
         self.env = E
         self.H = H
@@ -32,14 +38,24 @@ class RANDOM:
         self.max_address_core0 = max_address_core0
         self.min_address_core1 = min_address_core1
         self.max_address_core1 = max_address_core1
+        self.batch_size = batch_size
+        self.packed = packed
+        self.rng = rng if rng is not None else random
+        self.start = 0
     def __call__(self):
         start_time = time.time()
-        for i in range(self.N):
-            if i%1000==0 or i==self.N-1:
-                print(f'step {i}/{self.N-1}')
-            code0 = generate_instruction_sequence(None,max_cycle = self.max_cycle,min_address=self.min_address_core0,max_address = self.max_address_core0)
-            code1 = generate_instruction_sequence(None,max_cycle = self.max_cycle,min_address=self.min_address_core1,max_address = self.max_address_core1)
-            parameter = {'core0':code0,
-                        'core1':code1}
-            self.H.store({"program":parameter}|self.env(parameter))
+        for i in range(self.start,self.N,self.batch_size):
+            parameters = []
+            for j in range(i,min(i+self.batch_size,self.N)):
+                if j%1000==0 or j==self.N-1:
+                    print(f'step {j}/{self.N-1}')
+                code0 = generate_instruction_sequence(None,max_cycle = self.max_cycle,min_address=self.min_address_core0,max_address = self.max_address_core0,packed=self.packed,rng=self.rng)
+                code1 = generate_instruction_sequence(None,max_cycle = self.max_cycle,min_address=self.min_address_core1,max_address = self.max_address_core1,packed=self.packed,rng=self.rng)
+                parameters.append({'core0':code0,
+                                   'core1':code1})
+            for parameter, observation in zip(parameters,self.env.evaluate_many(parameters)):
+                self.H.store({"program":parameter}|observation)
+        self.H.flush()
         print(time.time() - start_time)
+        if self.env.cache is not None:
+            print('simulation cache', self.env.cache.stats())
@@ -0,0 +1,50 @@
+"""
+Seed-splitting scheme of an exploration.
+
+A run is reproduced from a single root seed. ``split_seed(seed)`` spawns one independent
+``numpy.random.SeedSequence`` per consumer, always in the order of ``STREAMS``:
+- 'env': root of the simulations. The simulation of a program pair uses
+  ``simulation_seed(env_seed, key)``, where ``key`` is the content hash of the pair and of the
+  simulator configuration (``exploration.env.cache.program_key``). The interconnect jitter of a
+  simulation therefore only depends on what is simulated, not on when, in which batch or on
+  which worker it runs, and cached, pooled and batched results are bit for bit the ones of a
+  serial run.
+- 'random': program generation of the random initialisation (``RANDOM``).
+- 'imgep': module choice of ``IMGEP``.
+- 'policy': mixing and mutation of ``OptimizationPolicykNN``.
+- 'goal': goal sampling of ``GoalGenerator``.
+The python streams are ``random.Random`` instances, the numpy ones ``numpy.random.Generator``.
+"""
+import random
+import numpy as np
+
+STREAMS = ['env', 'random', 'imgep', 'policy', 'goal']
+
+def as_seed_sequence(seed)->np.random.SeedSequence:
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    return np.random.SeedSequence(seed)
+
+def split_seed(seed)->dict:
+    """One SeedSequence per stream of ``STREAMS``"""
+    return dict(zip(STREAMS, as_seed_sequence(seed).spawn(len(STREAMS))))
+
+def python_rng(seed)->random.Random:
+    return random.Random(int(as_seed_sequence(seed).generate_state(1, np.uint64)[0]))
+
+def numpy_rng(seed)->np.random.Generator:
+    return np.random.default_rng(as_seed_sequence(seed))
+
+def simulation_seed(seed, key:str)->np.random.SeedSequence:
+    """Seed of the simulation whose content hash is ``key``, a child of ``seed``"""
+    seed = as_seed_sequence(seed)
+    return np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key+(int(key[:16], 16), int(key[16:32], 16)))
+
+def make_rngs(seed)->dict:
+    """Ready to use random generators of every stream, 'env' being left as a SeedSequence for ``Env``"""
+    seeds = split_seed(seed)
+    return {'env':seeds['env'],
+            'random':python_rng(seeds['random']),
+            'imgep':python_rng(seeds['imgep']),
+            'policy':python_rng(seeds['policy']),
+            'goal':numpy_rng(seeds['goal'])}
@@ -0,0 +1,146 @@
+import json
+import os
+import numpy as np
+from simulator.program import is_packed
+
+
+def to_json(o):
+    # numpy scalars found in programs and shared resource events
+    if hasattr(o, 'item'):
+        return o.item()
+    raise TypeError(f'{type(o)} is not serializable')
+
+def program2list(inst)->list:
+    if is_packed(inst):
+        return inst.tolist()
+    return [[int(cycle), op, int(addr)] for cycle, (op, addr) in dict(inst).items()]
+
+def list2program(inst:list, packed:bool = False):
+    if packed:
+        return np.array(inst, dtype=np.int32)
+    return {cycle:(op, addr) for cycle, op, addr in inst}
+
+
+class HistoryStore:
+    """
+    Append-only on-disk store of an exploration, written in chunks by ``History.flush``.
+    path: str. Directory of the store, created if needed. An existing store is opened for appending.
+    Layout of the directory:
+    - one raw float64 file per feature ``{key1}.{key2}.f64`` (plus ``reward.f64`` and ``alp.f64``),
+      rows appended one sample after the other, memory-mappable with ``read``
+    - ``programs.jsonl``: one line per sample, the two instruction sequences as [cycle, op, addr] lists,
+      or as the list of slots for packed programs (see simulator/program.py)
+    - ``events.jsonl``: one line per sample with shared resource events
+    - ``state_{size}.npz``: the diversity bookkeeping of History needed to resume, written at every flush
+    - ``meta.json``: number of samples, feature shapes and byte length of every file. It is written last,
+      so after a crash everything past the recorded lengths is discarded when the store is opened again.
+    """
+    def __init__(self, path:str):
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+        self.size = 0
+        self.features = {} # name: shape of one sample
+        self.columns = []
+        self.lengths = {}
+        self.state_file = None
+        self.packed = None
+        if os.path.isfile(self.file('meta.json')):
+            with open(self.file('meta.json')) as f:
+                meta = json.load(f)
+            self.size = meta['size']
+            self.features = {name:tuple(shape) for name, shape in meta['features']}
+            self.columns = meta['columns']
+            self.lengths = meta['lengths']
+            self.state_file = meta['state']
+            self.packed = meta['packed']
+        # drops what was written after the last complete flush
+        for filename in os.listdir(self.path):
+            if filename.endswith(('.f64', '.jsonl')):
+                length = self.lengths.get(filename, 0)
+                if os.path.getsize(self.file(filename))!=length:
+                    os.truncate(self.file(filename), length)
+            elif filename.startswith('state_') and filename!=self.state_file:
+                os.remove(self.file(filename))
+    def __len__(self):
+        return self.size
+    def file(self, filename:str)->str:
+        return os.path.join(self.path, filename)
+    def feature_file(self, name:str)->str:
+        return name.replace('/', '.')+'.f64'
+    def write(self, filename:str, write_fn, mode:str):
+        with open(self.file(filename), mode) as f:
+            write_fn(f)
+    def replace(self, filename:str, write_fn, mode:str = 'w'):
+        # write then rename, so that a crash never leaves a partial file
+        tmp = self.file(filename+'.tmp')
+        with open(tmp, mode) as f:
+            write_fn(f)
+        os.replace(tmp, self.file(filename))
+    def append(self, arrays:dict, programs:list[tuple], events:list[tuple], state:dict, columns:list[str] = None):
+        """
+        Appends a chunk of samples.
+        arrays: dict. feature name: array of shape (chunk,)+feature shape
+        programs: list. (core0, core1) instruction sequences of every sample of the chunk
+        events: list. (sample id, key1, list of events) for the samples that have shared resource events
+        state: dict. Arrays saved in the state file
+        """
+        n = len(programs)
+        if self.packed is None and n:
+            self.packed = is_packed(programs[0][0])
+        for name, value in arrays.items():
+            value = np.ascontiguousarray(value, dtype=np.float64)
+            assert value.shape[0]==n, f'{name}: {value.shape[0]} rows for {n} samples'
+            if name not in self.features:
+                self.features[name] = value.shape[1:]
+            self.write(self.feature_file(name), value.tofile, 'ab')
+        self.write('programs.jsonl', lambda f: f.writelines(json.dumps([program2list(core0), program2list(core1)], default=to_json)+'\n' for core0, core1 in programs), 'a')
+        self.write('events.jsonl', lambda f: f.writelines(json.dumps([j, key1, value], default=to_json)+'\n' for j, key1, value in events), 'a')
+        self.size+=n
+        previous_state, self.state_file = self.state_file, f'state_{self.size}.npz'
+        self.replace(self.state_file, lambda f: np.savez(f, **state), 'wb')
+        if columns is not None:
+            self.columns = columns
+        self.lengths = {filename:os.path.getsize(self.file(filename)) for filename in os.listdir(self.path) if filename.endswith(('.f64', '.jsonl'))}
+        meta = {'size':self.size,
+                'features':[[name, list(shape)] for name, shape in self.features.items()],
+                'columns':self.columns,
+                'lengths':self.lengths,
+                'state':self.state_file,
+                'packed':self.packed}
+        self.replace('meta.json', lambda f: json.dump(meta, f))
+        if previous_state is not None and previous_state!=self.state_file:
+            os.remove(self.file(previous_state))
+    def read(self, name:str, mmap:bool = True)->np.ndarray:
+        """Values of the feature ``name`` for every stored sample, memory-mapped read-only by default"""
+        shape = (self.size,)+self.features[name]
+        if self.size==0:
+            return np.zeros(shape)
+        if mmap:
+            return np.memmap(self.file(self.feature_file(name)), dtype=np.float64, mode='r', shape=shape)
+        return np.fromfile(self.file(self.feature_file(name)), dtype=np.float64).reshape(shape)
+    def programs(self)->list[tuple]:
+        with open(self.file('programs.jsonl')) as f:
+            return [tuple(list2program(inst, self.packed) for inst in json.loads(line)) for line in f]
+    def events(self)->list[tuple]:
+        if not os.path.isfile(self.file('events.jsonl')):
+            return []
+        with open(self.file('events.jsonl')) as f:
+            return [tuple(json.loads(line)) for line in f]
+    def state(self)->dict:
+        with np.load(self.file(self.state_file)) as state:
+            return {key:state[key] for key in state.files}
+    def memory_perf(self, mmap:bool = True)->dict:
+        out = {}
+        for name in self.features:
+            if '/' in name:
+                key1, key2 = name.split('/')
+                out.setdefault(key1, {})[key2] = self.read(name, mmap)
+        return out
+    def content(self, mmap:bool = True)->dict:
+        """Same layout as ``History.content``, with memory-mapped arrays holding exactly the stored samples"""
+        programs = self.programs()
+        return {"memory_perf":self.memory_perf(mmap),
+                "memory_program":{"core0":[core0 for core0, _ in programs], "core1":[core1 for _, core1 in programs]},
+                "reward":self.read('reward', mmap),
+                "diversity_vec":self.state()['diversity_vec'],
+                "alp_vec":self.read('alp', mmap)}
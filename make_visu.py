@@ -7,6 +7,7 @@ from codegeneration import generate_instruction_sequence
 from simulator.sim3 import print_contention_analysis
 import pandas as pd
 from exploration.history import History
+from exploration.store import HistoryStore
 
 from visualisation.visu import plot_ddr_miss_ratio_diversity, plot_time_diversity, comparaison_ratios_iterations,diversity_time_iteration,hist_diversity
 import os
@@ -17,6 +18,9 @@ import os
 
 
 def load(name):
+    if os.path.isdir(name):
+        # streamed run, the arrays are memory-mapped
+        return HistoryStore(name).content()
     k = 1
     while os.path.isfile(f"{name}_{k}.pkl"):
         k+=1
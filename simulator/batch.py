@@ -0,0 +1,464 @@
+#===============================================================================
+# Array-backed lockstep engine
+# Simulates a whole batch of (core0, core1) program pairs at once. Every
+# component of the memory hierarchy of sim3.py is stored as NumPy arrays with
+# a leading batch axis, and all the pairs advance cycle by cycle with masked
+# operations:
+# - caches:      valid/tag/dirty of shape (batch, sets, ways), PLRU states of
+#                shape (batch, sets) decoded with the tables of sim3.PLRUTable
+# - DDR:         open row, precharge and last command per (batch, banks)
+# - queues:      interconnect and controller requests as padded arrays of shape
+#                (batch, slots) with a validity mask
+# The engine reproduces the behaviour of the object model:
+# - the controller never signals the completion of a DDR access, so a read
+#   that misses in L2 never fills the caches and stays pending in its core;
+#   a write depending on it stalls the core for the rest of the simulation.
+# - a read that hits in L1 or L2 completes in the cycle it is issued.
+# The DDRMemory bank state machine has no effect on the results and is not
+# modelled.
+# Requests are ordered by (ready time, issue time) in the interconnect and by
+# (row hit, read, issue time) in the controller. As in the object model, ties
+# are broken by the layout of the heaps of the queues, which every element
+# keeps as a Python heapq list of the slots of its requests.
+#===============================================================================
+
+import heapq
+import numpy as np
+from simulator.program import is_packed, length as program_length
+from simulator.sim3 import JITTER_BLOCK, TRACE_LEVELS, plru_table, ddr_miss_ratios
+
+READ = 0
+WRITE = 1
+OPERATIONS = ['read', 'write']
+
+# Encodes a list of {cycle: (op, addr)} or packed programs as (batch, cycles)
+# op and address arrays, op being -1 on idle cycles.
+def encode_programs(programs, length):
+    ops = np.full((len(programs), length), -1, dtype=np.int8)
+    addrs = np.zeros((len(programs), length), dtype=np.int64)
+    for b, inst in enumerate(programs):
+        if is_packed(inst):
+            slots = inst[:length]
+            issued = slots >= 0
+            ops[b, :len(slots)][issued] = slots[issued] & 1
+            addrs[b, :len(slots)][issued] = slots[issued] >> 1
+            continue
+        for cycle, (op, addr) in dict(inst).items():
+            if cycle < length:
+                ops[b, cycle] = WRITE if op == 'write' else READ
+                addrs[b, cycle] = addr
+    return ops, addrs
+
+# First n jitter values an Interconnect drawing from rng uses, by blocks of
+# JITTER_BLOCK values.
+def draw_jitter(rng, n):
+    blocks = max(-(-n // JITTER_BLOCK), 1)
+    return np.concatenate([rng.integers(0, 3, size=JITTER_BLOCK) for _ in range(blocks)])[:n]
+
+# Slot of a request in the heap of a queue. Requests whose keys are equal are
+# never smaller than each other, like the requests of the object model.
+class HeapSlot:
+    __slots__ = ('slot',)
+
+    def __init__(self, slot):
+        self.slot = slot
+
+    def __lt__(self, other):
+        return False
+
+# ---------------------------------------------------------
+# Batch of caches of the same level
+# ---------------------------------------------------------
+class BatchCache:
+    def __init__(self, batch, size, line_size, assoc):
+        self.line_size = line_size
+        self.assoc = assoc
+        self.num_sets = (size // line_size) // assoc
+        self.valid = np.zeros((batch, self.num_sets, assoc), dtype=bool)
+        self.tag = np.zeros((batch, self.num_sets, assoc), dtype=np.int64)
+        self.dirty = np.zeros((batch, self.num_sets, assoc), dtype=bool)
+        # States of more than 64 ways are Python integers
+        self.plru = np.zeros((batch, self.num_sets), dtype=np.int64 if assoc <= 64 else object)
+        self.plru_table = plru_table(assoc)
+        self.hits = np.zeros(batch, dtype=np.int64)
+        self.misses = np.zeros(batch, dtype=np.int64)
+
+    def _index(self, addr):
+        return (addr // self.line_size) % self.num_sets
+
+    def _tag(self, addr):
+        return addr // (self.line_size * self.num_sets)
+
+    def victim_addr(self, tag, index):
+        return ((tag * self.num_sets) + index) * self.line_size
+
+    # Returns (hit, way) of the lookup of the given tags in the given sets
+    def lookup(self, b, index, tag):
+        match = self.valid[b, index] & (self.tag[b, index] == tag[:, None])
+        return match.any(axis=1), match.argmax(axis=1)
+
+    # PLRU.get_victim for one set per element
+    def get_victim(self, b, index):
+        return self.plru_table.get_victims(self.plru[b, index]).astype(np.int64)
+
+    # PLRU.update_on_access for one set per element
+    def update_on_access(self, b, index, way):
+        self.plru[b, index] = self.plru_table.update_on_accesses(self.plru[b, index], way.astype(self.plru.dtype))
+
+# ---------------------------------------------------------
+# Batch version of exploration.env.func.Experiment
+# ---------------------------------------------------------
+class BatchExperiment:
+    def __init__(self, num_banks=4, num_addr=20, rng=None,
+                 l1_conf=None, l2_conf=None,
+                 delay=5, bandwidth=4,
+                 tRCD=15, tRP=15, tCAS=15, tRC=30, tWR=15, tRTP=8, tCCD=4,
+                 trace='contention'):
+        self.num_banks = num_banks
+        self.num_addr = num_addr
+        self.num_rows = self.num_addr//16+1
+        # Interconnect jitter of the whole batch, unless given per element to simulate()
+        self.rng = rng if rng is not None else np.random.default_rng(0)
+        self.l1_conf = l1_conf or {'size': 32, 'line_size': 4, 'assoc': 2}
+        self.l2_conf = l2_conf or {'size': 512, 'line_size': 4, 'assoc': 16}
+        self.delay = delay
+        self.bandwidth = bandwidth
+        self.tRCD = tRCD
+        self.tRP = tRP
+        self.tCAS = tCAS
+        self.tRC = tRC
+        self.tWR = tWR
+        self.tRTP = tRTP
+        self.tCCD = tCCD
+        # The accesses are only logged for the shared resource events, from the 'contention' trace level
+        self.contention = TRACE_LEVELS[trace] >= TRACE_LEVELS['contention']
+        self.core0_inst = []
+        self.core1_inst = []
+
+    # Loads one program per element for each core
+    def load_instr(self, core0_inst, core1_inst):
+        assert len(core0_inst) == len(core1_inst), "one program per core and per element"
+        self.core0_inst = list(core0_inst)
+        self.core1_inst = list(core1_inst)
+
+    def _reset(self, cycles, jitter, rngs):
+        B = self.batch = len(self.core0_inst)
+        length = max([program_length(inst) for inst in self.core0_inst + self.core1_inst] + [1])
+        self.length = min(length, cycles)
+        ops0, addrs0 = encode_programs(self.core0_inst, self.length)
+        ops1, addrs1 = encode_programs(self.core1_inst, self.length)
+        self.ops = np.stack((ops0, ops1))
+        self.addrs = np.stack((addrs0, addrs1))
+        # Cores
+        self.pending = np.zeros((2, B, max(int(self.addrs.max(initial=0)) + 1, self.num_addr + 1)), dtype=np.int64)
+        self.stalled = np.zeros((2, B), dtype=bool)
+        self.time_max = np.zeros((2, B), dtype=np.int64)
+        # Caches
+        self.l1 = [BatchCache(B, **self.l1_conf), BatchCache(B, **self.l1_conf)]
+        self.l2 = BatchCache(B, **self.l2_conf)
+        # Interconnect, at most one request per core and per cycle
+        if jitter is None and rngs is not None:
+            jitter = np.stack([draw_jitter(rng, 2 * self.length) for rng in rngs])
+        elif jitter is None:
+            jitter = self.rng.integers(0, 3, size=(B, 2 * self.length))
+        self.jitter = np.asarray(jitter, dtype=np.int64)
+        self.num_requests = np.zeros(B, dtype=np.int64)
+        self.ic = self._queue(B, 2 * (self.delay + 3) + self.bandwidth)
+        self.ic_heaps = [[] for _ in range(B)]  # (ready, time, HeapSlot)
+        # Controller
+        self.cq = self._queue(B, 16)
+        self.cq_heaps = [[] for _ in range(B)]  # (time, HeapSlot)
+        self.open_row = np.full((B, self.num_banks), -1, dtype=np.int64)
+        self.precharge_done = np.zeros((B, self.num_banks), dtype=np.int64)
+        self.last_cmd_time = np.full((B, self.num_banks), -self.tRC, dtype=np.int64)
+        self.last_cmd_type = np.full((B, self.num_banks), -1, dtype=np.int64)
+        # Statistics
+        self.ddr_hits = np.zeros((B, self.num_rows, self.num_banks), dtype=np.int64)
+        self.ddr_misses = np.zeros((B, self.num_rows, self.num_banks), dtype=np.int64)
+        self.l2_events = [[] for _ in range(B)]
+        self.ddr_events = [[] for _ in range(B)]
+        # L2 accesses of the current cycle, at most two per core
+        self.l2_log = {key: np.zeros((B, 4), dtype=np.int64) for key in ('core', 'addr', 'op', 'set', 'way')}
+        self.l2_count = np.zeros(B, dtype=np.int64)
+
+    @staticmethod
+    def _queue(B, slots):
+        queue = {key: np.zeros((B, slots), dtype=np.int64) for key in ('ready', 'time', 'core', 'addr', 'op')}
+        queue['valid'] = np.zeros((B, slots), dtype=bool)
+        return queue
+
+    # Pushes one request per element of b in a padded queue, growing it if
+    # full, and returns the slots of the requests
+    @staticmethod
+    def _push(queue, b, **fields):
+        free = ~queue['valid'][b]
+        if not free.any(axis=1).all():
+            for key in queue:
+                queue[key] = np.concatenate((queue[key], np.zeros_like(queue[key])), axis=1)
+            free = ~queue['valid'][b]
+        slot = free.argmax(axis=1)
+        queue['valid'][b, slot] = True
+        for key, value in fields.items():
+            queue[key][b, slot] = value
+        return slot
+
+    def _log_l2(self, core, b, addr, op, index, way):
+        n = self.l2_count[b]
+        for key, value in (('core', core), ('addr', addr), ('op', op), ('set', index), ('way', way)):
+            self.l2_log[key][b, n] = value
+        self.l2_count[b] += 1
+
+    def _request(self, core, b, addr, op):
+        ready = self.cycle + self.delay + self.jitter[b, self.num_requests[b]]
+        slot = self._push(self.ic, b, ready=ready, time=self.cycle, core=core, addr=addr, op=op)
+        for e, ready_e, slot_e in zip(b.tolist(), ready.tolist(), slot.tolist()):
+            heapq.heappush(self.ic_heaps[e], (ready_e, self.cycle, HeapSlot(slot_e)))
+        self.num_requests[b] += 1
+
+    # ---------------------------------------------------------
+    # L2 (shared)
+    # ---------------------------------------------------------
+    def _l2_read(self, core, b, addr):
+        l2 = self.l2
+        index, tag = l2._index(addr), l2._tag(addr)
+        hit, way = l2.lookup(b, index, tag)
+        if self.contention:
+            self._log_l2(core, b, addr, READ, index, np.where(hit, way, -1))
+        h, m = b[hit], b[~hit]
+        l2.hits[h] += 1
+        l2.update_on_access(h, index[hit], way[hit])
+        l2.misses[m] += 1
+        # The fill never happens: the DDR completion is never signalled
+        self._request(core, m, addr[~hit], READ)
+        return hit
+
+    def _l2_write(self, core, b, addr):
+        l2 = self.l2
+        index, tag = l2._index(addr), l2._tag(addr)
+        hit, way = l2.lookup(b, index, tag)
+        if self.contention:
+            self._log_l2(core, b, addr, WRITE, index, np.where(hit, way, -1))
+        h = b[hit]
+        l2.hits[h] += 1
+        l2.dirty[h, index[hit], way[hit]] = True
+        l2.update_on_access(h, index[hit], way[hit])
+        # Write allocate, writing back a dirty victim
+        m, index, tag = b[~hit], index[~hit], tag[~hit]
+        l2.misses[m] += 1
+        victim = l2.get_victim(m, index)
+        evict = l2.valid[m, index, victim] & l2.dirty[m, index, victim]
+        self._request(core, m[evict], l2.victim_addr(l2.tag[m, index, victim], index)[evict], WRITE)
+        l2.valid[m, index, victim] = True
+        l2.tag[m, index, victim] = tag
+        l2.dirty[m, index, victim] = True
+        l2.update_on_access(m, index, victim)
+
+    # ---------------------------------------------------------
+    # L1 (per core)
+    # ---------------------------------------------------------
+    def _l1_read(self, core, b, addr):
+        l1 = self.l1[core]
+        index, tag = l1._index(addr), l1._tag(addr)
+        hit, way = l1.lookup(b, index, tag)
+        h = b[hit]
+        l1.hits[h] += 1
+        l1.update_on_access(h, index[hit], way[hit])
+        self.pending[core, h, addr[hit]] -= 1
+        m, addr, index, tag = b[~hit], addr[~hit], index[~hit], tag[~hit]
+        l1.misses[m] += 1
+        victim = l1.get_victim(m, index)
+        l2_hit = self._l2_read(core, m, addr)
+        # L2 hit: the line is filled in L1, writing back a dirty victim first
+        m, addr, index, tag, victim = m[l2_hit], addr[l2_hit], index[l2_hit], tag[l2_hit], victim[l2_hit]
+        evict = l1.valid[m, index, victim] & l1.dirty[m, index, victim]
+        self._l2_write(core, m[evict], l1.victim_addr(l1.tag[m, index, victim], index)[evict])
+        l1.valid[m, index, victim] = True
+        l1.tag[m, index, victim] = tag
+        l1.dirty[m, index, victim] = False
+        l1.update_on_access(m, index, victim)
+        self.pending[core, m, addr] -= 1
+
+    def _l1_write(self, core, b, addr):
+        l1 = self.l1[core]
+        index, tag = l1._index(addr), l1._tag(addr)
+        hit, way = l1.lookup(b, index, tag)
+        h = b[hit]
+        l1.hits[h] += 1
+        l1.dirty[h, index[hit], way[hit]] = True
+        l1.update_on_access(h, index[hit], way[hit])
+        m, index, tag = b[~hit], index[~hit], tag[~hit]
+        l1.misses[m] += 1
+        victim = l1.get_victim(m, index)
+        evict = l1.valid[m, index, victim] & l1.dirty[m, index, victim]
+        self._l2_write(core, m[evict], l1.victim_addr(l1.tag[m, index, victim], index)[evict])
+        l1.valid[m, index, victim] = True
+        l1.tag[m, index, victim] = tag
+        l1.dirty[m, index, victim] = True
+        l1.update_on_access(m, index, victim)
+
+    # ---------------------------------------------------------
+    # One cycle of every component
+    # ---------------------------------------------------------
+    def _tick_core(self, core):
+        if self.cycle >= self.length:
+            return
+        op = self.ops[core, :, self.cycle]
+        addr = self.addrs[core, :, self.cycle]
+        active = (op >= 0) & ~self.stalled[core]
+        write = active & (op == WRITE)
+        read = active & (op == READ)
+        # A write waiting for a pending read of the same address stalls the core
+        # (for good, since DDR reads never complete)
+        stall = write & (self.pending[core, np.arange(self.batch), addr] > 0)
+        self.stalled[core] |= stall
+        write &= ~stall
+        issued = write | read
+        self.time_max[core, issued] = np.maximum(self.time_max[core, issued], self.cycle)
+        b = np.flatnonzero(read)
+        if b.size:
+            self.pending[core, b, addr[b]] += 1
+            self._l1_read(core, b, addr[b])
+        b = np.flatnonzero(write)
+        if b.size:
+            self._l1_write(core, b, addr[b])
+
+    def _tick_interconnect(self):
+        ic = self.ic
+        for _ in range(self.bandwidth):
+            b, slot = [], []
+            for e in np.flatnonzero(ic['valid'].any(axis=1)).tolist():
+                heap = self.ic_heaps[e]
+                if heap and heap[0][0] <= self.cycle:
+                    b.append(e)
+                    slot.append(heapq.heappop(heap)[-1].slot)
+            if not b:
+                return
+            b, slot = np.array(b), np.array(slot)
+            ic['valid'][b, slot] = False
+            cq_slot = self._push(self.cq, b, **{key: ic[key][b, slot] for key in ('time', 'core', 'addr', 'op')})
+            for e, slot_e in zip(b.tolist(), cq_slot.tolist()):
+                heapq.heappush(self.cq_heaps[e], (int(self.cq['time'][e, slot_e]), HeapSlot(slot_e)))
+
+    def _tick_controller(self):
+        cq = self.cq
+        bank = cq['addr'] % self.num_banks
+        row = cq['addr'] // 16
+        B = np.arange(self.batch)[:, None]
+        candidates = (cq['valid']
+                      & (self.precharge_done[B, bank] <= self.cycle)
+                      & (self.cycle >= self.last_cmd_time[B, bank] + self.tCCD))
+        b = np.flatnonzero(candidates.any(axis=1))
+        if not b.size:
+            return
+        miss = self.open_row[B, bank] != row
+        # Requests of the same priority are taken in the order of the heap
+        position = np.zeros(cq['valid'].shape, dtype=np.int64)
+        for e in b.tolist():
+            for i, (_, heap_slot) in enumerate(self.cq_heaps[e]):
+                position[e, heap_slot.slot] = i
+        key = np.where(candidates, (miss.astype(np.int64) << 61) + (cq['op'] << 60) + (cq['time'] << 20) + position,
+                       np.iinfo(np.int64).max)[b]
+        slot = key.argmin(axis=1)
+        best_bank, best_row, op = bank[b, slot], row[b, slot], cq['op'][b, slot]
+        row_miss = miss[b, slot]
+        delay = np.where(row_miss, self.tRP + self.tRCD + self.tCAS, 0)
+        last = self.last_cmd_type[b, best_bank]
+        delay += np.where((last == WRITE) & (op == READ), self.tWR, 0)
+        delay += np.where((last == READ) & (op == WRITE), self.tWR + 2, 0)
+        self.precharge_done[b[row_miss], best_bank[row_miss]] = self.cycle + self.tRP
+        self.open_row[b, best_bank] = best_row
+        self.last_cmd_time[b, best_bank] = self.cycle
+        self.last_cmd_type[b, best_bank] = op
+        core = cq['core'][b, slot]
+        self.time_max[core, b] = np.maximum(self.time_max[core, b], self.cycle + delay)
+        np.add.at(self.ddr_misses, (b[row_miss], best_row[row_miss], best_bank[row_miss]), 1)
+        np.add.at(self.ddr_hits, (b[~row_miss], best_row[~row_miss], best_bank[~row_miss]), 1)
+        # Several candidates: the scheduled request and the waiting ones may contend
+        for i in np.flatnonzero(candidates[b].sum(axis=1) > 1) if self.contention else []:
+            e = b[i]
+            slots = np.flatnonzero(candidates[e])
+            slots = slots[np.argsort(key[i, slots], kind='stable')]
+            statuses = ['ROW MISS' if row_miss[i] else 'ROW HIT'] + ['waiting'] * (len(slots) - 1)
+            self._ddr_contention(e, cq['core'][e, slots], bank[e, slots], row[e, slots], cq['op'][e, slots], statuses)
+        cq['valid'][b, slot] = False
+        for e, slot_e in zip(b.tolist(), slot.tolist()):
+            heap = self.cq_heaps[e]
+            heap.pop(next(i for i, (_, heap_slot) in enumerate(heap) if heap_slot.slot == slot_e))
+            heapq.heapify(heap)
+
+    # Same rules as analyze_shared_resource_contention, applied to the
+    # accesses of one cycle
+    def _ddr_contention(self, e, cores, banks, rows, ops, statuses):
+        cores, banks, rows = cores.tolist(), banks.tolist(), rows.tolist()
+        bank_conflicts = len(banks) > len(set(banks))
+        row_conflicts = False
+        bank_row_map = {}
+        for bank, row in zip(banks, rows):
+            if bank in bank_row_map and bank_row_map[bank] != row:
+                row_conflicts = True
+            bank_row_map[bank] = row
+        if len(set(cores)) > 1 and (bank_conflicts or row_conflicts):
+            self.ddr_events[e].append({
+                'cycle': self.cycle,
+                'type': 'DDR_MEMORY_CONTENTION',
+                'resource': 'DDR_MEMORY',
+                'initiators': cores,
+                'details': {'banks': banks,
+                            'rows': rows,
+                            'operations': [OPERATIONS[op] for op in ops],
+                            'statuses': statuses,
+                            'bank_conflicts': bank_conflicts,
+                            'row_conflicts': row_conflicts}})
+
+    def _l2_contention(self):
+        log = self.l2_log
+        for e in np.flatnonzero(self.l2_count > 1):
+            n = self.l2_count[e]
+            cores = log['core'][e, :n].tolist()
+            if len(set(cores)) > 1:
+                self.l2_events[e].append({
+                    'cycle': self.cycle,
+                    'type': 'L2_CACHE_CONTENTION',
+                    'resource': 'L2_CACHE',
+                    'initiators': list(set(cores)),
+                    'details': {'set_indices': log['set'][e, :n].tolist(),
+                                'operations': [OPERATIONS[op] for op in log['op'][e, :n]],
+                                'addresses': log['addr'][e, :n].tolist(),
+                                'ways': log['way'][e, :n].tolist()}})
+        self.l2_count[:] = 0
+
+    def simulate(self, cycles, jitter=None, rngs=None):
+        """
+        Runs every element of the batch for ``cycles`` cycles and returns one
+        ``Experiment.output_data()`` dictionary per element.
+        jitter: (batch, n) int array. Optional interconnect jitter, the k-th
+        request of element b being delayed by jitter[b, k] extra cycles.
+        rngs: list. Optional numpy Generator of every element, drawing its jitter
+        like the Interconnect of an Experiment created with the same Generator.
+        """
+        self._reset(cycles, jitter, rngs)
+        for self.cycle in range(cycles):
+            self._tick_core(0)
+            self._tick_core(1)
+            self._l2_contention()
+            self._tick_interconnect()
+            self._tick_controller()
+            # Nothing can happen anymore once programs are over and queues are empty
+            if self.cycle >= self.length and not self.ic['valid'].any() and not self.cq['valid'].any():
+                break
+        return self.output_data()
+
+    def output_data(self):
+        ratios_tab, ratios, _ = ddr_miss_ratios(self.ddr_hits, self.ddr_misses)
+        l2_hits, l2_misses = self.l2.hits.tolist(), self.l2.misses.tolist()
+        outputs = []
+        for e in range(self.batch):
+            total = l2_hits[e] + l2_misses[e]
+            outputs.append({'time_core0': int(self.time_max[0, e]),
+                            'time_core1': int(self.time_max[1, e]),
+                            'miss_ratios_detailled': ratios_tab[e].copy(),
+                            'miss_ratios_global': ratios[e].copy(),
+                            'L2_miss_ratio': l2_misses[e] / total if total else 0,
+                            'shared_resource_events': self.l2_events[e] + self.ddr_events[e],
+                            })
+        return outputs
@@ -0,0 +1,65 @@
+#===============================================================================
+# Packed instruction programs
+# A program {cycle: (op, addr)} is packed as an int32 array with one slot per
+# cycle: EMPTY (-1) when no instruction is issued at that cycle, otherwise
+# (addr << 1) | op with op 0 for 'read' and 1 for 'write'.
+# Copying a packed program is a single array copy, and the functions that
+# build or transform programs (generation, mutation, mixing, subsequence) as
+# well as Core.load_instr accept both forms.
+#===============================================================================
+
+import numpy as np
+
+EMPTY = -1
+OPCODES = {'read': 0, 'write': 1}
+OPERATIONS = ['read', 'write']
+
+def is_packed(inst):
+    return isinstance(inst, np.ndarray)
+
+def encode(op, addr):
+    return (int(addr) << 1) | OPCODES[op]
+
+def decode(slot):
+    return (OPERATIONS[slot & 1], int(slot >> 1))
+
+def pack(inst, max_cycle=None):
+    """Packs a {cycle: (op, addr)} program into max_cycle+1 slots (enough slots for its last cycle by default)"""
+    if is_packed(inst):
+        return resize(inst, max_cycle)
+    inst = dict(inst)
+    if max_cycle is None:
+        max_cycle = max(inst, default=-1)
+    packed = np.full(max_cycle + 1, EMPTY, dtype=np.int32)
+    for cycle, (op, addr) in inst.items():
+        if cycle <= max_cycle:
+            packed[cycle] = encode(op, addr)
+    return packed
+
+def unpack(inst):
+    """{cycle: (op, addr)} form of a program, in cycle order"""
+    if not is_packed(inst):
+        return dict(inst)
+    return {int(cycle): decode(int(inst[cycle])) for cycle in np.flatnonzero(inst >= 0)}
+
+def resize(packed, max_cycle=None):
+    """Copy of a packed program with max_cycle+1 slots"""
+    if max_cycle is None:
+        return packed.copy()
+    out = np.full(max_cycle + 1, EMPTY, dtype=np.int32)
+    n = min(len(packed), max_cycle + 1)
+    out[:n] = packed[:n]
+    return out
+
+def cycles(inst):
+    """Sorted cycles at which an instruction is issued"""
+    if is_packed(inst):
+        return np.flatnonzero(inst >= 0).tolist()
+    return sorted(dict(inst))
+
+def length(inst):
+    """Last cycle of the program plus one"""
+    if is_packed(inst):
+        issued = np.flatnonzero(inst >= 0)
+        return int(issued[-1]) + 1 if len(issued) else 0
+    return max(dict(inst), default=-1) + 1
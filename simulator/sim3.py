@@ -8,25 +8,124 @@ from os import altsep
 # - an interconnect
 # The number of cores, levels of cache, characteristics of the cache (number of ways,...)
 # are parameters and can be modified.
+#
+# Every stateful component has snapshot() and restore(state): snapshot returns
+# a copy of its state at the current cycle, restore puts it back in place, so
+# that the callbacks held by queued requests (closures over the components)
+# stay valid. A snapshot is therefore restored into the hierarchy that took it
+# (see Experiment.snapshot in exploration/env/func.py).
 #===============================================================================
 
 import random
 import heapq
+import bisect
+from array import array
+from collections import deque
 from enum import Enum, auto
 import numpy as np
+from simulator.program import is_packed, unpack
+
+# Version of the timing model, part of the keys of the cached results.
+# Increase it whenever a change can alter the result of a simulation.
+# - 1: baseline
+# - 2: requests of the same age are ordered by arrival in the interconnect
+#      and in the DDR controller, instead of by the layout of the heaps
+# - 3: back to the order of the baseline, same results as 1
+SIMULATOR_VERSION = 3
+
+# ==========================================================
+# Tracing
+# ==========================================================
+# Level of detail of the records kept by a simulation:
+# - 'off':        nothing
+# - 'aggregate':  the number of records of every kind (SimContext.trace_counts)
+# - 'contention': also the shared resource events, detected online (below)
+# - 'full':       also the L2 and DDR access logs and the stages ('queued',
+#                 'ready', 'complete') of every request in the DDR controller
+# Records are tuples appended to a TraceBuffer, turned into dicts or into a
+# structured array only when they are read. The components test the flags of
+# the context (tracing, trace_accesses, trace_full) before building a
+# record, so a disabled level costs a single attribute test.
+TRACE_LEVELS = {'off': 0, 'aggregate': 1, 'contention': 2, 'full': 3}
+TRACE_KINDS = ['l2_access', 'ddr_access', 'queued', 'ready', 'complete']
+
+L2_ACCESS_FIELDS = [('cycle', np.int64), ('core_id', np.int64), ('addr', np.int64), ('operation', 'U5'),
+                    ('set_index', np.int64), ('way', np.int64), ('hit', bool)]
+DDR_ACCESS_FIELDS = [('cycle', np.int64), ('core_id', np.int64), ('addr', np.int64), ('operation', 'U5'),
+                     ('bank', np.int64), ('row', np.int64), ('status', 'U8')]
+STAGE_FIELDS = [('stage', 'U8'), ('cycle', np.int64), ('type', 'U5'), ('core', np.int64), ('addr', np.int64)]
+
+class TraceBuffer:
+    def __init__(self, fields, capacity=None):
+        self.fields = fields
+        self.names = [name for name, _ in fields]
+        # With a capacity, a ring buffer keeping the last records only
+        self.records = deque(maxlen=capacity) if capacity else []
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def append(self, record):
+        self.records.append(record)
+
+    def clear(self):
+        self.records.clear()
+
+    def dicts(self):
+        return [dict(zip(self.names, record)) for record in self.records]
+
+    def array(self):
+        return np.array(list(self.records), dtype=self.fields)
 
 # ==========================================================
-# Global clock
+# Simulation context
 # ==========================================================
-class GlobalVar:
-    global_cycle = 0
-    # New: Track shared resource contention
-    shared_resource_events = []
-    l2_access_log = []  # Track L2 cache accesses
-    ddr_access_log = []  # Track DDR memory accesses
-    
-    @classmethod
-    def log_shared_resource_event(cls, event_type, resource_type, initiators, details,cycle):
+# Holds the clock and the access logs of one simulation. Every component of a
+# memory hierarchy shares the same context, so several simulations can run side
+# by side in one interpreter without clobbering each other's logs.
+# Contention is detected online: the L2 and DDR accesses of the current cycle
+# are accumulated, and checked for contention when an access of a later cycle
+# comes in (or by finish_contention at the end of the simulation). The events
+# are kept in one list per resource so that shared_resource_events lists the
+# L2 events, then the DDR events, each in cycle order.
+# trace: level of TRACE_LEVELS. trace_capacity: number of controller stages
+# kept at the 'full' level, all of them if None.
+class SimContext:
+    def __init__(self, trace='full', trace_capacity=None):
+        self.global_cycle = 0
+        # Track shared resource contention
+        self.shared_resource_events = []
+        self.l2_events = []
+        self.ddr_events = []
+        self.l2_cycle = -1      # cycle of the accumulated L2 accesses
+        self.l2_accesses = []   # (core_id, addr, operation, set_index, way)
+        self.ddr_cycle = -1     # cycle of the accumulated DDR accesses
+        self.ddr_accesses = []  # (core_id, operation, bank, row, status)
+        self.l2_trace = TraceBuffer(L2_ACCESS_FIELDS)  # Track L2 cache accesses
+        self.ddr_trace = TraceBuffer(DDR_ACCESS_FIELDS)  # Track DDR memory accesses
+        self.stage_trace = TraceBuffer(STAGE_FIELDS, trace_capacity)  # Track DDR controller stages
+        self.set_trace(trace)
+
+    def set_trace(self, trace):
+        assert trace in TRACE_LEVELS, f'unknown trace level {trace}'
+        self.trace = trace
+        self.tracing = TRACE_LEVELS[trace] >= TRACE_LEVELS['aggregate']
+        self.trace_accesses = TRACE_LEVELS[trace] >= TRACE_LEVELS['contention']
+        self.trace_full = TRACE_LEVELS[trace] >= TRACE_LEVELS['full']
+        self.trace_counts = dict.fromkeys(TRACE_KINDS, 0)
+
+    @property
+    def l2_access_log(self):
+        return self.l2_trace.dicts()
+
+    @property
+    def ddr_access_log(self):
+        return self.ddr_trace.dicts()
+
+    def log_shared_resource_event(self, event_type, resource_type, initiators, details,cycle,events=None):
         """Log when multiple initiators access shared resources simultaneously"""
         event = {
             'cycle': cycle,
@@ -35,44 +134,125 @@ class GlobalVar:
             'initiators': initiators.copy(),  # Core IDs involved
             'details': details.copy()
         }
-        cls.shared_resource_events.append(event)
-    
-    @classmethod
-    def log_l2_access(cls, core_id, addr, operation, set_index, way, hit):
-        """Log L2 cache access for contention analysis"""
+        (self.shared_resource_events if events is None else events).append(event)
 
-        cycle = cls.global_cycle
-        access = {
-            'cycle': cycle,
-            'core_id': core_id,
-            'addr': addr,
-            'operation': operation,
-            'set_index': set_index,
-            'way': way,
-            'hit': hit
-        }
-        cls.l2_access_log.append(access)
-    
-    @classmethod
-    def log_ddr_access(cls, core_id, addr, operation, bank, row, status):
+    def log_l2_access(self, core_id, addr, operation, set_index, way, hit):
+        """Log L2 cache access for contention analysis"""
+        self.trace_counts['l2_access'] += 1
+        if self.trace_accesses:
+            if self.global_cycle != self.l2_cycle:
+                self.check_l2_contention()
+                self.l2_cycle = self.global_cycle
+            self.l2_accesses.append((core_id, addr, operation, set_index, way))
+            if self.trace_full:
+                self.l2_trace.append((self.global_cycle, core_id, addr, operation, set_index, way, hit))
+
+    def log_ddr_access(self, core_id, addr, operation, bank, row, status):
         """Log DDR memory access for contention analysis"""
-        cycle = cls.global_cycle
-        access = {
-            'cycle': cycle,
-            'core_id': core_id,
-            'addr': addr,
-            'operation': operation,
-            'bank': bank,
-            'row': row,
-            'status': status
-        }
-        cls.ddr_access_log.append(access)
-    @classmethod
-    def clear_history(cls):
-        cls.global_cycle = 0
-        cls.shared_resource_events = []
-        cls.l2_access_log = []  # Track L2 cache accesses
-        cls.ddr_access_log = []  # Track DDR memory accesses
+        self.trace_counts['ddr_access'] += 1
+        if self.trace_accesses:
+            if self.global_cycle != self.ddr_cycle:
+                self.check_ddr_contention()
+                self.ddr_cycle = self.global_cycle
+            self.ddr_accesses.append((core_id, operation, bank, row, status))
+            if self.trace_full:
+                self.ddr_trace.append((self.global_cycle, core_id, addr, operation, bank, row, status))
+
+    # Multiple accesses to L2 in the same cycle from several cores
+    def check_l2_contention(self):
+        accesses = self.l2_accesses
+        if len(accesses) > 1:
+            cores_involved = set(access[0] for access in accesses)
+            if len(cores_involved) > 1:
+                details = {
+                    'set_indices': [access[3] for access in accesses],
+                    'operations': [access[2] for access in accesses],
+                    'addresses': [access[1] for access in accesses],
+                    'ways':[access[4] for access in accesses],
+                }
+                self.log_shared_resource_event(
+                    'L2_CACHE_CONTENTION', 'L2_CACHE', list(cores_involved), details, self.l2_cycle, self.l2_events
+                )
+        self.l2_accesses = []
+
+    # Multiple DDR accesses in the same cycle from several cores, with a bank
+    # or a row buffer conflict
+    def check_ddr_contention(self):
+        accesses = self.ddr_accesses
+        if len(accesses) > 1:
+            cores_involved = set(access[0] for access in accesses)
+            banks_accessed = set(access[2] for access in accesses)
+
+            # Check for bank conflicts
+            bank_conflicts = len(accesses) > len(banks_accessed)
+
+            # Check for row buffer conflicts
+            row_conflicts = False
+            bank_row_map = {}
+            for access in accesses:
+                bank = access[2]
+                row = access[3]
+                if bank in bank_row_map and bank_row_map[bank] != row:
+                    row_conflicts = True
+                bank_row_map[bank] = row
+
+            if len(cores_involved) > 1 and (bank_conflicts or row_conflicts):
+                details = {
+                    'banks': [access[2] for access in accesses],
+                    'rows': [access[3] for access in accesses],
+                    'operations': [access[1] for access in accesses],
+                    'statuses': [access[4] for access in accesses],
+                    'bank_conflicts': bank_conflicts,
+                    'row_conflicts': row_conflicts
+                }
+                self.log_shared_resource_event(
+                    'DDR_MEMORY_CONTENTION', 'DDR_MEMORY', [access[0] for access in accesses], details, self.ddr_cycle, self.ddr_events)
+        self.ddr_accesses = []
+
+    def finish_contention(self):
+        """Checks the accesses of the last cycles and gathers the events in shared_resource_events"""
+        self.check_l2_contention()
+        self.check_ddr_contention()
+        self.shared_resource_events = self.l2_events + self.ddr_events
+
+    def log_stage(self, stage, req):
+        """Log a stage of a request in the DDR controller"""
+        self.trace_counts[stage] += 1
+        if self.trace_full:
+            self.stage_trace.append((stage, self.global_cycle, req.req_type.upper(), req.core_id, req.addr))
+
+    def snapshot(self):
+        return (self.global_cycle, list(self.l2_events), list(self.ddr_events),
+                self.l2_cycle, list(self.l2_accesses), self.ddr_cycle, list(self.ddr_accesses),
+                list(self.l2_trace), list(self.ddr_trace), list(self.stage_trace), dict(self.trace_counts))
+
+    def restore(self, state):
+        (self.global_cycle, l2_events, ddr_events, self.l2_cycle, l2_accesses, self.ddr_cycle, ddr_accesses,
+         l2_trace, ddr_trace, stage_trace, trace_counts) = state
+        # new lists, the outputs of previous simulations keep theirs
+        self.shared_resource_events = []
+        self.l2_events = list(l2_events)
+        self.ddr_events = list(ddr_events)
+        self.l2_accesses = list(l2_accesses)
+        self.ddr_accesses = list(ddr_accesses)
+        for buffer, records in [(self.l2_trace, l2_trace), (self.ddr_trace, ddr_trace), (self.stage_trace, stage_trace)]:
+            buffer.clear()
+            buffer.records.extend(records)
+        self.trace_counts = dict(trace_counts)
+
+    def clear_history(self):
+        self.global_cycle = 0
+        self.shared_resource_events = []
+        self.l2_events = []
+        self.ddr_events = []
+        self.l2_cycle = -1
+        self.l2_accesses = []
+        self.ddr_cycle = -1
+        self.ddr_accesses = []
+        self.l2_trace.clear()
+        self.ddr_trace.clear()
+        self.stage_trace.clear()
+        self.trace_counts = dict.fromkeys(TRACE_KINDS, 0)
 # -----------------------------------------------------
 # CacheLine: Represents a single cache line in the cache hierarchy
 # -----------------------------------------------------
@@ -113,35 +293,118 @@ class CacheLine:
 #
 # Each node of the tree contains a direction (left=0, right=1) that indicates
 # the path to follow to find the next pLRU entry.
+#
+# The tree of a set is encoded as a single integer, the state, whose bit i is
+# node i. For a given associativity the replacement decisions are precomputed
+# once, for every state, by PLRUTable:
+# - victim[state]: the block to replace
+# - update[state * ways + way]: the state after an access to block way
+# so that both operations are a single table lookup whatever the number of ways.
+# The tables hold 2^(ways-1) states and are built for up to PLRU_TABLE_WAYS
+# ways, larger caches walk the tree of the state with PLRUWalk.
+PLRU_TABLE_WAYS = 16
+
+class PLRUTable:
+    def __init__(self, ways):
+        self.ways = ways
+        num_levels = ways.bit_length() - 1
+        states = np.arange(1 << (ways - 1), dtype=np.int32)
+
+        # Traverse the trees of all the states at once, following the directions
+        victim = np.zeros_like(states)
+        idx = np.zeros_like(states)
+        for level in range(num_levels):
+            direction = (states >> idx) & 1
+            victim = (victim << 1) | direction
+            idx = (idx << 1) + 1 + direction
+
+        # An access to a block sets the nodes on its path to point away from it
+        update = np.empty((len(states), ways), dtype=np.int32)
+        for way in range(ways):
+            idx = 0
+            path = 0   # nodes on the path of the block
+            away = 0   # their new directions
+            for level in range(num_levels):
+                direction = (way >> (num_levels - 1 - level)) & 1
+                path |= 1 << idx
+                away |= (1 - direction) << idx
+                idx = (idx << 1) + 1 + direction
+            update[:, way] = (states & ~path) | away
+
+        # Typed arrays for the lookups of single sets, NumPy views for the batch form
+        self.victim = array('i', victim.tobytes())
+        self.update = array('i', update.tobytes())
+        self.victim_tab = np.frombuffer(self.victim, dtype=np.int32)
+        self.update_tab = np.frombuffer(self.update, dtype=np.int32).reshape(len(states), ways)
+
+    def get_victim(self, state):
+        return self.victim[state]
+
+    def update_on_access(self, state, way):
+        return self.update[state * self.ways + way]
+
+    # Batch form: one state (and accessed block) per entry of the arrays
+    def get_victims(self, states):
+        return self.victim_tab[states]
+
+    def update_on_accesses(self, states, ways):
+        return self.update_tab[states, ways]
+
+# Same operations as PLRUTable, following the directions of the tree of the
+# state. The batch forms take NumPy arrays of states (and blocks) as well.
+class PLRUWalk:
+    def __init__(self, ways):
+        self.ways = ways
+        self.num_levels = ways.bit_length() - 1
+
+    def get_victim(self, state):
+        idx = 0
+        way = state & 0  # of the type of state
+        for level in range(self.num_levels):
+            direction = (state >> idx) & 1
+            way = (way << 1) | direction
+            idx = (idx << 1) + 1 + direction
+        return way
+
+    def update_on_access(self, state, way):
+        idx = 0
+        for level in range(self.num_levels):
+            direction = (way >> (self.num_levels - 1 - level)) & 1
+            state = (state & ~(1 << idx)) | ((1 - direction) << idx)
+            idx = (idx << 1) + 1 + direction
+        return state
+
+    get_victims = get_victim
+    update_on_accesses = update_on_access
+
+PLRU_TABLES = {}
+# Tables of an associativity, built on first use and shared by all the caches
+def plru_table(ways):
+    if ways not in PLRU_TABLES:
+        PLRU_TABLES[ways] = PLRUTable(ways) if ways <= PLRU_TABLE_WAYS else PLRUWalk(ways)
+    return PLRU_TABLES[ways]
+
+# PLRU tree of one set
 class PLRU:
     def __init__(self, ways):
-        self.bits = [0] * (ways - 1)  # Tree structure to track usage
+        self.state = 0  # Tree structure to track usage, node i in bit i
         self.ways = ways
+        self.table = plru_table(ways)
+
+    def reset(self):
+        self.state = 0
 
     # Update the binary tree in case of a hit
     # The bits in the tree are modified to point "away" from this entry
     # (which is the MRU)
     def update_on_access(self, way):
-        idx = 0
-        num_levels = self.ways.bit_length() - 1
-        for level in range(num_levels):
-            # Select direction according to the way
-             # (e.g., way=3=0b101 in a 4-way cache => direction = 1 (right subtree), 0 (left subtree)
-            direction = (way >> (num_levels - 1 - level)) & 1
-            self.bits[idx] = 1-direction # Point to the opposite direction
-            idx = (idx << 1)+ 1 + direction
+        self.state = self.table.update_on_access(self.state, way)
 
     # Compute the next victim (the pLRU)
     # The block is selected by traversing the tree according
     # to the directions given by each bit.
     def get_victim(self):
-        idx = 0
-        way = 0
-        for level in range(self.ways.bit_length() - 1):
-            direction = self.bits[idx]
-            way = (way << 1) | direction
-            idx = ( idx << 1) + 1 + direction
-        return way
+        return self.table.get_victim(self.state)
 
 # ---------------------------------------------------------
 # Represents a memory access request (either read or write)
@@ -162,6 +425,27 @@ class MemoryRequest:
     def __str__(self):
         return f"<req: {self.req_type.upper()}@{self.addr} from core {self.core_id} >"
 
+    # Same request, sharing the callback
+    def copy(self):
+        req = MemoryRequest(self.core_id, self.time, self.req_type, self.addr, self.callback)
+        req.completion_time = self.completion_time
+        return req
+
+# Requests are updated by the controller when they are scheduled, snapshots
+# keep copies of the (..., request) entries of the queues. Queues holding the
+# same requests are copied with the same dict copies {id(request): copy}, so
+# that they still share them.
+def copy_entries(entries, copies=None):
+    if copies is None:
+        return [entry[:-1] + (entry[-1].copy(),) for entry in entries]
+    out = []
+    for entry in entries:
+        req = entry[-1]
+        if id(req) not in copies:
+            copies[id(req)] = req.copy()
+        out.append(entry[:-1] + (copies[id(req)],))
+    return out
+
 # ---------------------------------------------------------
 # Interconnect model between CPU cores and DDR, with bandwidth and latency
 # ---------------------------------------------------------
@@ -172,13 +456,47 @@ class MemoryRequest:
 # Note
 # - Using a heapqueue ensures that all items are and remain sorted
 #   according to their ready_time (and req)
+# - The random component of the delay is drawn from the numpy Generator rng
+#   (seeded with 0 by default), by blocks of JITTER_BLOCK values
+JITTER_BLOCK = 256
+
 class Interconnect:
-    def __init__(self, memory_controller, delay=5, bandwidth=4):
+    def __init__(self, memory_controller, delay=5, bandwidth=4, rng=None):
         self.memory_controller = memory_controller
         self.queue = []               # Queue of pending memory requests (ready_time, request)
         self.delay = delay            # Base delay before forwarding to DDR controller
         self.bandwidth = bandwidth    # Max number of requests per cycle
         self.cycle = 0
+        self.rng = rng if rng is not None else np.random.default_rng(0)
+        self.jitter = []              # Jitter values of the current block, next one last
+        self.rng_state = None         # State of rng after the current block, taken by the first snapshot
+
+    # Back to the state of a new interconnect, drawing its jitter from rng (the current generator if None)
+    def reset(self, rng=None):
+        self.queue = []
+        self.cycle = 0
+        if rng is not None:
+            self.rng = rng
+        self.jitter = []
+        self.rng_state = None
+
+    def snapshot(self):
+        if self.rng_state is None:
+            self.rng_state = self.rng.bit_generator.state
+        return (copy_entries(self.queue), self.cycle, self.rng_state, list(self.jitter))
+
+    # The generator is kept, moved to the state of the snapshot
+    def restore(self, state):
+        queue, self.cycle, self.rng_state, jitter = state
+        self.queue = copy_entries(queue)
+        self.rng.bit_generator.state = self.rng_state
+        self.jitter = list(jitter)
+
+    def draw_jitter(self):
+        if not self.jitter:
+            self.jitter = self.rng.integers(0, 3, size=JITTER_BLOCK).tolist()[::-1]
+            self.rng_state = None
+        return self.jitter.pop()
 
     # Push a request into the interconnect queue.
     # We push the tuple (ready_time, request) where ready_time is the earliest
@@ -187,10 +505,10 @@ class Interconnect:
         
 
         # Add a random component to the delay for more realistic simulation
-        ready_time = self.cycle + self.delay + random.randint(0, 2)
+        ready_time = self.cycle + self.delay + self.draw_jitter()
         heapq.heappush(self.queue, (ready_time, req))
 
-        #print(f"{GlobalVar.global_cycle}: [Interconnect] Request {req.req_type.upper()}@{req.addr} from core {req.core_id} queued, to be released at {ready_time}")
+        #print(f"{self.cycle}: [Interconnect] Request {req.req_type.upper()}@{req.addr} from core {req.core_id} queued, to be released at {ready_time}")
 
     # Process the interconnect's current cycle
     def tick(self):
@@ -206,20 +524,74 @@ class Interconnect:
 
         # Forward the selected requests to the memory controller
         for req in requests_to_forward:
-            #print(f"{GlobalVar.global_cycle}: [Interconnect] Request {req} sent to memory controller")
+            #print(f"{self.cycle}: [Interconnect] Request {req} sent to memory controller")
             self.memory_controller.request(req)
 
         self.cycle += 1
 
+    # Earliest cycle (>= current cycle) at which tick() has something to
+    # forward, or None if the queue is empty.
+    def next_event(self):
+        if not self.queue:
+            return None
+        return max(self.queue[0][0], self.cycle)
+
 
 # ---------------------------------------------------------
 # DDR Memory Controller Model
 # Arbitrates and schedules requests for the DDR memory
 # ---------------------------------------------------------
+# Requests waiting for one bank, in one heap per (row, operation) ordered by
+# (issue time, arrival order). With the open row of the bank, the priority of
+# a request is (row miss, write, issue time), the first requests of the heaps
+# holding the best one.
+class BankQueue:
+    def __init__(self):
+        self.heaps = {}  # (row, req_type): [(time, arrival, req)]
+        self.size = 0
+
+    def push(self, row, req, arrival):
+        heapq.heappush(self.heaps.setdefault((row, req.req_type), []), (req.time, arrival, req))
+        self.size += 1
+
+    def priority(self, row, req_type, open_row, time):
+        return (0 if row == open_row else 1, 0 if req_type == 'read' else 1, time)
+
+    # Priority of the first request of the bank
+    def best(self, open_row):
+        return min(self.priority(row, req_type, open_row, heap[0][0])
+                   for (row, req_type), heap in self.heaps.items() if heap)
+
+    # Requests of the bank whose priority is key
+    def ties(self, key, open_row):
+        return [req for (row, req_type), heap in self.heaps.items()
+                if heap and self.priority(row, req_type, open_row, heap[0][0]) == key
+                for time, _, req in heap if time == key[2]]
+
+    def remove(self, row, req):
+        heap = self.heaps[(row, req.req_type)]
+        if heap[0][-1] is req:
+            heapq.heappop(heap)
+        else:
+            heap[:] = [entry for entry in heap if entry[-1] is not req]
+            heapq.heapify(heap)
+        self.size -= 1
+
+    def snapshot(self, copies):
+        return ({key: copy_entries(heap, copies) for key, heap in self.heaps.items()}, self.size)
+
+    def restore(self, state, copies):
+        heaps, self.size = state
+        self.heaps = {key: copy_entries(heap, copies) for key, heap in heaps.items()}
+
 class DDRMemoryController:
-    def __init__(self, ddr_model, tRCD=15, tRP=15, tCAS=15, tRC=30, tWR=15, tRTP=8, tCCD=4):
+    def __init__(self, ddr_model, tRCD=15, tRP=15, tCAS=15, tRC=30, tWR=15, tRTP=8, tCCD=4, context=None, num_rows=1):
         self.ddr = ddr_model
+        self.context = context if context is not None else SimContext()
         self.queue = []  # Requests waiting to be scheduled by the controller
+        self.bank_queues = [BankQueue() for _ in range(self.ddr.num_banks)]  # The same requests, per bank
+        self.pending = 0     # Number of requests in bank_queues
+        self.arrivals = 0    # Number of requests received
         self.scheduled_ddr_requests = [] # Requests passed to DDR, waiting for completion
         self.cycle = 0
 
@@ -239,14 +611,69 @@ class DDRMemoryController:
         self.last_access_command = {} # To track RD/WR transition penalties
         self.last_access_addr = {} # To track the last accessed address for a core
 
-        self.sequence_ddr = []
+        # Statistics of the scheduled requests
+        self.row_hits = np.zeros((num_rows, self.ddr.num_banks), dtype=np.int64)    # ROW HIT per (row, bank)
+        self.row_misses = np.zeros((num_rows, self.ddr.num_banks), dtype=np.int64)  # ROW MISS per (row, bank)
+        self.completion_max = {}  # Latest completion time per core
+
+    # Back to the state of a new controller
+    def reset(self):
+        self.queue = []
+        self.bank_queues = [BankQueue() for _ in range(self.ddr.num_banks)]
+        self.pending = 0
+        self.arrivals = 0
+        self.scheduled_ddr_requests = []
+        self.cycle = 0
+        self.last_command_time = {}
+        self.bank_open_row = [None] * self.ddr.num_banks
+        self.bank_precharge_complete_time = [0] * self.ddr.num_banks
+        self.last_access_command = {}
+        self.last_access_addr = {}
+        self.row_hits.fill(0)
+        self.row_misses.fill(0)
+        self.completion_max = {}
+
+    def snapshot(self):
+        copies = {}
+        return (copy_entries(self.queue, copies), [bank_queue.snapshot(copies) for bank_queue in self.bank_queues], self.pending, self.arrivals,
+                [dict(req_info, request=req_info['request'].copy()) for req_info in self.scheduled_ddr_requests],
+                self.cycle, dict(self.last_command_time), list(self.bank_open_row), list(self.bank_precharge_complete_time),
+                dict(self.last_access_command), dict(self.last_access_addr),
+                self.row_hits.copy(), self.row_misses.copy(), dict(self.completion_max))
+
+    def restore(self, state):
+        (queue, bank_queues, self.pending, self.arrivals, scheduled, self.cycle, last_command_time, bank_open_row,
+         bank_precharge_complete_time, last_access_command, last_access_addr, row_hits, row_misses, completion_max) = state
+        copies = {}
+        self.queue = copy_entries(queue, copies)
+        for bank_queue, bank_state in zip(self.bank_queues, bank_queues):
+            bank_queue.restore(bank_state, copies)
+        self.scheduled_ddr_requests = [dict(req_info, request=req_info['request'].copy()) for req_info in scheduled]
+        self.last_command_time = dict(last_command_time)
+        self.bank_open_row = list(bank_open_row)
+        self.bank_precharge_complete_time = list(bank_precharge_complete_time)
+        self.last_access_command = dict(last_access_command)
+        self.last_access_addr = dict(last_access_addr)
+        self.row_hits[...] = row_hits
+        self.row_misses[...] = row_misses
+        self.completion_max = dict(completion_max)
+
+    # Stages of the requests, logged in the context at the 'full' trace level
+    @property
+    def sequence_ddr(self):
+        return self.context.stage_trace.dicts()
 
     # Enqueue a request
     def request(self, req):
         
-        #print(f"{GlobalVar.global_cycle}: [DDR controller] request queued: {req.req_type.upper()}@{req.addr}")
+        #print(f"{self.context.global_cycle}: [DDR controller] request queued: {req.req_type.upper()}@{req.addr}")
         heapq.heappush(self.queue, (req.time, req)) # Store with original arrival time for fairness
-        self.sequence_ddr.append({'stage':'queued','cycle':GlobalVar.global_cycle,'type':req.req_type.upper(),'core':req.core_id,'addr':req.addr})
+        bank = self.ddr._get_bank(req.addr)
+        self.bank_queues[bank].push(self.ddr._get_row(req.addr), req, self.arrivals)
+        self.arrivals += 1
+        self.pending += 1
+        if self.context.tracing:
+            self.context.log_stage('queued', req)
 
     def tick(self):
         
@@ -260,6 +687,21 @@ class DDRMemoryController:
 
         return output
 
+    # Earliest cycle (>= current cycle) at which tick() may complete or
+    # schedule a request, or None if the controller is idle.
+    # A queued request becomes a scheduling candidate once its bank is out of
+    # precharge and the tCCD command-to-command delay has elapsed.
+    def next_event(self):
+        events = [req_info['request'].completion_time for req_info in self.scheduled_ddr_requests]
+        for bank, bank_queue in enumerate(self.bank_queues):
+            if not bank_queue.size:
+                continue
+            events.append(max(self.bank_precharge_complete_time[bank],
+                              self.last_command_time.get(bank, -self.tRC) + self.tCCD))
+        if not events:
+            return None
+        return max(min(events), self.cycle)
+
 
     def _complete_ddr_requests(self):
         
@@ -270,13 +712,15 @@ class DDRMemoryController:
             if req.completion_time <= self.cycle:
                 if req.req_type == 'read':
                     _ = self.ddr.memory.get(req.addr, 0) # Read value from DDR model
-                    #print(f"{GlobalVar.global_cycle}: [DDR controller] READ@{req.addr} complete")
-                    self.sequence_ddr.append({'stage':'complete','cycle':GlobalVar.global_cycle,'type':req.req_type.upper(),'core':req.core_id,'addr':req.addr})
+                    #print(f"{self.context.global_cycle}: [DDR controller] READ@{req.addr} complete")
+                    if self.context.tracing:
+                        self.context.log_stage('complete', req)
                     if req.callback:
                         req.callback()
                 elif req.req_type == 'write':
-                    #print(f"{GlobalVar.global_cycle}: [DDR controller] WRITE@{req.addr} complete")
-                    self.sequence_ddr.append({'stage':'complete','cycle':GlobalVar.global_cycle,'type':req.req_type.upper(),'core':req.core_id,'addr':req.addr})
+                    #print(f"{self.context.global_cycle}: [DDR controller] WRITE@{req.addr} complete")
+                    if self.context.tracing:
+                        self.context.log_stage('complete', req)
                     pass
 
                 completed.append(req_info)
@@ -287,20 +731,24 @@ class DDRMemoryController:
 
     def _schedule_next_request(self):
         
-        if not self.queue:  # No request, return
+        if not self.pending:  # No request, return
             return
 
-        # Apply arbitration strategy:
-        # 1. Read prioritization
-        # 2. Opened row prioritization
-        # 3. RD/WR batching (simplified by favoring row hits and avoiding bank conflicts)
-        # 4. Older commands (handled by initial sorting in `self.queue` which is a min-heap based on arrival time)
-
-        # Candidates for scheduling
-        candidates = []
-        for _, req in self.queue:
-            bank = self.ddr._get_bank(req.addr)
-            row = self.ddr._get_row(req.addr)
+        # Apply arbitration strategy (FR-FCFS):
+        # 1. Opened row prioritization
+        # 2. Read prioritization
+        # 3. Older requests, then the first one in the layout of self.queue
+        # Each bank keeps its requests in one heap per (row, operation), so the
+        # best priority of a bank is among the tops of its heaps and the bank
+        # constraints are checked once per bank. Requests of the same priority
+        # are ordered by their position in the min-heap self.queue, as when all
+        # the candidates were taken from it in order and sorted by priority.
+
+        # Banks ready for a new command
+        ready_banks = []
+        for bank, bank_queue in enumerate(self.bank_queues):
+            if not bank_queue.size:
+                continue
 
             # Check if bank is available (not in precharge)
             if self.bank_precharge_complete_time[bank] > self.cycle:
@@ -311,26 +759,38 @@ class DDRMemoryController:
             last_cmd_time = self.last_command_time.get(bank, -self.tRC) # Default if no previous command
             if self.cycle < last_cmd_time + self.tCCD: # Basic command-to-command delay
                  continue
+            ready_banks.append(bank)
 
-            self.sequence_ddr.append({'stage':'ready','cycle':GlobalVar.global_cycle,'type':req.req_type.upper(),'core':req.core_id,'addr':req.addr})
-            candidates.append(req)
-
-        if not candidates:
-            #print(f"{GlobalVar.global_cycle}: [DDR controller] No suitable candidates for scheduling this cycle.")
+        if not ready_banks:
+            #print(f"{self.context.global_cycle}: [DDR controller] No suitable candidates for scheduling this cycle.")
             return
 
-        # Sort candidates based on priority rules (simplified scoring for demonstration)
-        # We want to prioritize:
-        # 1. Row hits
-        # 2. Reads over Writes
-        # 3. Older requests (handled by min-heap property of self.queue)
-        candidates.sort(key=lambda req: (
-            0 if self.bank_open_row[self.ddr._get_bank(req.addr)] == self.ddr._get_row(req.addr) else 1, # Row hit first
-            0 if req.req_type == 'read' else 1, # Reads before writes
-            req.time # Oldest request if other criteria are equal
-        ))
-
-        best_req = candidates[0]
+        best_key = min(self.bank_queues[bank].best(self.bank_open_row[bank]) for bank in ready_banks)
+        ties = [req for bank in ready_banks for req in self.bank_queues[bank].ties(best_key, self.bank_open_row[bank])]
+        if len(ties) == 1:
+            best_req = ties[0]
+        else:
+            ties = set(map(id, ties))
+            best_req = next(req for _, req in self.queue if id(req) in ties)
+
+        # Every request of the ready banks, in the order of self.queue then by
+        # priority, for the logs (None below the 'contention' trace level, only counted)
+        candidates = None
+        if self.context.trace_accesses:
+            ready = set(ready_banks)
+            candidates = [req for _, req in self.queue if self.ddr._get_bank(req.addr) in ready]
+            for req in candidates:
+                self.context.log_stage('ready', req)
+            candidates.sort(key=lambda req: (
+                0 if self.bank_open_row[self.ddr._get_bank(req.addr)] == self.ddr._get_row(req.addr) else 1, # Row hit first
+                0 if req.req_type == 'read' else 1, # Reads before writes
+                req.time # Oldest request if other criteria are equal
+            ))
+        elif self.context.tracing:
+            num_candidates = sum(self.bank_queues[bank].size for bank in ready_banks)
+            self.context.trace_counts['ready'] += num_candidates
+            self.context.trace_counts['ddr_access'] += num_candidates
+
         bank = self.ddr._get_bank(best_req.addr)
         row = self.ddr._get_row(best_req.addr)
 
@@ -338,10 +798,10 @@ class DDRMemoryController:
         delay = self.ddr.base_latency
         row_status = "ROW HIT"
         if self.bank_open_row[bank] == row:
-            #print(f"{GlobalVar.global_cycle}: [DDR] ROW HIT@{best_req.addr} for bank {bank} ")
+            #print(f"{self.context.global_cycle}: [DDR] ROW HIT@{best_req.addr} for bank {bank} ")
             delay = self.ddr.row_hit_latency
         else:
-            #print(f"{GlobalVar.global_cycle}: [DDR] ROW MISS@{best_req.addr} for bank {bank} ")
+            #print(f"{self.context.global_cycle}: [DDR] ROW MISS@{best_req.addr} for bank {bank} ")
             delay = self.tRP + self.tRCD + self.tCAS # ACT (tRCD) + PRE (tRP) + CAS
             row_status = "ROW MISS"
             self.bank_precharge_complete_time[bank] = self.cycle + self.tRP # Bank busy during precharge
@@ -355,33 +815,39 @@ class DDRMemoryController:
             if last_cmd_type == 'write' and best_req.req_type == 'read':
                 # Simplified: add twR as turnaround penalty for WR->RD
                 delay += self.tWR # tWTR for actual paper value
-                #print(f"{GlobalVar.global_cycle}: [DDR] Applying WR->RD transition penalty for Bank {bank}")
+                #print(f"{self.context.global_cycle}: [DDR] Applying WR->RD transition penalty for Bank {bank}")
             elif last_cmd_type == 'read' and best_req.req_type == 'write':
                 # Simplified: add tWR (Write Latency) + 2 cycles for RD->WR
                 delay += self.tWR + 2
-                #print(f"{GlobalVar.global_cycle}: [DDR] Applying RD->WR transition penalty for Bank {bank}")
+                #print(f"{self.context.global_cycle}: [DDR] Applying RD->WR transition penalty for Bank {bank}")
 
         completion_time = self.cycle + delay
 
-
-
+        if row_status == "ROW MISS":
+            self.row_misses[row, bank] += 1
+        else:
+            self.row_hits[row, bank] += 1
+        if completion_time > self.completion_max.get(best_req.core_id, 0):
+            self.completion_max[best_req.core_id] = completion_time
 
         # Update controller's state after scheduling
         self.last_command_time[bank] = self.cycle
         self.last_access_command[bank] = best_req.req_type
         self.last_access_addr[bank] = best_req.addr
 
-        # Remove the request from the controller's queue
+        # Remove the request from the controller's queues
         for i, (time, req) in enumerate(self.queue):
-            if req == best_req:
+            if req is best_req:
                 self.queue.pop(i)
                 break
         heapq.heapify(self.queue) # Re-heapify after pop
+        self.bank_queues[bank].remove(row, best_req)
+        self.pending -= 1
 
-        #print(f"{GlobalVar.global_cycle}: [DDR controller] Scheduling {best_req.req_type.upper()}@{best_req.addr} via Controller")
-        #print(f"{GlobalVar.global_cycle}: [DDR controller] Bank {bank}, Row {row} | {row_status} | Calculated Delay: {delay} | Completion at Cycle {completion_time}")
+        #print(f"{self.context.global_cycle}: [DDR controller] Scheduling {best_req.req_type.upper()}@{best_req.addr} via Controller")
+        #print(f"{self.context.global_cycle}: [DDR controller] Bank {bank}, Row {row} | {row_status} | Calculated Delay: {delay} | Completion at Cycle {completion_time}")
 
-        #self.sequence_ddr.append({'stage':'scheduling','cycle':GlobalVar.global_cycle,'type':req.req_type.upper(),'core':req.core_id,'addr':req.addr})
+        #self.sequence_ddr.append({'stage':'scheduling','cycle':self.context.global_cycle,'type':req.req_type.upper(),'core':req.core_id,'addr':req.addr})
 
         # Pass the request to the DDR
         best_req.time = self.cycle # Update request time to when it's issued to DDR
@@ -390,11 +856,12 @@ class DDRMemoryController:
         #self.scheduled_ddr_requests.append({'request': best_req, 'bank': bank, 'row': row, 'status': row_status})
 
 
-        GlobalVar.log_ddr_access(best_req.core_id, best_req.addr, best_req.req_type,
-                               self.ddr._get_bank(best_req.addr), self.ddr._get_row(best_req.addr), row_status)
-        for cmd in candidates[1:]:
-            GlobalVar.log_ddr_access(cmd.core_id, cmd.addr, cmd.req_type,
-                               self.ddr._get_bank(cmd.addr), self.ddr._get_row(cmd.addr), 'waiting')
+        if candidates is not None:
+            self.context.log_ddr_access(best_req.core_id, best_req.addr, best_req.req_type,
+                                   self.ddr._get_bank(best_req.addr), self.ddr._get_row(best_req.addr), row_status)
+            for cmd in candidates[1:]:
+                self.context.log_ddr_access(cmd.core_id, cmd.addr, cmd.req_type,
+                                   self.ddr._get_bank(cmd.addr), self.ddr._get_row(cmd.addr), 'waiting')
 
         return {'completion_time': completion_time,
                 'row': row,
@@ -433,6 +900,29 @@ class DDRMemory:
 
         self.scheduled_completions = [] # Requests whose data is ready to be returned
 
+    # Back to the state of a new DDR
+    def reset(self):
+        self.memory = {}
+        self.cycle = 0
+        self.bank_states = [DDRState.IDLE] * self.num_banks
+        self.bank_timers = [0] * self.num_banks
+        self.bank_open_row = [None] * self.num_banks
+        self.bank_active_requests = [None] * self.num_banks
+        self.scheduled_completions = []
+
+    def snapshot(self):
+        return (dict(self.memory), self.cycle, list(self.bank_states), list(self.bank_timers), list(self.bank_open_row),
+                list(self.bank_active_requests), copy_entries(self.scheduled_completions))
+
+    def restore(self, state):
+        memory, self.cycle, bank_states, bank_timers, bank_open_row, bank_active_requests, scheduled_completions = state
+        self.memory = dict(memory)
+        self.bank_states = list(bank_states)
+        self.bank_timers = list(bank_timers)
+        self.bank_open_row = list(bank_open_row)
+        self.bank_active_requests = list(bank_active_requests)
+        self.scheduled_completions = copy_entries(scheduled_completions)
+
     def _get_bank(self, addr):
         return addr % self.num_banks
 
@@ -448,7 +938,7 @@ class DDRMemory:
 
         # Simplified state transitions (see Figure 3.9 in Mascarenas-Gonzalez thesis)
         current_state = self.bank_states[bank]
-        #print(f"{GlobalVar.global_cycle}: [DDR] Bank {bank} receives {req.req_type.upper()} for Row {row}. Current state: {current_state.name}")
+        #print(f"{self.cycle}: [DDR] Bank {bank} receives {req.req_type.upper()} for Row {row}. Current state: {current_state.name}")
 
         if req.req_type == 'read':
             if current_state == DDRState.IDLE or self.bank_open_row[bank] != row:
@@ -457,15 +947,15 @@ class DDRMemory:
                 self.bank_states[bank] = DDRState.READING
                 self.bank_timers[bank] = req.completion_time
                 self.bank_open_row[bank] = row
-                #print(f"{GlobalVar.global_cycle}: [DDR] Bank {bank} transition: IDLE or row change -> READING scheduled at {req.completion_time}")
+                #print(f"{self.cycle}: [DDR] Bank {bank} transition: IDLE or row change -> READING scheduled at {req.completion_time}")
 
             elif current_state == DDRState.ACTIVATE_BANK_ROW or current_state == DDRState.READING:
                 self.bank_states[bank] = DDRState.READING
                 self.bank_timers[bank] = req.completion_time
-                #print(f"{GlobalVar.global_cycle}: [DDR] Bank {bank} transition: ACTIVATE_BANK_ROW/READING -> READING scheduled at {req.completion_time}")
+                #print(f"{self.cycle}: [DDR] Bank {bank} transition: ACTIVATE_BANK_ROW/READING -> READING scheduled at {req.completion_time}")
                 
             else:
-                #print(f"{GlobalVar.global_cycle}: [DDR] ERROR: Cannot READ from Bank {bank} in state {current_state.name}")
+                #print(f"{self.cycle}: [DDR] ERROR: Cannot READ from Bank {bank} in state {current_state.name}")
                 pass
 
         elif req.req_type == 'write':
@@ -473,14 +963,14 @@ class DDRMemory:
                 self.bank_states[bank] = DDRState.WRITING
                 self.bank_timers[bank] = req.completion_time
                 self.bank_open_row[bank] = row
-                #print(f"{GlobalVar.global_cycle}: [DDR] Bank {bank} transition: IDLE -> WRITING  scheduled at {req.completion_time}")
+                #print(f"{self.cycle}: [DDR] Bank {bank} transition: IDLE -> WRITING  scheduled at {req.completion_time}")
 
             elif current_state == DDRState.ACTIVATE_BANK_ROW or current_state == DDRState.WRITING:
                 self.bank_states[bank] = DDRState.WRITING
                 self.bank_timers[bank] = req.completion_time
-                #print(f"{GlobalVar.global_cycle}: [DDR] Bank {bank} transition: ACTIVATE_BANK_ROW/WRITING -> WRITING  scheduled at {req.completion_time}")
+                #print(f"{self.cycle}: [DDR] Bank {bank} transition: ACTIVATE_BANK_ROW/WRITING -> WRITING  scheduled at {req.completion_time}")
             else:
-                #print(f"{GlobalVar.global_cycle}: [DDR] ERROR: Cannot WRITE to Bank {bank} in state {current_state.name}")
+                #print(f"{self.cycle}: [DDR] ERROR: Cannot WRITE to Bank {bank} in state {current_state.name}")
                 pass
 
         # Store the request with its completion time for processing
@@ -505,7 +995,7 @@ class DDRMemory:
                 # After a read/write, it implicitly goes to ACTIVATE_BANK_ROW, ready for more column access or PRE
                 self.bank_states[bank] = DDRState.ACTIVATE_BANK_ROW
                 self.bank_timers[bank] = 0 # Ready for next command
-                #print(f"{GlobalVar.global_cycle}: [DDR] Bank {bank} access completion, transition: READING/WRITING -> ACTIVATE_BANK_ROW")
+                #print(f"{self.cycle}: [DDR] Bank {bank} access completion, transition: READING/WRITING -> ACTIVATE_BANK_ROW")
 
         # Update FSM timers for each bank
         for i in range(self.num_banks):
@@ -519,16 +1009,27 @@ class DDRMemory:
             elif self.bank_states[i] == DDRState.PRECHARGING and self.bank_timers[i] <= self.cycle:
                 self.bank_states[i] = DDRState.IDLE
                 self.bank_open_row[i] = None
-                #print(f"{GlobalVar.global_cycle}: [DDR] Bank {i} transition: PRECHARGING -> IDLE")
+                #print(f"{self.cycle}: [DDR] Bank {i} transition: PRECHARGING -> IDLE")
 
         self.cycle += 1
 
+    # Earliest cycle (>= current cycle) at which tick() has a completion to
+    # process or a precharge to finish, or None if the DDR is idle.
+    def next_event(self):
+        events = [timer for state, timer in zip(self.bank_states, self.bank_timers) if state == DDRState.PRECHARGING]
+        if self.scheduled_completions:
+            events.append(self.scheduled_completions[0][0])
+        if not events:
+            return None
+        return max(min(events), self.cycle)
+
 #---------------------------------------
 # Models one level in the cache hierarchy
 #----------------------------------------
 class CacheLevel:
-    def __init__(self, level_name, core_id, size, line_size, assoc, memory=None, write_back=True, write_allocate=True):
+    def __init__(self, level_name, core_id, size, line_size, assoc, memory=None, write_back=True, write_allocate=True, context=None):
         self.level = level_name
+        self.context = context if context is not None else SimContext()
         self.core_id = core_id
         self.line_size = line_size
         self.assoc = assoc
@@ -545,6 +1046,37 @@ class CacheLevel:
         self.miss_tab = np.zeros((self.num_sets,assoc))
         self.hit_tab = np.zeros((self.num_sets,assoc))
 
+    # Cold cache: every line invalid, PLRU trees and counters cleared in place
+    def reset(self):
+        for cache_set in self.sets:
+            for line in cache_set:
+                line.valid = False
+                line.tag = None
+                line.dirty = False
+        for plru in self.plru_trees:
+            plru.reset()
+        self.hits = 0
+        self.misses = 0
+        self.miss_tab.fill(0)
+        self.hit_tab.fill(0)
+
+    # The lines are written back into the same CacheLine objects, captured by
+    # the callbacks of pending reads
+    def snapshot(self):
+        return ([(line.valid, line.tag, line.dirty) for cache_set in self.sets for line in cache_set],
+                [plru.state for plru in self.plru_trees], self.hits, self.misses, self.hit_tab.copy(), self.miss_tab.copy())
+
+    def restore(self, state):
+        lines, plru_states, self.hits, self.misses, hit_tab, miss_tab = state
+        for line, (valid, tag, dirty) in zip((line for cache_set in self.sets for line in cache_set), lines):
+            line.valid = valid
+            line.tag = tag
+            line.dirty = dirty
+        for plru, plru_state in zip(self.plru_trees, plru_states):
+            plru.state = plru_state
+        self.hit_tab[...] = hit_tab
+        self.miss_tab[...] = miss_tab
+
     # Extract the set index from the address
     #  addr = [ tag ][ idx ][ offset ]
     def _index(self, addr):
@@ -564,21 +1096,21 @@ class CacheLevel:
         cache_set = self.sets[index]
         plru = self.plru_trees[index]
 				
-        #print(f"{GlobalVar.global_cycle}: [Cache {self.level}] READ@{addr} from {self.core_id}")
+        #print(f"{self.context.global_cycle}: [Cache {self.level}] READ@{addr} from {self.core_id}")
 
         # Track L2 access for shared cache analysis
         #if self.level == "L2":
-        #    GlobalVar.log_l2_access(origine, addr, 'read', index, -1, False)  # way not known yet
+        #    self.context.log_l2_access(origine, addr, 'read', index, -1, False)  # way not known yet
 
         # Seach the tag in the cache set
         for i, line in enumerate(cache_set):
             if line.valid and line.tag == tag:
 
-                if self.level == "L2":
-                    GlobalVar.log_l2_access(origine, addr, 'read', index, i, True)
+                if self.level == "L2" and self.context.tracing:
+                    self.context.log_l2_access(origine, addr, 'read', index, i, True)
                 # There is a hit.
                 # Trace event
-                #print(f"{GlobalVar.global_cycle}: [Cache {self.level}] READ HIT@{addr} from {self.core_id}")
+                #print(f"{self.context.global_cycle}: [Cache {self.level}] READ HIT@{addr} from {self.core_id}")
                 
                 # Count hits
                 self.hits += 1
@@ -594,10 +1126,10 @@ class CacheLevel:
         # Cache miss...
 
         # Cache miss
-        if self.level == "L2":
-            GlobalVar.log_l2_access(origine, addr, 'read', index, -1, False)
+        if self.level == "L2" and self.context.tracing:
+            self.context.log_l2_access(origine, addr, 'read', index, -1, False)
         # Trace event
-        #print(f"{GlobalVar.global_cycle}: [Cache {self.level}] READ MISS@{addr} from {self.core_id}")
+        #print(f"{self.context.global_cycle}: [Cache {self.level}] READ MISS@{addr} from {self.core_id}")
         
         # Count misses
         self.misses += 1
@@ -643,19 +1175,19 @@ class CacheLevel:
         cache_set = self.sets[index]
         plru = self.plru_trees[index]
 
-        #print(f"{GlobalVar.global_cycle}: [Cache {self.level}] WRITE@{addr} from {self.core_id}")
+        #print(f"{self.context.global_cycle}: [Cache {self.level}] WRITE@{addr} from {self.core_id}")
         # Track L2 access for shared cache analysis
         #if self.level == "L2":
-        #    GlobalVar.log_l2_access(origine, addr, 'write', index, -1, False)
+        #    self.context.log_l2_access(origine, addr, 'write', index, -1, False)
 
         for i, line in enumerate(cache_set):
             if line.valid and line.tag == tag:
                # Cache hit
-                if self.level == "L2":
-                    GlobalVar.log_l2_access(origine, addr, 'write', index, i, True)
+                if self.level == "L2" and self.context.tracing:
+                    self.context.log_l2_access(origine, addr, 'write', index, i, True)
                 # There is a cache hit
                 # Trace event
-                #print(f"{GlobalVar.global_cycle}: [Cache {self.level}] WRITE HIT@{addr} from {self.core_id}")
+                #print(f"{self.context.global_cycle}: [Cache {self.level}] WRITE HIT@{addr} from {self.core_id}")
 
                 # Count hits
                 self.hits += 1
@@ -676,10 +1208,10 @@ class CacheLevel:
 
         # There is a cache miss...
         # Cache miss
-        if self.level == "L2":
-            GlobalVar.log_l2_access(origine, addr, 'write', index, -1, False)
+        if self.level == "L2" and self.context.tracing:
+            self.context.log_l2_access(origine, addr, 'write', index, -1, False)
         # Trace event
-        #print(f"{GlobalVar.global_cycle}: [Cache {self.level}] WRITE MISS@{addr} from {self.core_id}")
+        #print(f"{self.context.global_cycle}: [Cache {self.level}] WRITE MISS@{addr} from {self.core_id}")
         
         # Count misses
         self.misses += 1
@@ -730,6 +1262,169 @@ class CacheLevel:
             'cache_miss_detailled':self.miss_tab,#number of miss at every locaation
         }
 
+#---------------------------------------
+# Array-backed cache level
+#----------------------------------------
+# Same behaviour as CacheLevel (hits, misses, hit_tab/miss_tab, L2 logging,
+# write-backs), with the lines of all the sets stored in flat typed arrays of
+# num_sets * assoc entries instead of CacheLine objects (line (index, way) at
+# index * assoc + way):
+# - valid, dirty: array('b')
+# - tag: array('q'), -1 for a line that never held data, so that the tag
+#   lookup of a set is a single array.index scan of its slice
+# - plru: the PLRU state of every set (see PLRUTable)
+# valid_tab, tag_tab and dirty_tab are (num_sets, assoc) NumPy views on the
+# same memory. Typed arrays are used rather than NumPy arrays for the storage
+# because a NumPy call per access costs more than the whole search.
+# Selected with 'impl': 'array' in the cache configuration dict (see cache_level).
+
+class ArrayCacheLevel(CacheLevel):
+    def __init__(self, level_name, core_id, size, line_size, assoc, memory=None, write_back=True, write_allocate=True, context=None):
+        self.level = level_name
+        self.context = context if context is not None else SimContext()
+        self.core_id = core_id
+        self.line_size = line_size
+        self.assoc = assoc
+        self.num_sets = (size // line_size) // assoc
+        self.num_lines = self.num_sets * assoc
+        self.valid = array('b', [0]) * self.num_lines
+        self.tag = array('q', [-1]) * self.num_lines
+        self.dirty = array('b', [0]) * self.num_lines
+        self.valid_tab = np.frombuffer(self.valid, dtype=np.int8).reshape(self.num_sets, assoc)
+        self.tag_tab = np.frombuffer(self.tag, dtype=np.int64).reshape(self.num_sets, assoc)
+        self.dirty_tab = np.frombuffer(self.dirty, dtype=np.int8).reshape(self.num_sets, assoc)
+        self.plru = [0] * self.num_sets
+        self.plru_table = plru_table(assoc)
+        self.memory = memory
+        self.lower = None
+        self.write_back = write_back
+        self.write_allocate = write_allocate
+        self.hits = 0
+        self.misses = 0
+
+        self.miss_tab = np.zeros((self.num_sets,assoc))
+        self.hit_tab = np.zeros((self.num_sets,assoc))
+
+    def reset(self):
+        self.valid_tab.fill(0)
+        self.tag_tab.fill(-1)
+        self.dirty_tab.fill(0)
+        self.plru = [0] * self.num_sets
+        self.hits = 0
+        self.misses = 0
+        self.miss_tab.fill(0)
+        self.hit_tab.fill(0)
+
+    # Same size slice assignments, the NumPy views stay valid
+    def snapshot(self):
+        return (self.valid[:], self.tag[:], self.dirty[:], list(self.plru), self.hits, self.misses,
+                self.hit_tab.copy(), self.miss_tab.copy())
+
+    def restore(self, state):
+        valid, tag, dirty, plru, self.hits, self.misses, hit_tab, miss_tab = state
+        self.valid[:] = valid
+        self.tag[:] = tag
+        self.dirty[:] = dirty
+        self.plru = list(plru)
+        self.hit_tab[...] = hit_tab
+        self.miss_tab[...] = miss_tab
+
+    # Way holding the tag in the set, or -1
+    def lookup(self, index, tag):
+        base = index * self.assoc
+        try:
+            return self.tag.index(tag, base, base + self.assoc) - base
+        except ValueError:
+            return -1
+
+    # Writes the line back to the lower level if it is valid and dirty
+    def write_back_line(self, index, line, origine):
+        if self.valid[line] and self.dirty[line] and self.write_back:
+            victim_addr = ((self.tag[line] * self.num_sets) + index) * self.line_size
+            if self.lower:
+                self.lower.write(victim_addr,origine=self.core_id)
+            elif self.memory: # If L2, send to interconnect
+                self.memory.request(MemoryRequest(origine, self.memory.cycle, 'write', victim_addr))
+
+    def read(self, addr, callback,origine=None):
+        index = self._index(addr)
+        tag = self._tag(addr)
+        i = self.lookup(index, tag)
+        if i >= 0:
+            if self.level == "L2" and self.context.tracing:
+                self.context.log_l2_access(origine, addr, 'read', index, i, True)
+            self.hits += 1
+            self.hit_tab[index,i] += 1
+            self.plru[index] = self.plru_table.update_on_access(self.plru[index], i)
+            callback()
+            return
+
+        if self.level == "L2" and self.context.tracing:
+            self.context.log_l2_access(origine, addr, 'read', index, -1, False)
+        self.misses += 1
+        # CacheLevel counts a read miss on the last way visited by its search loop
+        self.miss_tab[index,self.assoc-1] += 1
+
+        victim_idx = self.plru_table.get_victim(self.plru[index])
+        line = index * self.assoc + victim_idx
+
+        # The victim line is looked at when the data comes back, as in CacheLevel
+        def lower_cb():
+            self.write_back_line(index, line, origine)
+            self.valid[line] = 1
+            self.tag[line] = tag
+            self.dirty[line] = 0
+            self.plru[index] = self.plru_table.update_on_access(self.plru[index], victim_idx)
+            callback()
+
+        if self.lower:
+            self.lower.read(addr, lower_cb,origine=self.core_id)
+        elif self.memory:
+            self.memory.request(MemoryRequest(origine, self.memory.cycle, 'read', addr, lower_cb))
+
+    def write(self, addr,origine=None):
+        index = self._index(addr)
+        tag = self._tag(addr)
+        i = self.lookup(index, tag)
+        if i >= 0:
+            if self.level == "L2" and self.context.tracing:
+                self.context.log_l2_access(origine, addr, 'write', index, i, True)
+            self.hits += 1
+            self.dirty[index * self.assoc + i] = 1 if self.write_back else 0
+            self.plru[index] = self.plru_table.update_on_access(self.plru[index], i)
+            if not self.write_back:
+                if self.lower:
+                    self.lower.write(addr,origine=self.core_id)
+                elif self.memory:
+                    self.memory.request(MemoryRequest(origine, self.memory.cycle, 'write', addr))
+            return
+
+        if self.level == "L2" and self.context.tracing:
+            self.context.log_l2_access(origine, addr, 'write', index, -1, False)
+        self.misses += 1
+
+        if self.write_allocate:
+            victim_idx = self.plru_table.get_victim(self.plru[index])
+            line = index * self.assoc + victim_idx
+            self.write_back_line(index, line, origine)
+            self.valid[line] = 1
+            self.tag[line] = tag
+            self.dirty[line] = 1 if self.write_back else 0
+            self.plru[index] = self.plru_table.update_on_access(self.plru[index], victim_idx)
+        else:
+            if self.lower:
+                self.lower.write(addr,origine=self.core_id)
+            elif self.memory:
+                self.memory.request(MemoryRequest(origine, self.memory.cycle, 'write', addr))
+
+CACHE_LEVELS = {'object': CacheLevel, 'array': ArrayCacheLevel}
+
+# Builds a cache level from its configuration dict, whose optional 'impl' key
+# selects the implementation in CACHE_LEVELS ('object' by default)
+def cache_level(level_name, core_id, impl='object', **conf):
+    assert impl in CACHE_LEVELS, f'unknown cache implementation {impl}'
+    return CACHE_LEVELS[impl](level_name, core_id, **conf)
+
 # ---------------------------------------------------------
 # Multi-level cache hierarchy for a core
 # Currently supports 2 levels (L1 + shared L2)
@@ -738,7 +1433,7 @@ class MultiLevelCache:
     def __init__(self, core_id, l1_conf, shared_cache):
         self.core_id = core_id
         # Create the memory hierarchy
-        self.l1 = CacheLevel("L1", core_id, **l1_conf)
+        self.l1 = cache_level("L1", core_id, context=shared_cache.context, **l1_conf)
         self.l1.lower = shared_cache  # L1 connects to the shared L2 cache
         #add up cache for lower cache
         self.l1.lower.upper = self.l1
@@ -762,18 +1457,37 @@ class MultiLevelCache:
 # Simple CPU core model that generates memory accesses
 # ---------------------------------------------------------
 class Core:
-    def __init__(self, core_id, cache):
+    def __init__(self, core_id, cache, context=None):
         self.core_id = core_id
+        self.context = context if context is not None else cache.l1.context
         self.cache = cache
         self.cache.core_id = core_id
         self.pending_accesses = []  # List of (op, addr) tuples for pending accesses
         self.stall_op = None        # (op, addr) of the stalled operation, if any
         self.inst = {}            # Instructions scheduled by cycle {cycle: (op, addr)}
+        self.inst_cycles = []     # Sorted cycles of self.inst, used by next_event()
+
+    # Back to the state of a new core, without instructions
+    def reset(self):
+        self.pending_accesses = []
+        self.stall_op = None
+        self.inst = {}
+        self.inst_cycles = []
+
+    # The instructions are not part of the state, they are loaded separately
+    def snapshot(self):
+        return (list(self.pending_accesses), self.stall_op)
+
+    def restore(self, state):
+        pending_accesses, self.stall_op = state
+        self.pending_accesses = list(pending_accesses)
 
     # Load a sequence of instructions
     # Instructions are a dict {cycle: (op, addr)}
     def load_instr(self, inst):
-        self.inst=inst
+        # packed programs (see program.py) are unpacked once, instructions are looked up by cycle
+        self.inst=unpack(inst) if is_packed(inst) else inst
+        self.inst_cycles = sorted(self.inst)
 
     def read(self, addr, callback):
         self.cache.read(addr, callback)
@@ -785,16 +1499,16 @@ class Core:
     def enqueue_access(self, op, addr):
         # Enqueue a memory access operation (read or write) in FIFO order 
         # This is used to track pending accesses for dependency checking.
-        #print(f"{GlobalVar.global_cycle}: [Core {self.core_id}] enqueueing access {op.upper()}@{addr} :", end=" ")  
+        #print(f"{self.context.global_cycle}: [Core {self.core_id}] enqueueing access {op.upper()}@{addr} :", end=" ")  
         self.pending_accesses.append((op, addr))
         if len(self.pending_accesses) > 10:
-            #print(f"{GlobalVar.global_cycle}: [Core {self.core_id}] :more than 10 pending accesses!")   
+            #print(f"{self.context.global_cycle}: [Core {self.core_id}] :more than 10 pending accesses!")   
             pass
         #print(f"{self.pending_accesses}")
 
     def dequeue_access(self, op, addr):
         # Remove the oldest entry in the queue matching the operation and address
-        #print(f"{GlobalVar.global_cycle}: [Core {self.core_id}] dequeueing access {op.upper()}@{addr} :", end=" ")
+        #print(f"{self.context.global_cycle}: [Core {self.core_id}] dequeueing access {op.upper()}@{addr} :", end=" ")
         for i, (o, a) in enumerate(self.pending_accesses):
             if o == op and a == addr:
                 self.pending_accesses.pop(i)
@@ -810,6 +1524,16 @@ class Core:
                 return True 
         return False
 
+    # Earliest cycle (>= cycle) at which tick() may issue an access, or None.
+    # A stalled core only wakes up once its dependency has been released by a
+    # memory callback, which can only happen during a memory controller tick.
+    def next_event(self, cycle):
+        if self.stall_op:
+            op, addr = self.stall_op
+            return None if self.dependency(op, addr) else cycle
+        i = bisect.bisect_left(self.inst_cycles, cycle)
+        return self.inst_cycles[i] if i < len(self.inst_cycles) else None
+
     def tick(self):
         
 
@@ -818,7 +1542,7 @@ class Core:
         if self.stall_op:
             op, addr = self.stall_op
             if not self.dependency(op, addr):
-                #print(f"{GlobalVar.global_cycle}: [Core {self.core_id}] Resuming stalled {op.upper()}@{addr}")
+                #print(f"{self.context.global_cycle}: [Core {self.core_id}] Resuming stalled {op.upper()}@{addr}")
                 if op == 'write':
                     self.write(addr)
                     self.stall_op = None
@@ -827,124 +1551,79 @@ class Core:
                     self.read(addr, lambda addr=addr: self.dequeue_access('read', addr) )
                     self.stall_op = None
             else:
-                #print(f"{GlobalVar.global_cycle}: [Core {self.core_id}] Still stalled on {op.upper()}@{addr} due to dependency")
+                #print(f"{self.context.global_cycle}: [Core {self.core_id}] Still stalled on {op.upper()}@{addr} due to dependency")
                 return 
-            return GlobalVar.global_cycle
+            return self.context.global_cycle
 
         # Check if there is an instruction to execute
-        if GlobalVar.global_cycle in self.inst:
-            op,addr = self.inst[GlobalVar.global_cycle]
+        if self.context.global_cycle in self.inst:
+            op,addr = self.inst[self.context.global_cycle]
             if op=='write':
                 if self.dependency('write', addr):
                     # There is a pending access with dependency, we stall
-                    #print(f"{GlobalVar.global_cycle}: [Core {self.core_id}] WRITE@{addr} stalled due to dependency")
+                    #print(f"{self.context.global_cycle}: [Core {self.core_id}] WRITE@{addr} stalled due to dependency")
                     self.stall_op = ('write', addr)
                     return 
                 else:
-                    #print(f"{GlobalVar.global_cycle}: [Core {self.core_id}] WRITE op at @{addr}")
+                    #print(f"{self.context.global_cycle}: [Core {self.core_id}] WRITE op at @{addr}")
                     self.write(addr)             
-                    return GlobalVar.global_cycle
+                    return self.context.global_cycle
             else:
                 if self.dependency('read', addr):
                     # There is a pending access with dependency, we stall
-                    #print(f"{GlobalVar.global_cycle}: [Core {self.core_id}] READ@{addr} stalled due to dependency")
+                    #print(f"{self.context.global_cycle}: [Core {self.core_id}] READ@{addr} stalled due to dependency")
                     self.stall_op = ('read', addr)
                     return
                 else:
-                    #print(f"{GlobalVar.global_cycle}: [Core {self.core_id}] READ op at @{addr}")
+                    #print(f"{self.context.global_cycle}: [Core {self.core_id}] READ op at @{addr}")
                     self.enqueue_access('read', addr)
                     self.read(addr, lambda addr=addr: self.dequeue_access('read', addr) )
-                    return GlobalVar.global_cycle
+                    return self.context.global_cycle
         else:
              # IDLE cycle, do nothing.
-            #print(f"{GlobalVar.global_cycle}: [Core {self.core_id}] IDLE cycle")
+            #print(f"{self.context.global_cycle}: [Core {self.core_id}] IDLE cycle")
             pass
 
 
-# Add a new analysis function to detect contention
-def analyze_shared_resource_contention():
-    """Analyze logged accesses to detect shared resource contention"""
-
-    # Analyze L2 cache contention
-    l2_contention_cycles = set()
-    l2_access_by_cycle = {}
-
-    for access in GlobalVar.l2_access_log:
-        cycle = access['cycle']
-        if cycle not in l2_access_by_cycle:
-            l2_access_by_cycle[cycle] = []
-        l2_access_by_cycle[cycle].append(access)
-
-    for cycle, accesses in l2_access_by_cycle.items():
-        if len(accesses) > 1:
-            # Multiple accesses in same cycle - potential contention
-            cores_involved = set(access['core_id'] for access in accesses)
-            if len(cores_involved) > 1:
-                l2_contention_cycles.add(cycle)
-                # Log detailed contention event
-                details = {
-                    'set_indices': [access['set_index'] for access in accesses],
-                    'operations': [access['operation'] for access in accesses],
-                    'addresses': [access['addr'] for access in accesses],
-                    'ways':[access['way'] for access in accesses],
-                }
-                GlobalVar.log_shared_resource_event(
-                    'L2_CACHE_CONTENTION', 'L2_CACHE', list(cores_involved), details,cycle
-                )
-
-    # Analyze DDR memory contention
-    ddr_contention_cycles = set()
-    ddr_access_by_cycle = {}
-
-    for access in GlobalVar.ddr_access_log:
-        cycle = access['cycle']
-        if cycle not in ddr_access_by_cycle:
-            ddr_access_by_cycle[cycle] = []
-        ddr_access_by_cycle[cycle].append(access)
+# DDR miss ratios of one or several simulations from their (..., num_rows, num_banks)
+# ROW HIT and ROW MISS counts. Returns the ratio per row and bank (-1 where the
+# row was not accessed), the ratio per bank and the global ratio. As in the
+# original bookkeeping, the row hits of a simulation are all counted for every
+# bank it accessed.
+def ddr_miss_ratios(hit_counts, miss_counts):
+    hits_tab = np.asarray(hit_counts, dtype=float)
+    miss_tab = np.asarray(miss_counts, dtype=float)
+    miss = miss_tab.sum(axis=-2)
+    hits = np.where((miss_tab + hits_tab).sum(axis=-2) > 0, hits_tab.sum(axis=(-2, -1))[..., None], 0.0)
 
-    for cycle, accesses in ddr_access_by_cycle.items():
-        if len(accesses) > 1:
-            # Multiple DDR accesses in same cycle - bank/row level analysis
-            cores_involved = set(access['core_id'] for access in accesses)
-            banks_accessed = set(access['bank'] for access in accesses)
+    denominator = miss + hits
+    denominator[denominator==0] = -1
+    ratios = miss/(denominator)
+    ratios[ratios<=0] = 0
 
-            # Check for bank conflicts
-            bank_conflicts = len(accesses) > len(banks_accessed)
+    total = miss.sum(axis=-1) + hits.sum(axis=-1)
+    miss_ratio_global = np.divide(miss.sum(axis=-1), total, out=np.zeros_like(total), where=total>0)
 
-            # Check for row buffer conflicts
-            row_conflicts = False
-            bank_row_map = {}
-            for access in accesses:
-                bank = access['bank']
-                row = access['row']
-                if bank in bank_row_map and bank_row_map[bank] != row:
-                    row_conflicts = True
-                bank_row_map[bank] = row
-
-            if len(cores_involved) > 1 and (bank_conflicts or row_conflicts):
-                ddr_contention_cycles.add(cycle)
-                details = {
-                    'banks': [access['bank'] for access in accesses],
-                    'rows': [access['row'] for access in accesses],
-                    'operations': [access['operation'] for access in accesses],
-                    'statuses': [access['status'] for access in accesses],
-                    'bank_conflicts': bank_conflicts,
-                    'row_conflicts': row_conflicts
-                }
-                GlobalVar.log_shared_resource_event(
-                    #'DDR_MEMORY_CONTENTION', 'DDR_MEMORY', list(cores_involved), details
-                    'DDR_MEMORY_CONTENTION', 'DDR_MEMORY', [access['core_id'] for access in accesses], details,cycle)
+    denominator_tab  = miss_tab + hits_tab
+    denominator_tab[denominator_tab==0] = -1
+    ratios_tab = miss_tab/(denominator_tab)
+    ratios_tab[ratios_tab<0] = -1
+    return ratios_tab, ratios, miss_ratio_global
 
+# Add a new analysis function to detect contention
+def analyze_shared_resource_contention(context):
+    """Completes the online contention detection of ``context`` (see SimContext) and summarizes its events"""
+    context.finish_contention()
     return {
-        'l2_contention_cycles': sorted(list(l2_contention_cycles)),
-        'ddr_contention_cycles': sorted(list(ddr_contention_cycles)),
-        'total_contention_events': len(GlobalVar.shared_resource_events)
+        'l2_contention_cycles': sorted(set(event['cycle'] for event in context.l2_events)),
+        'ddr_contention_cycles': sorted(set(event['cycle'] for event in context.ddr_events)),
+        'total_contention_events': len(context.shared_resource_events)
     }
 
 # Example usage after simulation:
-def print_contention_analysis():
+def print_contention_analysis(context):
     """Print detailed analysis of shared resource contention"""
-    analysis = analyze_shared_resource_contention()
+    analysis = analyze_shared_resource_contention(context)
 
     print("\n=== SHARED RESOURCE CONTENTION ANALYSIS ===")
     print(f"Total contention events: {analysis['total_contention_events']}")
@@ -952,7 +1631,7 @@ def print_contention_analysis():
     print(f"DDR memory contention cycles: {len(analysis['ddr_contention_cycles'])}")
 
     print("\n=== DETAILED CONTENTION EVENTS ===")
-    for event in GlobalVar.shared_resource_events:
+    for event in context.shared_resource_events:
         print(f"Cycle {event['cycle']}: {event['type']}")
         print(f"  Cores involved: {event['initiators']}")
         print(f"  Details: {event['details']}")
@@ -15,6 +15,7 @@ import os
 from exploration.imgep.OptimizationPolicy import OptimizationPolicykNN as OP
 from exploration.imgep.goal_generator import GoalGenerator as G
 from exploration.imgep.imgep import IMGEP
+from exploration.seed import make_rngs
 
 
 
@@ -33,20 +34,22 @@ if __name__=="__main__":
         for k in k_values:
             print('k',k)
             print('segment mixing method', segment_method)
-            E =Env(300,num_addr=100)
+            rngs = make_rngs(0) # one seed for the whole run, see exploration/seed.py
+            E =Env(300,num_addr=100,seed=rngs['env'])
             H = History(env=E,capacity=N)
-            Pi = OP(num_mutations = num_mutations,k=k,
+            Pi = OP(num_mutations = num_mutations,k=k,rng=rngs['policy'],
                     segment_method=segment_method,
                     min_address_core0=min_address_core0,
                     max_address_core0=max_address_core0,
                     min_address_core1=min_address_core1,
                     max_address_core1=max_address_core0)
-            goal_generator = G()
+            goal_generator = G(rng=rngs['goal'])
             imgep = IMGEP(N,N_init,E,H,goal_generator,Pi, periode = periode,
                           min_address_core0=min_address_core0,
                           max_address_core0=max_address_core0,
                           min_address_core1=min_address_core1,
-                          max_address_core1=max_address_core1)
+                          max_address_core1=max_address_core1,
+                          rng=rngs['imgep'],random_rng=rngs['random'])
             imgep()
             s = 1 if segment_method else 0
             H.save_pickle(f'data_explor/imgep_run_{k}_{N}_s_{s}')
@@ -0,0 +1,227 @@
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import random
+import time
+import numpy as np
+from codegeneration import generate_instruction_sequence
+from exploration.env.func import Env
+from exploration.history import History, shared_resources2vec
+from exploration.random.func import RANDOM
+from exploration.imgep.imgep import IMGEP, AsyncIMGEP
+from exploration.imgep.OptimizationPolicy import OptimizationPolicykNN
+from exploration.imgep.goal_generator import GoalGenerator
+from exploration.seed import make_rngs
+from exploration.knn_index import SortedIndex, VectorIndex
+from exploration.bounds import Bounds
+
+def parameters(n, rng):
+    return [{'core0': generate_instruction_sequence(None, 60, 0, 50, rng=rng),
+             'core1': generate_instruction_sequence(None, 60, 49, 100, rng=rng)} for _ in range(n)]
+
+def assert_same_history(H, resumed, n):
+    assert len(resumed) == len(H) == n
+    assert resumed.memory_program == H.memory_program
+    assert resumed.columns == H.columns
+    assert np.array_equal(resumed.as_tab(), H.as_tab())
+    for key1 in H.memory_perf:
+        for key2, value in H.memory_perf[key1].items():
+            if key2 == 'shared_resource_events':
+                assert resumed.memory_perf[key1][key2] == value
+            else:
+                assert np.array_equal(resumed.memory_perf[key1][key2][:n], value[:n]), (key1, key2)
+    assert np.array_equal(resumed.reward_vec[:n], H.reward_vec[:n])
+    assert np.array_equal(resumed.alp_vec[:n], H.alp_vec[:n])
+    assert np.array_equal(resumed.diversity_vec, H.diversity_vec)
+    assert all(np.array_equal(a, b) for a, b in zip(resumed.hist_vec, H.hist_vec)) and len(resumed.hist_vec) == len(H.hist_vec)
+    assert np.array_equal(resumed.shared_resource_list, H.shared_resource_list)
+    assert np.array_equal(resumed.shared_resource_coords, H.shared_resource_coords)
+    for module in range(H.num_features()+1):
+        assert np.array_equal(resumed.bounds(module), H.bounds(module))
+
+# user-009: a History resumed from its store holds the state of the History that wrote it, and goes on like it
+def test_history_store_resume(tmp_path):
+    E = Env(300, num_addr=100)
+    H = History(env=E, capacity=100, path=str(tmp_path), flush_every=16)
+    RANDOM(40, E, H, 0, 50, 49, 100, rng=random.Random(9))()
+    # a chunk interrupted by a crash is dropped when the store is opened again
+    with open(tmp_path/'programs.jsonl', 'a') as f:
+        f.write('[[1, 0, 3]')
+    with open(tmp_path/'reward.f64', 'ab') as f:
+        f.write(np.zeros(3).tobytes())
+
+    resumed = History(env=E, capacity=100, path=str(tmp_path), flush_every=16)
+    assert resumed.resume() == 40
+    assert_same_history(H, resumed, 40)
+
+    H.storage = None # the resumed History alone goes on writing the store
+    new = parameters(20, random.Random(90))
+    for parameter, observation in zip(new, E.evaluate_many(new)):
+        H.store({'program': parameter} | observation)
+        resumed.store({'program': parameter} | observation)
+    assert_same_history(H, resumed, 60)
+    resumed.flush()
+    again = History(env=E, capacity=100, path=str(tmp_path))
+    assert again.resume() == 60
+    assert_same_history(H, again, 60)
+
+# user-023: the batch queries of the nearest neighbour indexes give the results of the single ones
+def test_query_many_matches_query():
+    rng = np.random.default_rng(23)
+    scalar, vector = SortedIndex(), VectorIndex()
+    for id_ in rng.permutation(500):
+        scalar.add(rng.integers(0, 40)/4, id_) # many ties in value and in distance
+        vector.add(rng.integers(0, 3, size=5)/2, id_)
+    scalar_goals = np.concatenate((rng.uniform(-2, 12, 50), rng.integers(-4, 48, 50)/4))
+    vector_goals = np.concatenate((rng.uniform(-1, 2, (50, 5)), rng.integers(-1, 4, (50, 5))/2))
+    for k in (1, 2, 5, 600):
+        assert scalar.query_many(scalar_goals, k) == [scalar.query(goal, k) for goal in scalar_goals]
+        assert scalar.query_many(scalar_goals[:3], k) == [scalar.query(goal, k) for goal in scalar_goals[:3]]
+        assert vector.query_many(vector_goals, k) == [vector.query(goal, k) for goal in vector_goals]
+
+# user-023: add stays independent of the number of stored ids, the arrays of query_many are built on demand
+def test_sorted_index_add_does_not_rebuild(monkeypatch):
+    builds = []
+    build = SortedIndex.build
+    monkeypatch.setattr(SortedIndex, 'build', lambda self: builds.append(1) or build(self))
+    index = SortedIndex()
+    values = np.random.default_rng(24).integers(0, 50, 200000)/2
+    def add(start, stop):
+        t = time.perf_counter()
+        for id_ in range(start, stop):
+            index.add(values[id_], id_)
+        return time.perf_counter()-t
+    small = add(0, 2000)
+    add(2000, 198000)
+    large = add(198000, 200000)
+    assert not builds
+    assert large < 5*small
+    goals = np.linspace(-1, 26, 20)
+    for k in (1, 3):
+        assert index.query_many(goals, k) == [index.query(goal, k) for goal in goals]
+    assert len(builds) == 1
+
+# Vector of one DDR contention event, as computed event by event before user-025
+def shared_resource2vec_loop(event, E):
+    count_banks = np.histogram(event['details']['banks'], bins=range(E.num_banks+1))[0]/len(event['details']['banks'])
+    count_rows = np.histogram(event['details']['rows'], bins=range(E.num_rows+1))[0]/len(event['details']['banks'])
+    ratios_core = np.array([sum(np.array(event['initiators'])==1)/len(event['initiators'])])
+    conflicts = np.array([1*event['details']['bank_conflicts'], 1*event['details']['row_conflicts']])
+    return np.concatenate((ratios_core, count_banks, count_rows, conflicts), axis=0)
+
+# user-025: the vectors of all the events at once are the vectors of the events one by one
+def test_shared_resources2vec_matches_loop():
+    E = Env(300, num_addr=100)
+    rng = np.random.default_rng(25)
+    assert shared_resources2vec([], E).shape == (0, 1+E.num_banks+E.num_rows+2)
+    for _ in range(50):
+        events = []
+        for _ in range(rng.integers(1, 40)):
+            n = int(rng.integers(1, 9))
+            addrs = rng.integers(0, 3, n) if rng.random() < 0.5 else rng.integers(0, 120, n) # repeated addresses
+            events.append({'type': 'DDR_MEMORY_CONTENTION', 'cycle': int(rng.integers(300)),
+                           'initiators': rng.integers(0, 2, int(rng.integers(1, 4))).tolist(),
+                           'details': {'banks': (addrs % E.num_banks).tolist(), 'rows': (addrs//16 - rng.integers(0, 2, n)).tolist(),
+                                       'bank_conflicts': bool(rng.integers(2)), 'row_conflicts': bool(rng.integers(2))}})
+        expected = np.array([shared_resource2vec_loop(event, E) for event in events])
+        assert np.array_equal(shared_resources2vec(events, E), expected)
+
+# user-004, user-008: the observations, rewards and ALP of a History are those of the definitions, recomputed from scratch
+def test_history_matches_brute_force():
+    E = Env(300, num_addr=100)
+    H = History(env=E, capacity=60)
+    RANDOM(40, E, H, 0, 50, 49, 100, rng=random.Random(8))()
+    outputs = E.evaluate_many([{'core0': core0, 'core1': core1} for core0, core1 in zip(H.memory_program['core0'], H.memory_program['core1'])])
+    keys = [(key1, key2) for key1 in ('mutual', 'core0', 'core1') for key2 in outputs[0][key1] if key2 != 'shared_resource_events']
+    tab = np.array([np.concatenate([np.array(out[key1][key2]).reshape(-1) for key1, key2 in keys]) for out in outputs])
+    assert np.array_equal(H.as_tab(), tab)
+    # histogram bin of every feature, 5 cycles or 5% wide (the ratios of the first sample are truncated first)
+    times = np.concatenate([np.full(np.size(outputs[0][key1][key2]), key2 in ('time_core0', 'time_core1')) for key1, key2 in keys])
+    bins = np.where(times, tab//5, np.concatenate(([tab[0].astype('int64')*100//5], 100*tab[1:]//5))).astype('int64')
+    bins = np.where(times, bins, bins % 21) # negative bins wrap around, as the indexes of the histograms
+    diversity = np.array([[len(set(bins[:j+1, i])) for i in range(tab.shape[1])] for j in range(len(tab))])
+    reward = np.zeros_like(tab)
+    reward[1:] = diversity[1:] - diversity[:-1]
+    alp = np.zeros_like(tab)
+    for j in range(1, len(tab)):
+        nearest = np.abs(tab[:j] - tab[j]).argmin(axis=0)
+        alp[j] = np.abs(reward[nearest, range(tab.shape[1])] - reward[j])
+    assert np.array_equal(H.reward_vec[:len(tab)], reward)
+    assert np.array_equal(H.alp_vec[:len(tab)], alp)
+    assert alp.any()
+
+# History of a short seeded exploration
+def explore(imgep=IMGEP, num_workers=None, **kwargs):
+    rngs = make_rngs(22)
+    E = Env(300, num_addr=100, seed=rngs['env'], num_workers=num_workers)
+    H = History(env=E, capacity=60)
+    Pi = OptimizationPolicykNN(num_mutations=1, k=2, min_address_core0=0, max_address_core0=50,
+                               min_address_core1=49, max_address_core1=100, rng=rngs['policy'])
+    try:
+        imgep(60, 20, E, H, GoalGenerator(rng=rngs['goal']), Pi, periode=1, min_address_core0=0, max_address_core0=50,
+              min_address_core1=49, max_address_core1=100, rng=rngs['imgep'], random_rng=rngs['random'], **kwargs)()
+    finally:
+        E.close()
+    return H
+
+# user-022: with one evaluation in flight the steady-state exploration is IMGEP, and the process pool changes nothing in ordered mode
+def test_async_imgep_matches_imgep():
+    tab = explore().as_tab()
+    assert np.array_equal(explore(AsyncIMGEP, in_flight=1).as_tab(), tab)
+    assert np.array_equal(explore(AsyncIMGEP, num_workers=2, in_flight=1).as_tab(), tab)
+    in_process = explore(AsyncIMGEP, in_flight=3).as_tab()
+    assert np.array_equal(explore(AsyncIMGEP, num_workers=2, in_flight=3).as_tab(), in_process)
+
+# Random updates of Bounds: nothing, one value or the bounds of a group of values
+def bounds_updates(n, rng, dim=4):
+    updates = []
+    for _ in range(n):
+        kind = rng.integers(3)
+        if kind==0:
+            updates.append((None, None))
+        elif kind==1:
+            updates.append((rng.integers(-5, 5, dim)/2, None)) # ties between values
+        else:
+            low = rng.normal(size=dim)
+            updates.append((low, low + rng.exponential(size=dim)))
+    return updates
+
+# user-024: the window bounds are the bounds of the values of the last updates, recomputed from scratch
+def test_window_bounds_match_brute_force():
+    rng = np.random.default_rng(24)
+    for window in (1, 2, 3, 7, 50):
+        bounds = Bounds('window', window=window)
+        updates = bounds_updates(300, rng)
+        expected = (None, None)
+        for t, (low, high) in enumerate(updates):
+            bounds.update(low, high)
+            values = [(low, low if high is None else high) for low, high in updates[max(t+1-window, 0):t+1] if low is not None]
+            if values:
+                expected = (np.min([low for low, _ in values], axis=0), np.max([high for _, high in values], axis=0))
+            if expected[0] is None:
+                assert bounds.low is None and bounds.high is None
+            else:
+                assert np.array_equal(bounds.low, expected[0]) and np.array_equal(bounds.high, expected[1]), (window, t)
+
+# user-024: the decayed bounds expand to every new value and contract towards the latest ones
+def test_decay_bounds():
+    bounds = Bounds('decay', decay=0.5)
+    bounds.update(None)
+    assert bounds.low is None
+    for value, low, high in ((0., 0., 0.), (10., 5., 10.), (5., 5., 7.5), (6., 5.5, 6.75), (-1., -1., 2.875)):
+        bounds.update([value])
+        assert bounds.low.tolist() == [low] and bounds.high.tolist() == [high], value
+    bounds.update([1.], [2.])
+    assert bounds.low.tolist() == [0.] and bounds.high.tolist() == [2.4375]
+    rng = np.random.default_rng(240)
+    bounds = Bounds('decay', decay=0.9)
+    low = high = None
+    for value, group_high in bounds_updates(300, rng):
+        bounds.update(value, group_high)
+        if value is None:
+            continue
+        group_high = value if group_high is None else group_high
+        low = value if low is None else np.minimum(value, value + 0.9*(low - value))
+        high = group_high if high is None else np.maximum(group_high, group_high + 0.9*(high - group_high))
+        assert np.array_equal(bounds.low, low) and np.array_equal(bounds.high, high)
+    assert np.all(bounds.low <= bounds.high)
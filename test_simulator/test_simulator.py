@@ -1 +1,209 @@
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import random
+import threading
 import numpy as np
+from codegeneration import generate_instruction_sequence
+from exploration.env.func import Env, Experiment, assert_same_output
+from exploration.imgep.mutation import mutate_instruction_sequence
+from simulator.batch import BatchExperiment
+from simulator.sim3 import TRACE_LEVELS, DDRMemoryController, PLRUTable, PLRUWalk, plru_table
+
+# Random pairs of programs, core0 and core1 on disjoint address ranges but sharing the L2 and the DDR
+def random_pairs(n, seed, max_cycle=60):
+    rng = random.Random(seed)
+    return [(generate_instruction_sequence(None, max_cycle, 0, 50, rng=rng),
+             generate_instruction_sequence(None, max_cycle, 49, 100, rng=rng)) for _ in range(n)]
+
+def assert_same(a, b, path=''):
+    if isinstance(a, dict):
+        assert set(a) == set(b), path
+        for key in a:
+            assert_same(a[key], b[key], f'{path}/{key}')
+    elif isinstance(a, (list, tuple)):
+        assert len(a) == len(b), path
+        for i, (x, y) in enumerate(zip(a, b)):
+            assert_same(x, y, f'{path}[{i}]')
+    elif isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        assert np.array_equal(np.asarray(a), np.asarray(b)), path
+    else:
+        assert a == b, (path, a, b)
+
+def simulate(core0, core1, seed, cycles=300, trace='contention', **kwargs):
+    return run(core0, core1, seed, cycles, trace, **kwargs)[0]
+
+# Outputs and Experiment of a simulation
+def run(core0, core1, seed, cycles=300, trace='contention', **kwargs):
+    experiment = Experiment(num_addr=100, rng=np.random.default_rng(seed), trace=trace)
+    experiment.load_instr(core0, core1)
+    return experiment.simulate(cycles, **kwargs), experiment
+
+# Records of the L2 and DDR access logs and of the stages of the DDR controller requests
+def traces(experiment):
+    context = experiment.context
+    return [list(context.l2_trace), list(context.ddr_trace), list(context.stage_trace)]
+
+# user-005: the lockstep batch engine gives the outputs of Experiment, program pair by program pair
+def test_batch_matches_experiment():
+    pairs = random_pairs(200, seed=5)
+    core0 = [c0 for c0, _ in pairs] + [c0 for c0, _ in pairs] + [{} for _ in pairs]
+    core1 = [c1 for _, c1 in pairs] + [{} for _ in pairs] + [c1 for _, c1 in pairs]
+    batch = BatchExperiment(num_addr=100, trace='contention')
+    batch.load_instr(core0, core1)
+    outputs = batch.simulate(300, rngs=[np.random.default_rng(i) for i in range(len(core0))])
+    for i, output in enumerate(outputs):
+        assert_same(simulate(core0[i], core1[i], i, event_driven=True), output, f'pair {i}')
+
+# user-001: jumping between events gives the outputs, traces included, of the cycle by cycle simulation
+def test_event_driven_matches_ticks():
+    for i, (core0, core1) in enumerate(random_pairs(50, seed=1)):
+        ticks, tick_experiment = run(core0, core1, i, trace='full', event_driven=False)
+        events, event_experiment = run(core0, core1, i, trace='full', event_driven=True)
+        assert_same(ticks, events, f'pair {i}')
+        assert_same(traces(tick_experiment), traces(event_experiment), f'traces of pair {i}')
+
+# user-013: stopping once the system is quiescent does not change the outputs of the full simulation
+def test_quiescent_stop_matches_full_run():
+    for i, (core0, core1) in enumerate(random_pairs(50, seed=13)):
+        for event_driven in (False, True):
+            full, full_experiment = run(core0, core1, i, cycles=1000, trace='full', event_driven=event_driven)
+            stopped, stopped_experiment = run(core0, core1, i, cycles=1000, trace='full', event_driven=event_driven, stop_when_quiescent=True)
+            assert_same(full, stopped, f'pair {i}')
+            assert_same(traces(full_experiment), traces(stopped_experiment), f'traces of pair {i}')
+
+def test_quiescent_stop_skips_the_idle_tail():
+    core0, core1 = random_pairs(1, seed=13)[0]
+    experiment = Experiment(num_addr=100, rng=np.random.default_rng(0))
+    experiment.load_instr(core0, core1)
+    ticks = []
+    tick = experiment.core0.tick
+    experiment.core0.tick = lambda: ticks.append(1) or tick()
+    experiment.simulate(1000, stop_when_quiescent=True)
+    assert len(ticks) < 1000 and experiment.context.global_cycle == 1000
+
+# user-021: resuming mutated children from the snapshots of their parents gives the outputs of a fresh Env
+def test_prefix_sharing_matches_fresh_env(monkeypatch):
+    restores = []
+    restore = Experiment.restore
+    monkeypatch.setattr(Experiment, 'restore', lambda self, state: restores.append(state) or restore(self, state))
+    rng = random.Random(21)
+    shared = Env(300, num_addr=100, prefix_sharing=True)
+    for core0, core1 in random_pairs(20, seed=21):
+        parameters = [{'core0': core0, 'core1': core1}]
+        for _ in range(4):
+            parameters.append({'core0': mutate_instruction_sequence(core0, max_cycle=60, min_address=0, max_address=50, rng=rng),
+                               'core1': core1})
+        for parameter in parameters:
+            out = shared(parameter)
+            assert_same_output(out, Env(300, num_addr=100, prefix_sharing=True)(parameter))
+    assert len(restores) >= 20
+
+# user-014: Envs running in different threads do not share their warm Experiment
+def test_envs_in_threads_match_serial_runs():
+    parameters = [{'core0': core0, 'core1': core1} for core0, core1 in random_pairs(30, seed=14)]
+    serial = [Env(300, num_addr=100)(parameter) for parameter in parameters]
+    outputs = [None]*4
+    def explore(thread):
+        env = Env(300, num_addr=100)
+        outputs[thread] = [env(parameter) for parameter in parameters]
+    threads = [threading.Thread(target=explore, args=(thread,)) for thread in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for thread_outputs in outputs:
+        assert thread_outputs is not None
+        for out, reference in zip(thread_outputs, serial):
+            assert_same_output(out, reference)
+
+# Requests the FR-FCFS scheduler of the baseline considers, taken in the
+# order of the controller heap and sorted by priority
+def baseline_candidates(controller):
+    ddr = controller.ddr
+    candidates = [req for _, req in controller.queue
+                  if controller.bank_precharge_complete_time[ddr._get_bank(req.addr)] <= controller.cycle
+                  and controller.cycle >= controller.last_command_time.get(ddr._get_bank(req.addr), -controller.tRC) + controller.tCCD]
+    candidates.sort(key=lambda req: (0 if controller.bank_open_row[ddr._get_bank(req.addr)] == ddr._get_row(req.addr) else 1,
+                                     0 if req.req_type == 'read' else 1, req.time))
+    return candidates
+
+# user-011: the per bank queues of the controller schedule the requests the baseline scheduler picks, in the same order
+def test_bank_queues_match_baseline_scheduler(monkeypatch):
+    schedules = []
+    schedule = DDRMemoryController._schedule_next_request
+    def checked_schedule(self):
+        expected = baseline_candidates(self)
+        queued = [req for _, req in self.queue]
+        output = schedule(self)
+        scheduled = [req for req in queued if all(req is not other for _, other in self.queue)]
+        assert scheduled == expected[:1]
+        if output is not None and output['candidates'] is not None:
+            assert all(a is b for a, b in zip(output['candidates'], expected)) and len(output['candidates']) == len(expected)
+        schedules.append(len(expected))
+        return output
+    monkeypatch.setattr(DDRMemoryController, '_schedule_next_request', checked_schedule)
+    for i, (core0, core1) in enumerate(random_pairs(200, seed=11)):
+        run(core0, core1, i, trace='full' if i % 2 else 'off', event_driven=bool(i % 3))
+    assert sum(n > 1 for n in schedules) > 100
+
+# user-016: the PLRU tables make the decisions of the tree walk
+def test_plru_tables_match_tree_walk():
+    for ways in range(1, 17):
+        table, walk = PLRUTable(ways), PLRUWalk(ways)
+        states = np.arange(1 << (ways - 1))
+        assert np.array_equal(table.get_victims(states), walk.get_victims(states)), ways
+        for way in range(ways):
+            blocks = np.full_like(states, way)
+            assert np.array_equal(table.update_on_accesses(states, blocks), walk.update_on_accesses(states, blocks)), (ways, way)
+        for state in range(0, len(states), 37):
+            assert table.get_victim(state) == walk.get_victim(state)
+            assert all(table.update_on_access(state, way) == walk.update_on_access(state, way) for way in range(ways))
+
+# user-016: caches of more than 16 ways walk the PLRU trees, in every implementation
+def test_wide_caches_walk_the_plru_tree():
+    assert isinstance(plru_table(32), PLRUWalk)
+    rng = random.Random(16)
+    pairs = [(generate_instruction_sequence(None, 60, 0, 300, rng=rng),
+              generate_instruction_sequence(None, 60, 250, 600, rng=rng)) for _ in range(20)]
+    for assoc in (32, 128):
+        l2_conf = {'size': 128, 'line_size': 1, 'assoc': assoc} # fewer lines than addresses, victims are evicted
+        batch = BatchExperiment(num_addr=600, l2_conf=l2_conf)
+        batch.load_instr([c0 for c0, _ in pairs], [c1 for _, c1 in pairs])
+        outputs = batch.simulate(300, rngs=[np.random.default_rng(i) for i in range(len(pairs))])
+        for i, (core0, core1) in enumerate(pairs):
+            for impl in ('object', 'array'):
+                experiment = Experiment(num_addr=600, rng=np.random.default_rng(i), trace='contention',
+                                        l2_conf=dict(l2_conf, impl=impl))
+                experiment.load_instr(core0, core1)
+                assert_same(experiment.simulate(300), outputs[i], f'pair {i}, {assoc} ways, {impl}')
+
+# user-015: the array cache levels behave like the object ones, statistics and traces included
+def test_array_cache_levels_match_object_ones():
+    configs = [({'size': 32, 'line_size': 4, 'assoc': 2}, {'size': 512, 'line_size': 4, 'assoc': 16}),
+               ({'size': 16, 'line_size': 2, 'assoc': 4}, {'size': 64, 'line_size': 2, 'assoc': 8}),
+               ({'size': 8, 'line_size': 1, 'assoc': 1}, {'size': 48, 'line_size': 4, 'assoc': 3})]
+    for i, (core0, core1) in enumerate(random_pairs(60, seed=15)):
+        l1_conf, l2_conf = configs[i % len(configs)]
+        runs = []
+        for impl in ('object', 'array'):
+            experiment = Experiment(num_addr=100, rng=np.random.default_rng(i), trace='full',
+                                    l1_conf=dict(l1_conf, impl=impl), l2_conf=dict(l2_conf, impl=impl))
+            experiment.load_instr(core0, core1)
+            output = experiment.simulate(300, event_driven=bool(i % 2))
+            runs.append((output, traces(experiment), experiment.mem_core0.stats(), experiment.mem_core1.stats()))
+        assert_same(runs[0], runs[1], f'pair {i}')
+
+# user-002, user-017, user-019: the process pool gives the observations of the serial Env, at every trace level
+def test_evaluate_many_in_pool_matches_serial_env():
+    parameters = [{'core0': core0, 'core1': core1} for core0, core1 in random_pairs(6, seed=2)]
+    for trace in TRACE_LEVELS:
+        serial = Env(300, num_addr=100, trace=trace, seed=3)
+        pooled = Env(300, num_addr=100, trace=trace, seed=3, num_workers=2)
+        try:
+            outputs = pooled.evaluate_many(parameters)
+        finally:
+            pooled.close()
+        assert len(outputs) == len(parameters)
+        for parameter, out in zip(parameters, outputs):
+            assert_same_output(out, serial(parameter))